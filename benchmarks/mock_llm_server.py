@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+
+# deterministic openai compatible stub for offline benchmarks. answers /chat/completions with a payload
+# generated from the request's json schema (Solution, MetricEvaluation, RelevanceSimilarity, ...), with
+# configurable latency, server error rate and 429 injection. streams (stream=true) come back as sse chunks with the
+# latency split into time to first token and generation time, and malformed_rate breaks the json of some answers.
+
+WORDS = ["force", "energy", "velocity", "integral", "moles", "equilibrium", "derivative", "momentum", "charge", "matrix", "entropy", "limit", "reaction", "vector", "pressure", "theorem"]
+
+def generate_text(rng, num_words):
+    return " ".join(rng.choice(WORDS) for _ in range(num_words))
+
+def generate_from_schema(schema, defs, rng, solution_words, field_name=None, solution_rng=None):
+    if "$ref" in schema:
+        return generate_from_schema(defs[schema["$ref"].split("/")[-1]], defs, rng, solution_words, field_name, solution_rng)
+    if "anyOf" in schema:
+        options = [option for option in schema["anyOf"] if option.get("type") != "null"]
+        return generate_from_schema(options[0], defs, rng, solution_words, field_name, solution_rng)
+    if "allOf" in schema:
+        return generate_from_schema(schema["allOf"][0], defs, rng, solution_words, field_name, solution_rng)
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+
+    schema_type = schema.get("type")
+    if schema_type == "object":
+        return {name: generate_from_schema(prop, defs, rng, solution_words, name, solution_rng) for name, prop in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        count = max(schema.get("minItems", 1), rng.randint(1, 4))
+        return [generate_from_schema(schema.get("items", {}), defs, rng, solution_words) for _ in range(count)]
+    if schema_type in ("number", "integer"):
+        low = schema.get("minimum", 0.0)
+        high = schema.get("maximum", 1.0)
+        return rng.randint(int(low), int(high)) if schema_type == "integer" else round(rng.uniform(low, high), 2)
+    if schema_type == "boolean":
+        return rng.random() < 0.5
+    if field_name == "generated_solution":
+        # solutions end with a final answer line like real ones, so answer extraction has something to work on
+        rng = solution_rng or rng
+        return f"{generate_text(rng, solution_words)}\nFinal answer: {rng.randint(1, 5)}"
+    return generate_text(rng, 12)
+
+class MockLLMServer():
+    # minimal asyncio http/1.1 server with keep-alive, a thread per connection server can't keep up
+    # with a client running hundreds of concurrent requests
+    def __init__(self, latency=0.2, latency_jitter=0.05, error_rate=0.0, rate_limit_rate=0.0, retry_after=0.1, solution_words=120, seed=0, identical_solution_rate=0.0, malformed_rate=0.0, ttft_share=0.2, stream_chunk_chars=16):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.solution_words = solution_words
+        self.seed = seed
+        # share of questions whose solutions come out the same with and without similar questions,
+        # lets the judge pre-filter be benchmarked
+        self.identical_solution_rate = identical_solution_rate
+        # share of structured answers sent with a missing comma after the first value, and for streams the part of
+        # the latency spent before the first chunk and the size of the chunks
+        self.malformed_rate = malformed_rate
+        self.ttft_share = ttft_share
+        self.stream_chunk_chars = stream_chunk_chars
+        self.counter = 0
+        # cachedContents entries created through the context cache endpoint, name -> system prompt
+        self.cached_contents = {}
+
+    def respond(self, writer, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error"}[status]
+        head = [f"HTTP/1.1 {status} {reason}", "Content-Type: application/json", f"Content-Length: {len(body)}"]
+        head += [f"{key}: {value}" for key, value in (headers or {}).items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    key, value = line.decode("latin-1").split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if method == "GET" and path.rstrip("/").endswith("health"):
+                    self.respond(writer, 200, {"status": "ok"})
+                elif method == "POST" and path.rstrip("/").endswith("chat/completions"):
+                    await self.chat_completion(writer, json.loads(body or b"{}"))
+                elif method == "POST" and path.rstrip("/").endswith("cachedContents"):
+                    self.create_cached_content(writer, json.loads(body or b"{}"))
+                elif method == "DELETE" and "cachedContents/" in path:
+                    self.cached_contents.pop("cachedContents/" + path.rsplit("/", 1)[-1], None)
+                    self.respond(writer, 200, {})
+                else:
+                    self.respond(writer, 404, {"error": {"message": "not found"}})
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def create_cached_content(self, writer, request):
+        name = f"cachedContents/mock-{len(self.cached_contents) + 1}"
+        self.cached_contents[name] = "".join(part.get("text", "") for part in request.get("systemInstruction", {}).get("parts", []))
+        self.respond(writer, 200, {"name": name, "model": request.get("model")})
+
+    async def chat_completion(self, writer, request):
+        self.counter += 1
+        fault_rng = random.Random(f"{self.seed}:{self.counter}")
+        latency = max(0.0, fault_rng.gauss(self.latency, self.latency_jitter))
+        stream = bool(request.get("stream"))
+        await asyncio.sleep(latency * self.ttft_share if stream else latency)
+
+        fault = fault_rng.random()
+        if fault < self.rate_limit_rate:
+            self.respond(writer, 429, {"error": {"message": "mock rate limit", "type": "rate_limit_error"}}, {"Retry-After": str(self.retry_after)})
+            return
+        if fault < self.rate_limit_rate + self.error_rate:
+            self.respond(writer, 500, {"error": {"message": "mock server error", "type": "server_error"}})
+            return
+
+        # gemini's openai endpoint takes its own options nested under extra_body.google
+        cached_name = ((request.get("extra_body") or {}).get("google") or {}).get("cached_content")
+        if cached_name is not None and cached_name not in self.cached_contents:
+            self.respond(writer, 400, {"error": {"message": f"unknown cached content {cached_name}", "type": "invalid_request_error"}})
+            return
+        cached_prompt = self.cached_contents.get(cached_name, "")
+        messages = ([{"role": "system", "content": cached_prompt}] if cached_name else []) + request.get("messages", [])
+
+        # content only depends on the request, so identical requests always get identical answers,
+        # whether the system prompt came inline or from a cached content entry
+        request_key = json.dumps({"messages": messages, "response_format": request.get("response_format")}, sort_keys=True)
+        rng = random.Random(hashlib.sha256(f"{self.seed}:{request_key}".encode("utf-8")).hexdigest())
+
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"]["schema"]
+            content = json.dumps(generate_from_schema(schema, schema.get("$defs", {}), rng, self.solution_words, solution_rng=self.solution_rng(messages)))
+            if fault_rng.random() < self.malformed_rate:
+                content = content.replace('", "', '" "', 1) if '", "' in content else content[:len(content) // 2]
+        else:
+            content = generate_text(rng, 40)
+
+        prompt_tokens = sum(len(message.get("content") or "") for message in messages) // 4
+        cached_tokens = len(cached_prompt) // 4
+        completion_tokens = len(content) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens, "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        if stream:
+            await self.stream_completion(writer, request, content, usage, latency * (1 - self.ttft_share))
+            return
+        self.respond(writer, 200, {
+            "id": f"mock-{self.counter}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage
+        })
+
+    async def stream_completion(self, writer, request, content, usage, generation_time):
+        # chunked transfer encoding keeps the connection reusable. a client that hangs up mid stream makes drain()
+        # raise, which ends the generation like a real endpoint would
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        pieces = [content[start:start + self.stream_chunk_chars] for start in range(0, len(content), self.stream_chunk_chars)] or [""]
+        base = {"id": f"mock-{self.counter}", "object": "chat.completion.chunk", "created": int(time.time()), "model": request.get("model", "mock")}
+
+        async def send(payload):
+            data = f"data: {payload if isinstance(payload, str) else json.dumps(payload)}\n\n".encode("utf-8")
+            writer.write(f"{len(data):X}\r\n".encode("latin-1") + data + b"\r\n")
+            await writer.drain()
+
+        for idx, piece in enumerate(pieces):
+            if idx:
+                await asyncio.sleep(generation_time / len(pieces))
+            finish_reason = "stop" if idx == len(pieces) - 1 else None
+            await send({**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": finish_reason}]})
+        if (request.get("stream_options") or {}).get("include_usage"):
+            await send({**base, "choices": [], "usage": usage})
+        await send("[DONE]")
+        writer.write(b"0\r\n\r\n")
+
+    def solution_rng(self, messages):
+        # solutions are seeded on the main question alone for identical_solution_rate of the questions
+        user_message = next((message.get("content") or "" for message in messages if message.get("role") == "user"), "")
+        if "<MAIN_QUESTION>" not in user_message:
+            return None
+        main_question = user_message.split("<MAIN_QUESTION>", 1)[1].split("</MAIN_QUESTION>", 1)[0]
+        digest = hashlib.sha256(f"{self.seed}:{main_question}".encode("utf-8")).hexdigest()
+        if int(digest[:8], 16) / 0xFFFFFFFF >= self.identical_solution_rate:
+            return None
+        return random.Random(digest)
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=4096)
+        print(f"========= Mock LLM server listening on http://{host}:{port}/ =========", flush=True)
+        async with server:
+            await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic OpenAI compatible mock LLM server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean response latency in seconds.")
+    parser.add_argument("--latency-jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with a 429.")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After seconds sent with injected 429s.")
+    parser.add_argument("--solution-words", type=int, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--identical-solution-rate", type=float, default=0.0, help="Fraction of questions whose with/without similar solutions are identical.")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of structured answers sent as invalid json.")
+    parser.add_argument("--ttft-share", type=float, default=0.2, help="Part of the latency a stream waits before its first chunk.")
+    args = parser.parse_args()
+    server = MockLLMServer(args.latency, args.latency_jitter, args.error_rate, args.rate_limit_rate, args.retry_after, args.solution_words, args.seed, args.identical_solution_rate, args.malformed_rate, args.ttft_share)
+    asyncio.run(server.serve(args.host, args.port))
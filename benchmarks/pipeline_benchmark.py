@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+# offline throughput benchmark. starts the mock llm server in its own process, then runs the pipeline on
+# synthetic datasets of each size in a fresh process (so peak memory is per size) and reports questions/sec.
+#
+#   python -m benchmarks.pipeline_benchmark --sizes 100 1000 10000 --concurrency 64 --latency 0.2
+
+RESULT_PREFIX = "BENCHMARK_RESULT "
+SUBJECTS = ["PHYSICS", "MATHS", "CHEMISTRY"]
+
+def make_synthetic_dataset(size, num_similar=3):
+    return [
+        {
+            "question_id": f"synthetic_{idx}",
+            "subject": SUBJECTS[idx % len(SUBJECTS)],
+            "question_text": f"Synthetic question {idx}: a body of mass {idx % 17 + 1} kg moves with velocity {idx % 11 + 2} m/s. Find its kinetic energy.",
+            "similar_questions": [
+                {
+                    "similar_question_text": f"Similar question {idx}.{sim_idx}: find the kinetic energy of a {sim_idx + 2} kg body at {sim_idx + 3} m/s.",
+                    "summarized_solution_approach": "Use KE = 1/2 m v^2 and substitute the given values."
+                }
+                for sim_idx in range(num_similar)
+            ]
+        }
+        for idx in range(size)
+    ]
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+async def run_pipeline(dataset, reports_dir, args):
+    # imported here so the child process picks up the mock server env before the client is built
+    from core.relevance_evaluator import RelevanceEvaluator
+    from core.solution_builder import SolutionBuilder
+    from core.comparative_analyzer import ComparativeAnalyzer
+    from core.pipeline import Pipeline
+    from helpers.scheduler import Scheduler
+
+    scheduler = Scheduler(concurrency=args.concurrency)
+    if args.mode == "pipelined":
+        await Pipeline(dataset, reports_dir, scheduler=scheduler, judge_mode=args.judge_mode, relevance_mode=args.relevance_mode, resume=False, judge_early_exit=args.early_exit, judge_position_swap=args.position_swap).run()
+    else:
+        await RelevanceEvaluator(dataset, reports_dir, scheduler=scheduler, resume=False, relevance_mode=args.relevance_mode).evaluate()
+        solutions_without_similar, solutions_with_similar = await SolutionBuilder(dataset, reports_dir, scheduler=scheduler, resume=False).build_solution()
+        analyzer = ComparativeAnalyzer(dataset, solutions_with_similar, solutions_without_similar, reports_dir, scheduler=scheduler, resume=False, judge_mode=args.judge_mode, early_exit=args.early_exit, position_swap=args.position_swap)
+        await analyzer.analyze()
+
+async def run_one(size, args):
+    from helpers.telemetry import configure_telemetry
+    from helpers.rate_limiter import get_rate_limiter
+
+    dataset = make_synthetic_dataset(size)
+    passes = ["cold", "warm"] if args.cache else ["cold"]
+    results = []
+    for run in passes:
+        telemetry = configure_telemetry()
+        with tempfile.TemporaryDirectory() as reports_dir:
+            started = time.perf_counter()
+            await run_pipeline(dataset, reports_dir, args)
+            elapsed = time.perf_counter() - started
+        summary = telemetry.summary()
+        calls = sum(stage["calls"] for stage in summary["stages"].values())
+        cache_hits = sum(stage["cache_hits"] for stage in summary["stages"].values())
+        results.append({
+            "size": size,
+            "run": run,
+            "mode": args.mode,
+            "concurrency": args.concurrency,
+            "seconds": elapsed,
+            "questions_per_s": size / elapsed,
+            "calls": calls,
+            "cache_hits": cache_hits,
+            "calls_per_s": calls / elapsed,
+            "prompt_tokens": sum(stage["prompt_tokens"] for stage in summary["stages"].values()),
+            "cached_prompt_tokens": sum(stage["cached_prompt_tokens"] for stage in summary["stages"].values()),
+            "completion_tokens": sum(stage["completion_tokens"] for stage in summary["stages"].values()),
+            "stream_aborts": sum(stage["stream_aborts"] for stage in summary["stages"].values()),
+            "rate_limited": get_rate_limiter().stats()["rate_limited"],
+            "peak_rss_mb": peak_rss_mb()
+        })
+    return results
+
+def wait_for_server(base_url, timeout=15.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(base_url.rstrip("/") + "/health", timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Mock server at {base_url} did not come up.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline pipeline throughput benchmark against the mock LLM server.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--mode", choices=["staged", "pipelined"], default="staged")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--judge-mode", choices=["per_metric", "combined"], default="per_metric")
+    parser.add_argument("--relevance-mode", choices=["separate", "fused"], default="separate")
+    parser.add_argument("--cache", action="store_true", help="Enable the response cache and report a cold and a warm pass.")
+    parser.add_argument("--context-cache", action="store_true", help="Enable explicit context caching of system prompts against the mock server.")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--identical-solution-rate", type=float, default=0.0, help="Share of questions the mock answers identically with and without similar questions.")
+    parser.add_argument("--early-exit", action="store_true", help="Skip or shrink the judge sweep for pairs with the same final answer.")
+    parser.add_argument("--position-swap", action="store_true", help="Judge every pair in both orders.")
+    parser.add_argument("--stream", action="store_true", help="Stream structured responses and abort malformed ones early.")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of structured answers the mock sends as invalid json.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--base-url", default=None, help="Use an already running mock server instead of starting one.")
+    parser.add_argument("--output", default=None, help="Write the results as json here.")
+    parser.add_argument("--run-one", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        for result in asyncio.run(run_one(args.run_one, args)):
+            print(RESULT_PREFIX + json.dumps(result), flush=True)
+        return
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        base_url = f"http://127.0.0.1:{args.port}/v1/"
+        server = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.mock_llm_server", "--port", str(args.port), "--latency", str(args.latency),
+             "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate), "--identical-solution-rate", str(args.identical_solution_rate),
+             "--malformed-rate", str(args.malformed_rate)],
+            stdout=subprocess.DEVNULL
+        )
+    results = []
+    try:
+        wait_for_server(base_url)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for size in args.sizes:
+                # fresh cache per size, otherwise larger sizes would hit on the smaller sizes' questions
+                env = {
+                    **os.environ,
+                    "LLM_BASE_URL": base_url,
+                    "GEMINI_API_KEY": "mock-key",
+                    "LLM_CACHE_PATH": os.path.join(cache_dir, f"benchmark_cache_{size}.sqlite"),
+                    "LLM_CACHE_DISABLED": "false" if args.cache else "true",
+                    "LLM_CONTEXT_CACHE": "true" if args.context_cache else "false",
+                    "LLM_CONTEXT_CACHE_URL": base_url + "cachedContents",
+                    # the benchmark prompts are short, cache them all
+                    "LLM_CONTEXT_CACHE_MIN_TOKENS": "0",
+                    "LLM_STREAMING": "true" if args.stream else "false",
+                    "TQDM_DISABLE": "1"
+                }
+                command = [sys.executable, "-m", "benchmarks.pipeline_benchmark", "--run-one", str(size), "--mode", args.mode,
+                           "--concurrency", str(args.concurrency), "--judge-mode", args.judge_mode, "--relevance-mode", args.relevance_mode]
+                if args.cache:
+                    command.append("--cache")
+                if args.early_exit:
+                    command.append("--early-exit")
+                if args.position_swap:
+                    command.append("--position-swap")
+                completed = subprocess.run(command, env=env, capture_output=True, text=True)
+                if completed.returncode != 0:
+                    print(completed.stderr[-2000:])
+                    raise RuntimeError(f"Benchmark run for {size} questions failed.")
+                for line in completed.stdout.splitlines():
+                    if line.startswith(RESULT_PREFIX):
+                        result = json.loads(line[len(RESULT_PREFIX):])
+                        results.append(result)
+                        print(f"{result['size']:>6} questions [{result['run']}] | {result['seconds']:8.1f}s | {result['questions_per_s']:8.1f} q/s | {result['calls_per_s']:8.1f} calls/s | {result['cache_hits']} cache hits | {result['cached_prompt_tokens']}/{result['prompt_tokens']} prompt tokens cached | {result['completion_tokens']} completion tokens | {result['stream_aborts']} streams aborted | {result['rate_limited']} 429s | peak {result['peak_rss_mb']:.0f} MB", flush=True)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
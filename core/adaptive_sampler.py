@@ -0,0 +1,112 @@
+import random
+import numpy as np
+from helpers.stats import stratified_bootstrap_mean_ci
+
+class AdaptiveSampler():
+    # evaluates a dataset in batches until the average score is known well enough. questions are drawn stratified
+    # by subject, every batch keeps each subject's share of the sample close to its share of the dataset, and the
+    # average score is estimated as a stratified mean with a bootstrap confidence interval. sampling stops once the
+    # interval is narrower than target_ci_width, the call budget can't fit another batch or the dataset runs out.
+    def __init__(self, dataset, batch_size=50, target_ci_width=0.1, max_calls=None, min_per_subject=2, confidence=0.95, bootstrap_samples=1000, seed=0):
+        self.batch_size = batch_size
+        self.target_ci_width = target_ci_width
+        self.max_calls = max_calls
+        self.min_per_subject = min_per_subject
+        self.confidence = confidence
+        self.bootstrap_samples = bootstrap_samples
+
+        # subject -> its questions in a seeded random order, batches are taken off the front
+        rng = random.Random(seed)
+        self.strata = {}
+        for data in dataset:
+            self.strata.setdefault(data['subject'], []).append(data)
+        for questions in self.strata.values():
+            rng.shuffle(questions)
+        self.population = sum(len(questions) for questions in self.strata.values())
+        self.taken = {subject: 0 for subject in self.strata}
+        self.scores = {subject: [] for subject in self.strata}
+        self.sampled = []
+        self.history = []
+        self.stop_reason = None
+
+    def next_batch(self, calls_used=0):
+        # the next questions to evaluate, empty once sampling should stop. with a call budget the batch shrinks to
+        # what the calls per question so far say it can afford
+        if self.stop_reason is not None:
+            return []
+        size = min(self.batch_size, self.population - len(self.sampled))
+        if self.max_calls is not None and self.sampled:
+            calls_per_question = calls_used / len(self.sampled)
+            if calls_per_question > 0:
+                size = min(size, int((self.max_calls - calls_used) // calls_per_question))
+        if size <= 0:
+            self.stop_reason = "exhausted" if len(self.sampled) == self.population else "budget"
+            return []
+
+        batch = []
+        for _ in range(size):
+            # proportional allocation, the subject furthest behind its share of the sample goes next
+            total = len(self.sampled) + len(batch) + 1
+            subject = max(
+                (subject for subject, questions in self.strata.items() if self.taken[subject] < len(questions)),
+                key=lambda subject: total * len(self.strata[subject]) / self.population - self.taken[subject]
+            )
+            batch.append(self.strata[subject][self.taken[subject]])
+            self.taken[subject] += 1
+        self.sampled.extend(batch)
+        return batch
+
+    def update(self, question_scores, calls_used=0):
+        # question_scores: question_id -> average score of the questions just evaluated. returns True when sampling
+        # can stop
+        subjects = {data['question_id']: data['subject'] for data in self.sampled}
+        for question_id, score in question_scores.items():
+            self.scores[subjects[question_id]].append(score)
+
+        mean, ci_low, ci_high = self.estimate()
+        self.history.append({
+            "questions": len(self.sampled),
+            "calls": calls_used,
+            "mean_score": mean,
+            "ci_low": ci_low,
+            "ci_high": ci_high,
+            "ci_width": None if ci_low is None else ci_high - ci_low
+        })
+        # a subject with too few scored questions has no say in the interval yet, so it can't end sampling
+        covered = all(len(self.scores[subject]) >= min(self.min_per_subject, len(questions)) for subject, questions in self.strata.items())
+        if len(self.sampled) == self.population:
+            self.stop_reason = "exhausted"
+        elif covered and ci_low is not None and ci_high - ci_low <= self.target_ci_width:
+            self.stop_reason = "ci_width"
+        elif self.max_calls is not None and calls_used >= self.max_calls:
+            self.stop_reason = "budget"
+        return self.stop_reason is not None
+
+    def estimate(self):
+        # stratified mean score and its confidence interval, each subject weighs its share of the dataset
+        subjects = [subject for subject in self.strata if self.scores[subject]]
+        if not subjects:
+            return None, None, None
+        weights = np.array([len(self.strata[subject]) for subject in subjects], dtype=float)
+        means = np.array([np.mean(self.scores[subject]) for subject in subjects])
+        mean = float(means @ weights / weights.sum())
+        ci_low, ci_high = stratified_bootstrap_mean_ci([self.scores[subject] for subject in subjects], weights, num_samples=self.bootstrap_samples, confidence=self.confidence)
+        return mean, ci_low, ci_high
+
+    def print_progress(self):
+        step = self.history[-1]
+        width = "n/a" if step["ci_width"] is None else f"{step['ci_width']:.3f}"
+        ci = "n/a" if step["ci_low"] is None else f"{step['ci_low']:+.3f} to {step['ci_high']:+.3f}"
+        mean = "n/a" if step["mean_score"] is None else f"{step['mean_score']:+.3f}"
+        print(f"========= Adaptive sampling: {step['questions']} of {self.population} questions, {step['calls']} calls | mean score {mean} ({self.confidence:.0%} CI {ci}, width {width} / target {self.target_ci_width}) =========")
+
+    def report(self):
+        return {
+            "stop_reason": self.stop_reason,
+            "population": self.population,
+            "sampled": len(self.sampled),
+            "target_ci_width": self.target_ci_width,
+            "max_calls": self.max_calls,
+            "by_subject": {subject: {"population": len(questions), "sampled": self.taken[subject]} for subject, questions in self.strata.items()},
+            "history": self.history
+        }
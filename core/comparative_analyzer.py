@@ -1,19 +1,71 @@
+import asyncio
 import json
+from collections import Counter
 import os
-from tqdm import tqdm
-from core.prompts import format_solution_comparison_system_prompt_array, format_solution_comparison_user_prompt, format_solution_performance_analysis_prompt, format_insight_generation_prompt
-from core.datatypes import MetricEvaluation, SolutionPerformanceAnalysis, InsightReport
-from helpers.ai_provider import call_gemini
-from helpers.utils import convert_list_to_dict_with_key
+import numpy as np
+import pandas as pd
+from core.prompts import COMPARE_PROMPT_VERSION, format_solution_comparison_system_prompt, format_solution_comparison_multi_metric_system_prompt, format_solution_comparison_user_prompt, format_solution_performance_analysis_system_prompt, format_solution_performance_analysis_prompt, format_insight_generation_prompt
+from core.datatypes import MetricEvaluation, SolutionPerformanceAnalysis, InsightReport, build_multi_metric_evaluation_model
+from helpers.ai_provider import call_gemini, resolve_temperature, DEFAULT_MODEL
+from helpers.text_utils import extract_final_answer, text_similarity
+from helpers.utils import convert_list_to_dict_with_key, dump_json_array
+from helpers.stats import bootstrap_mean_ci, top_k_indices
+from helpers.scheduler import get_scheduler
+from helpers.checkpoint import Checkpoint
+from helpers.model_cascade import get_cascade, stage_models
 from core.datatypes import WinnerSolution
 
+# store tables derived from the comparisons
+COMPARE_TABLES = ("comparisons", "comparison_metrics", "scores", "post_mortems")
+
 class ComparativeAnalyzer():
-    def __init__(self,similar_question_data, generated_solutions_w_similar, generated_solutions_wo_similar, reports_dir):
+    def __init__(self,similar_question_data, generated_solutions_w_similar, generated_solutions_wo_similar, reports_dir, scheduler=None, resume=True, judge_mode="per_metric", metric_weights=None, top_k=4, score_threshold=0.2, bootstrap_samples=1000, store=None, export_json=None, early_exit=False, identical_similarity=0.97, clear_similarity=0.85, clear_case_model=None, position_swap=False, dedupe_stats=None, cascade_margin=0.2):
         # convert arrays to dict with question_id as key for easier retrieval
         self.dataset = convert_list_to_dict_with_key(similar_question_data, 'question_id')
         self.solutions_with_similar = convert_list_to_dict_with_key(generated_solutions_w_similar, 'question_id')
         self.solutions_without_similar = convert_list_to_dict_with_key(generated_solutions_wo_similar, 'question_id')
         self.reports_dir = reports_dir
+        self.scheduler = scheduler or get_scheduler()
+        self.resume = resume
+        # results also go to the ResultStore when given one, the pretty json reports are then opt in
+        self.store = store
+        self.export_json = store is None if export_json is None else export_json
+        # "per_metric" makes one judge call per metric, "combined" scores every metric in a single call.
+        # per_metric is kept around to A/B the judge agreement between the two.
+        if judge_mode not in ("per_metric", "combined"):
+            raise ValueError("judge_mode must be either 'per_metric' or 'combined'.")
+        self.judge_mode = judge_mode
+        self.multi_metric_models = {}
+        self.analysed_dataset = None
+        
+        # insight selection. metric_weights weighs each metric in the average score (missing metrics weigh 1.0),
+        # the top_k strongest wins and losses beyond +-score_threshold get a post mortem
+        self.metric_weights = metric_weights or {}
+        self.top_k = top_k
+        self.score_threshold = score_threshold
+        self.bootstrap_samples = bootstrap_samples
+        self.relevance_bins = [0.0, 0.4, 0.7, 1.0]
+        self.relevance_bucket_labels = ("low", "medium", "high")
+        
+        # early exit judging. pairs with the same final answer and near identical text (>= identical_similarity)
+        # are an automatic TIE with no judge call. pairs with the same final answer and similar text
+        # (>= clear_similarity) tie on the answer metrics and only get the rest judged, on clear_case_model if set.
+        # everything else, including pairs without an extractable answer, gets the full evaluation.
+        self.early_exit = early_exit
+        self.identical_similarity = identical_similarity
+        self.clear_similarity = clear_similarity
+        self.clear_case_model = clear_case_model
+        self.answer_metrics = ("CORRECTNESS",)
+        self.judge_routes = Counter()
+        self.judge_calls_saved = 0
+        
+        # position_swap judges every pair a second time with the solutions swapped, concurrently and through the same
+        # scheduler and cache, and reconciles both verdicts into one debiased verdict per metric
+        self.position_swap = position_swap
+        # dataset level duplicate stats (DuplicateIndex.stats), reported next to the score breakdown
+        self.dedupe_stats = dedupe_stats
+        # with a model cascade on the compare stage, a verdict won by less than this margin goes to the next tier
+        self.cascade_margin = cascade_margin
         
         # define metrics, this is dynamic, can be extended or modified.
         self.solution_comparison_metrics = {
@@ -27,115 +79,404 @@ class ComparativeAnalyzer():
             data['solution_generated_with_similar'] = self.solutions_with_similar.get(ques_id)['generated_solution']
             data['solution_generated_without_similar'] = self.solutions_without_similar.get(ques_id)['generated_solution']
                
+    async def analyze_question(self, item):
+        ques_id, data = item
+        subject = data['subject']
+        main_question = data['question_text']
+        solution_a = data['solution_generated_with_similar']
+        solution_b = data['solution_generated_without_similar']
+        
+        route, reason, metrics, model = self.select_judged_metrics(solution_a, solution_b)
+        metric_evals = {}
+        for metric in self.solution_comparison_metrics:
+            if metric not in metrics:
+                metric_evals[metric] = MetricEvaluation(winner=WinnerSolution.TIE, margin_of_winning=0.0, reasoning=f"Automatic TIE without a judge call: {reason}.")
+        
+        judge = self.judge_combined if self.judge_mode == "combined" else self.judge_per_metric
+        swapped_evals = {}
+        tiers = {}
+        if metrics and self.position_swap:
+            # both orderings go out together, so the swap costs calls but not wall clock time
+            (original, original_tiers), (swapped_evals, swapped_tiers) = await asyncio.gather(
+                judge(ques_id, subject, main_question, solution_a, solution_b, metrics, model),
+                judge(ques_id, subject, main_question, solution_b, solution_a, metrics, model, swapped=True)
+            )
+            metric_evals.update(original)
+            tiers.update(original_tiers)
+            tiers.update({f"{metric}_SWAPPED": tier for metric, tier in swapped_tiers.items()})
+        elif metrics:
+            evals, tiers = await judge(ques_id, subject, main_question, solution_a, solution_b, metrics, model)
+            metric_evals.update(evals)
+        self.record_judge_route(route, metrics)
+        
+        analysis_report = {"question_id": ques_id}    
+        for metric in self.solution_comparison_metrics:
+            if metric in swapped_evals:
+                analysis_report[metric.lower()] = self.reconcile_positions(metric_evals[metric], swapped_evals[metric])
+            else:
+                analysis_report[metric.lower()] = metric_evals[metric].model_dump(mode="json")
+        analysis_report["judge_route"] = route
+        if any(tier is not None for tier in tiers.values()):
+            # cascade tier that gave each verdict, 0 is the first (cheapest) tier
+            analysis_report["judge_tiers"] = tiers
+        return analysis_report
+    
+    @staticmethod
+    def signed_score(evaluation):
+        # positive when the solution in the first slot won
+        if evaluation.winner == WinnerSolution.SOLUTION_A:
+            return evaluation.margin_of_winning
+        if evaluation.winner == WinnerSolution.SOLUTION_B:
+            return -evaluation.margin_of_winning
+        return 0.0
+    
+    def reconcile_positions(self, original, swapped):
+        # the swapped verdict is flipped back to with/without similar terms and averaged with the original, so a
+        # judge that just prefers one slot cancels out. agreeing verdicts keep their winner, disagreeing ones
+        # are decided by the averaged score and end up as a TIE when they cancel
+        score = (self.signed_score(original) - self.signed_score(swapped)) / 2
+        if score > 1e-9:
+            winner = WinnerSolution.SOLUTION_A
+        elif score < -1e-9:
+            winner = WinnerSolution.SOLUTION_B
+        else:
+            winner = WinnerSolution.TIE
+        return {
+            "winner": winner.value,
+            "margin_of_winning": round(abs(score), 4),
+            "reasoning": f"Original order: {original.reasoning}\nSwapped order: {swapped.reasoning}",
+            "position_swap": {
+                "original": {"winner": original.winner.value, "margin_of_winning": original.margin_of_winning},
+                # as judged, i.e. SOLUTION_A here is the solution generated without similar questions
+                "swapped": {"winner": swapped.winner.value, "margin_of_winning": swapped.margin_of_winning}
+            }
+        }
+    
+    def position_bias_stats(self, analysis_records):
+        # per metric, over the pairs judged in both orders. agreement_rate - both orders picked the same solution
+        # (or both tied). first_position_rate - share of non tie verdicts that went to whichever solution was shown
+        # first, 0.5 means no position bias. position_flips - pairs where the winning slot stayed the same while
+        # the solutions were swapped, i.e. the verdict followed the position rather than the content
+        stats = {}
+        frame = pd.json_normalize(analysis_records)
+        for metric in self.solution_comparison_metrics:
+            column = f"{metric.lower()}.position_swap.original.winner"
+            if column not in frame:
+                continue
+            judged = frame.dropna(subset=[column])
+            original = judged[column].to_numpy()
+            swapped = judged[f"{metric.lower()}.position_swap.swapped.winner"].to_numpy()
+            a, b, tie = WinnerSolution.SOLUTION_A.value, WinnerSolution.SOLUTION_B.value, WinnerSolution.TIE.value
+            agreement = ((original == a) & (swapped == b)) | ((original == b) & (swapped == a)) | ((original == tie) & (swapped == tie))
+            verdicts = np.concatenate([original, swapped])
+            decisive = verdicts[verdicts != tie]
+            stats[metric] = {
+                "pairs": int(len(judged)),
+                "agreement_rate": float(agreement.mean()) if len(judged) else None,
+                "first_position_rate": float((decisive == a).mean()) if len(decisive) else None,
+                "position_flips": int(((original == swapped) & (original != tie)).sum())
+            }
+        return stats
+    
+    def print_position_bias(self, stats):
+        for metric, metric_stats in stats.items():
+            if metric_stats["pairs"]:
+                first_position = "n/a" if metric_stats["first_position_rate"] is None else f"{metric_stats['first_position_rate']:.0%}"
+                print(f"{metric}: {metric_stats['pairs']} pairs judged in both orders | {metric_stats['agreement_rate']:.0%} agreement | first position wins {first_position} of decisive verdicts | {metric_stats['position_flips']} verdicts followed the position")
+    
+    def checkpoint_settings(self):
+        # everything a comparison depends on besides the two solutions, a checkpoint written under other settings is stale.
+        # metric weights and insight selection only apply to the scores, which are recomputed from the comparisons
+        settings = {
+            "judge_mode": self.judge_mode,
+            "metrics": self.solution_comparison_metrics,
+            "position_swap": self.position_swap,
+            "models": stage_models("compare", DEFAULT_MODEL),
+            "temperature": resolve_temperature("compare", 0.1),
+            "prompts": COMPARE_PROMPT_VERSION
+        }
+        if self.early_exit:
+            settings["early_exit"] = {"identical_similarity": self.identical_similarity, "clear_similarity": self.clear_similarity, "clear_case_model": self.clear_case_model}
+        if get_cascade("compare") is not None:
+            settings["cascade_margin"] = self.cascade_margin
+        return settings
+
+    def triage(self, solution_a, solution_b):
+        # cheap pre filter, decides how much judging a pair needs before any call is made
+        answer_a, answer_b = extract_final_answer(solution_a), extract_final_answer(solution_b)
+        if answer_a is None or answer_a != answer_b:
+            return "full", None
+        similarity = text_similarity(solution_a, solution_b, min_ratio=self.clear_similarity)
+        if similarity >= self.identical_similarity:
+            return "auto_tie", f"same final answer ({answer_a}) and {similarity:.0%} identical solutions"
+        if similarity >= self.clear_similarity:
+            return "reduced", f"both solutions reach the same final answer ({answer_a})"
+        return "full", None
+    
+    def select_judged_metrics(self, solution_a, solution_b):
+        # route of the pair, the metrics that still need a judge call and the model they go to
+        route, reason = self.triage(solution_a, solution_b) if self.early_exit else ("full", None)
+        if route == "auto_tie":
+            return route, reason, {}, DEFAULT_MODEL
+        if route == "reduced":
+            metrics = {metric: description for metric, description in self.solution_comparison_metrics.items() if metric not in self.answer_metrics}
+            return route, reason, metrics, self.clear_case_model or DEFAULT_MODEL
+        return route, reason, self.solution_comparison_metrics, DEFAULT_MODEL
+    
+    def get_judge_prompts(self, data, solution_a, solution_b):
+        # (model, system prompt, user prompt) of every judge call analyze_question makes for the pair, used to plan dry runs
+        _, _, metrics, model = self.select_judged_metrics(solution_a, solution_b)
+        if not metrics:
+            return []
+        subject, main_question = data['subject'], data['question_text']
+        if self.judge_mode == "combined":
+            prompts = [(format_solution_comparison_multi_metric_system_prompt(subject, metrics), format_solution_comparison_user_prompt(main_question, solution_a, solution_b))]
+        else:
+            system_prompt = format_solution_comparison_system_prompt(subject)
+            prompts = [(system_prompt, format_solution_comparison_user_prompt(main_question, solution_a, solution_b, metric, description)) for metric, description in metrics.items()]
+        # the swapped ordering sends the same prompts with the solutions exchanged, so the same sizes
+        return [(model, system_prompt, user_prompt) for system_prompt, user_prompt in prompts] * (2 if self.position_swap else 1)
+    
+    def record_judge_route(self, route, judged_metrics):
+        self.judge_routes[route] += 1
+        orderings = 2 if self.position_swap else 1
+        if self.judge_mode == "combined":
+            self.judge_calls_saved += 0 if judged_metrics else orderings
+        else:
+            self.judge_calls_saved += (len(self.solution_comparison_metrics) - len(judged_metrics)) * orderings
+    
+    def print_judge_routes(self):
+        if self.early_exit and self.judge_routes:
+            print(f"========= Judge pre-filter: {self.judge_routes['auto_tie']} automatic ties, {self.judge_routes['reduced']} reduced, {self.judge_routes['full']} full evaluations, {self.judge_calls_saved} judge calls saved. =========")
+    
+    def judge_uncertainty(self, response):
+        # why a cascade tier's verdict isn't trusted, None when it is. a MetricEvaluation or a multi metric evaluation
+        evaluations = [response] if isinstance(response, MetricEvaluation) else [getattr(response, metric.lower()) for metric in type(response).model_fields]
+        for evaluation in evaluations:
+            if evaluation.winner != WinnerSolution.TIE and evaluation.margin_of_winning < self.cascade_margin:
+                return "low_margin"
+        return None
+
+    async def judge_call(self, user_prompt, system_prompt, response_schema, model, tags):
+        # (response, cascade tier or None). a cascade on the compare stage replaces the model picked for the pair
+        cascade = get_cascade("compare")
+        if cascade is None:
+            return await self.scheduler.call(call_gemini, user_prompt, system_prompt, response_schema, model, temperature=0.1, tags=tags), None
+        return await cascade.call(self.scheduler, self.judge_uncertainty, user_prompt, system_prompt, response_schema, 0.1, tags)
+
+    async def judge_per_metric(self, ques_id, subject, main_question, solution_a, solution_b, metrics=None, model=DEFAULT_MODEL, swapped=False):
+        metrics = metrics or self.solution_comparison_metrics
+        # same system prompt for every metric and the metric goes last in the user prompt, so the per metric calls of
+        # one ordering (one per judged metric, 3 with the default metrics) share everything up to the metric block and
+        # only the first pays for the full prefix. the swapped ordering shows the solutions the other way round, so
+        # it only shares the system prompt and the problem with them
+        system_prompt = format_solution_comparison_system_prompt(subject)
+        
+        # metrics are independent of each other, so fan them out together
+        results = await asyncio.gather(*[
+            self.judge_call(format_solution_comparison_user_prompt(main_question, solution_a, solution_b, metric, description), system_prompt, MetricEvaluation, model, tags={"stage": "compare", "question_id": ques_id, "metric": f"{metric}_SWAPPED" if swapped else metric})
+            for metric, description in metrics.items()
+        ])
+        # ({metric: evaluation}, {metric: cascade tier})
+        return {metric: evaluation for metric, (evaluation, _) in zip(metrics, results)}, {metric: tier for metric, (_, tier) in zip(metrics, results)}
+    
+    async def judge_combined(self, ques_id, subject, main_question, solution_a, solution_b, metrics=None, model=DEFAULT_MODEL, swapped=False):
+        metrics = metrics or self.solution_comparison_metrics
+        # the model is built from the metric dict, cached since the metrics rarely change between questions
+        metrics_key = tuple(metrics.keys())
+        if metrics_key not in self.multi_metric_models:
+            self.multi_metric_models[metrics_key] = build_multi_metric_evaluation_model(metrics)
+        response_schema = self.multi_metric_models[metrics_key]
+        
+        system_prompt = format_solution_comparison_multi_metric_system_prompt(subject, metrics)
+        user_prompt = format_solution_comparison_user_prompt(main_question, solution_a, solution_b)
+        response, tier = await self.judge_call(user_prompt, system_prompt, response_schema, model, tags={"stage": "compare", "question_id": ques_id, "metric": "ALL_SWAPPED" if swapped else "ALL"})
+        return {metric: getattr(response, metric.lower()) for metric in metrics}, {metric: tier for metric in metrics}
+    
     async def analyze(self):
         print("========= Starting Comparative Analysis =========")
-        analysis_arr = []
-        
-        for ques_id, data in tqdm(self.dataset.items(), desc="Analyzing Solutions", unit="Question"):
-            subject = data['subject']
-            main_question = data['question_text']
-            solution_a = data['solution_generated_with_similar']
-            solution_b = data['solution_generated_without_similar']
-            
-            system_prompts = format_solution_comparison_system_prompt_array(subject, self.solution_comparison_metrics)
+        with Checkpoint(os.path.join(self.reports_dir, "comparative_analysis_report.jsonl"), resume=self.resume, settings=self.checkpoint_settings()) as checkpoint:
+            if checkpoint.invalidated and self.store is not None:
+                self.store.clear(*COMPARE_TABLES)
+            async def analyze_and_checkpoint(item):
+                checkpoint.append(await self.analyze_question(item))
             
-            # was initially thinking of flipping sol a and sol b to lessen bias
-            user_prompt = format_solution_comparison_user_prompt(main_question, solution_a, solution_b)
+            pending = checkpoint.pending(self.dataset.items(), key_fn=lambda item: item[0])
+            try:
+                await self.scheduler.map(analyze_and_checkpoint, pending, desc="Analyzing Solutions", unit="Question")
+            finally:
+                # the store is derived from the checkpoint, questions finished before a failure get there too
+                if self.store is not None:
+                    self.store.sync_from_checkpoint("comparisons", checkpoint, self.dataset.keys(), self.store.put_comparison)
+            analysis_arr = checkpoint.ordered(self.dataset.keys())
             
-            analysis_report = {"question_id": ques_id}    
-            # just a hack to show the exact metric being evaluated in tqdm
-            progress = tqdm(system_prompts.items(), total=len(system_prompts), desc="Evaluating Metrics", unit="Metric")
-            for metric, system_prompt in progress:
-                progress.set_postfix_str(f"Evaluating {metric}")
-                metric_eval : MetricEvaluation = await call_gemini(user_prompt, system_prompt, MetricEvaluation, temperature=0.1)
-                analysis_report[metric.lower()] = metric_eval.model_dump(mode="json")
-            
-            analysis_arr.append(analysis_report)
-            
-        # can think of some better way of saving checkpoint
-        with open(os.path.join(self.reports_dir,"comparative_analysis_report.json"),"w") as f:
-            json.dump(analysis_arr, f, indent=2, ensure_ascii=False)
+        if self.export_json:
+            with open(os.path.join(self.reports_dir,"comparative_analysis_report.json"),"w") as f:
+                dump_json_array(analysis_arr, f)
         
         self.analysed_dataset = analysis_arr    
+        self.print_judge_routes()
+        if self.position_swap:
+            self.print_position_bias(self.position_bias_stats(analysis_arr))
         print("========= Comparative Analysis Complete, check comparative_analysis_report file for full report. =========")
     
+    async def analyze_performance(self, outcome, case):
+        original_data = case['original_question_data']
+        user_prompt = format_solution_performance_analysis_prompt(original_data['subject'], outcome, case['average_score'], original_data['question_text'], original_data['similar_questions'], case['full_analysis'])
+        
+        system_prompt = format_solution_performance_analysis_system_prompt()
+        response: SolutionPerformanceAnalysis = await self.scheduler.call(call_gemini, user_prompt, system_prompt, SolutionPerformanceAnalysis, temperature=0.1, tags={"stage": "insights", "question_id": original_data['question_id'], "metric": outcome})
+        analysis = response.model_dump(mode="json")
+        analysis['question_id'] = original_data['question_id']
+        if self.store is not None:
+            self.store.put_post_mortem(outcome, analysis)
+        return analysis
+    
+    def build_metric_scores(self, analysis_records):
+        # one row per question, one column per metric. scores are positive when solution A (generated with similar
+        # questions) won, negative when solution B (without) won and 0 for a tie, scaled by the margin
+        metrics = [metric.lower() for metric in self.solution_comparison_metrics]
+        if not analysis_records:
+            # nothing analysed yet (e.g. an adaptive batch that was all resumed duplicates), same columns and no rows
+            return pd.DataFrame({"question_id": pd.Series(dtype=object), **{metric: pd.Series(dtype=float) for metric in metrics}, "average_score": pd.Series(dtype=float)})
+        frame = pd.json_normalize(analysis_records)
+        winners = frame[[f"{metric}.winner" for metric in metrics]].to_numpy()
+        margins = frame[[f"{metric}.margin_of_winning" for metric in metrics]].to_numpy(dtype=float)
+        signs = np.where(winners == WinnerSolution.SOLUTION_A.value, 1.0, np.where(winners == WinnerSolution.SOLUTION_B.value, -1.0, 0.0))
+        
+        scores = pd.DataFrame(signs * margins, columns=metrics)
+        weights = np.array([self.metric_weights.get(metric, 1.0) for metric in self.solution_comparison_metrics], dtype=float)
+        scores.insert(0, "question_id", frame["question_id"])
+        scores["average_score"] = scores[metrics].to_numpy() @ weights / weights.sum()
+        return scores
+
+    def build_score_frame(self, analysis_records):
+        scores = self.build_metric_scores(analysis_records)
+        scores["subject"] = scores["question_id"].map({ques_id: data.get('subject') for ques_id, data in self.dataset.items()})
+        scores["relevance_bucket"] = scores["question_id"].map(self.load_relevance_buckets())
+        return scores
+    
+    def load_relevance_buckets(self):
+        # relevance is bucketed on the mean of conceptual and structural similarity, if the relevance stage ran
+        if self.store is not None:
+            similarity = pd.Series(self.store.get_relevance_similarity(), dtype=float)
+        else:
+            relevance_path = os.path.join(self.reports_dir, "relevance_eval_report.json")
+            if not os.path.exists(relevance_path):
+                return {}
+            with open(relevance_path, "r") as f:
+                relevance = pd.json_normalize(json.load(f))
+            if relevance.empty:
+                return {}
+            similarity = pd.Series(relevance[["similarity.conceptual_similarity", "similarity.structural_similarity"]].mean(axis=1).to_numpy(), index=relevance["question_id"])
+        if similarity.empty:
+            return {}
+        buckets = pd.cut(similarity, bins=self.relevance_bins, labels=list(self.relevance_bucket_labels), include_lowest=True)
+        return buckets.astype(str).to_dict()
+    
+    def summarize_scores(self, group):
+        scores = group["average_score"].to_numpy()
+        ci_low, ci_high = bootstrap_mean_ci(scores, num_samples=self.bootstrap_samples)
+        return {
+            "questions": int(len(scores)),
+            "mean_score": float(scores.mean()) if len(scores) else None,
+            "ci_low": ci_low,
+            "ci_high": ci_high,
+            "win_rate": float((scores > self.score_threshold).mean()) if len(scores) else None,
+            "loss_rate": float((scores < -self.score_threshold).mean()) if len(scores) else None,
+            "metrics": {metric.lower(): float(group[metric.lower()].mean()) for metric in self.solution_comparison_metrics}
+        }
+    
+    def score_breakdown(self, scores):
+        breakdown = {
+            "metric_weights": {metric: self.metric_weights.get(metric, 1.0) for metric in self.solution_comparison_metrics},
+            "overall": self.summarize_scores(scores),
+            "by_subject": {},
+            "by_relevance_bucket": {}
+        }
+        for subject, group in scores.dropna(subset=["subject"]).groupby("subject", sort=True):
+            breakdown["by_subject"][subject] = self.summarize_scores(group)
+        buckets = dict(list(scores.dropna(subset=["relevance_bucket"]).groupby("relevance_bucket")))
+        for bucket in self.relevance_bucket_labels:
+            if bucket in buckets:
+                breakdown["by_relevance_bucket"][bucket] = self.summarize_scores(buckets[bucket])
+        return breakdown
+    
+    def print_score_breakdown(self, breakdown):
+        def line(name, stats):
+            return f"{name}: {stats['questions']} questions | mean score {stats['mean_score']:+.3f} (95% CI {stats['ci_low']:+.3f} to {stats['ci_high']:+.3f}) | {stats['win_rate']:.0%} wins / {stats['loss_rate']:.0%} losses"
+        print(line("Overall", breakdown["overall"]))
+        for subject, stats in breakdown["by_subject"].items():
+            print(line(f"  {subject}", stats))
+        for bucket, stats in breakdown["by_relevance_bucket"].items():
+            print(line(f"  relevance {bucket}", stats))
+    
     async def generate_insights(self):
         print("========= Starting Insight Generation =========")
-        processed_analysis = []
-        self.analysed_dataset = json.load(open(os.path.join(self.reports_dir,"comparative_analysis_report.json"), "r"))
-        for analysis in self.analysed_dataset:
-            ques_id = analysis['question_id']
-            
-            scores = {}
-            for metric,_ in self.solution_comparison_metrics.items():
-                metric_normalized = metric.lower()
-                winner = analysis[metric_normalized]['winner']
-                margin_winner = analysis[metric_normalized]['margin_of_winning']
-                
-                metric_score = 0.0
-                # Positive score for solution A, i.e. Sol generated with similar questions.
-                if winner == WinnerSolution.SOLUTION_A.value:
-                    metric_score = margin_winner
-                # Negative score for solution B, i.e. Sol generated without similar questions.
-                elif winner == WinnerSolution.SOLUTION_B.value:
-                    metric_score = -margin_winner
-                
-                scores[metric_normalized] = metric_score
-            # average of all metric scores 
-            average_score = sum(scores.values()) / len(scores)
-            
-            processed_analysis.append({
+        if self.analysed_dataset is None and self.store is not None:
+            self.analysed_dataset = self.store.get_comparisons(list(self.dataset.keys()))
+        elif self.analysed_dataset is None:
+            with open(os.path.join(self.reports_dir,"comparative_analysis_report.json"), "r") as f:
+                self.analysed_dataset = json.load(f)
+        analysis_records = self.analysed_dataset
+        scores = self.build_score_frame(analysis_records)
+        average_scores = scores["average_score"].to_numpy()
+        
+        def make_case(idx):
+            ques_id = analysis_records[idx]['question_id']
+            return {
                 "question_id": ques_id,
-                "average_score": average_score,
-                "full_analysis": analysis,
+                "average_score": float(average_scores[idx]),
+                "full_analysis": analysis_records[idx],
                 "original_question_data": self.dataset.get(ques_id)
-            })
+            }
+        
+        if self.store is not None:
+            # the store joins the full analysis on demand, only the scores are new here
+            self.store.put_scores(list(zip(scores["question_id"], average_scores.tolist(), scores["subject"], scores["relevance_bucket"])))
+            self.store.commit()
+        if self.export_json:
+            with open(os.path.join(self.reports_dir,"full_analysis_report.json"), "w") as f:
+                dump_json_array((make_case(idx) for idx in range(len(analysis_records))), f)
+            print("========= Full Analysis Report Generated. Check full_analysis_report.json for details. =========")   
         
-        with open(os.path.join(self.reports_dir,"full_analysis_report.json"), "w") as f:
-                json.dump(processed_analysis, f, indent=2, ensure_ascii=False)
-        print("========= Full Analysis Report Generated. Check full_analysis_report.json for details. =========")   
+        breakdown = self.score_breakdown(scores)
+        position_bias = self.position_bias_stats(analysis_records)
+        if position_bias:
+            breakdown["position_bias"] = position_bias
+        if self.dedupe_stats is not None:
+            breakdown["dedupe"] = self.dedupe_stats
+        with open(os.path.join(self.reports_dir,"score_breakdown.json"), "w") as f:
+            json.dump(breakdown, f, indent=2, ensure_ascii=False)
+        self.print_score_breakdown(breakdown)
             
-        # Determine when Solution A (Generated WITH similar questions) won and lost.
-        threshold = 0.2
-        strong_wins = [w for w in processed_analysis if w['average_score'] > threshold]
-        strong_losses = [l for l in processed_analysis if l['average_score'] < -threshold]
+        # Determine when Solution A (Generated WITH similar questions) won and lost, the top_k strongest of each.
+        win_candidates = np.flatnonzero(average_scores > self.score_threshold)
+        loss_candidates = np.flatnonzero(average_scores < -self.score_threshold)
+        strong_wins = [make_case(idx) for idx in win_candidates[top_k_indices(average_scores[win_candidates], self.top_k)]]
+        strong_losses = [make_case(idx) for idx in loss_candidates[top_k_indices(average_scores[loss_candidates], self.top_k, largest=False)]]
         
         # couldnt pass the threshold, so no strong wins or losses
         if strong_losses == [] and strong_wins == []:
             print("No strong wins or losses found. Here is the full analysis report:")
-            for analysis in processed_analysis:
-                print(f"\nQuestion ID: {analysis['question_id']}")
-                print(f"Average Score: {analysis['average_score']}")
-                print(f"Full Analysis: {json.dumps(analysis['full_analysis'], indent=2)}")
+            for idx in range(len(analysis_records)):
+                print(f"\nQuestion ID: {analysis_records[idx]['question_id']}")
+                print(f"Average Score: {average_scores[idx]}")
+                print(f"Full Analysis: {json.dumps(analysis_records[idx], indent=2)}")
             print("========= Insight Generation Complete. No strong wins or losses found. =========")
             return
         
-        win_analysis_arr = []
-        loss_analysis_arr = []
-        
-        for wins in tqdm(strong_wins[:min(len(strong_wins), 4)], desc="Analyzing wins", unit="WINS"):
-            original_data = wins['original_question_data']
-            user_prompt = format_solution_performance_analysis_prompt(original_data['subject'], "WIN", wins['average_score'], original_data['question_text'], original_data['similar_questions'], wins['full_analysis'])
-            
-            response: SolutionPerformanceAnalysis = await call_gemini(user_prompt, response_schema=SolutionPerformanceAnalysis, temperature=0.1)
-            win_analysis = response.model_dump(mode="json")
-            win_analysis['question_id'] = original_data['question_id']
-            win_analysis_arr.append(win_analysis)
-            
-        for loss in tqdm(strong_losses[:min(len(strong_losses), 4)], desc="Analyzing losses", unit="LOSSES"):
-            original_data = loss['original_question_data']
-            user_prompt = format_solution_performance_analysis_prompt(original_data['subject'], "LOSS", loss['average_score'], original_data['question_text'], original_data['similar_questions'], loss['full_analysis'])
-            
-            response: SolutionPerformanceAnalysis = await call_gemini(user_prompt, response_schema=SolutionPerformanceAnalysis, temperature=0.1)
-            loss_analysis = response.model_dump(mode="json")
-            loss_analysis['question_id'] = original_data['question_id']
-            loss_analysis_arr.append(loss_analysis)
+        # wins and losses are analysed independently, so fan them out through the scheduler
+        win_analysis_arr = await self.scheduler.map(lambda wins: self.analyze_performance("WIN", wins), strong_wins, desc="Analyzing wins", unit="WINS")
+        loss_analysis_arr = await self.scheduler.map(lambda loss: self.analyze_performance("LOSS", loss), strong_losses, desc="Analyzing losses", unit="LOSSES")
             
         insight_user_prompt = format_insight_generation_prompt(win_analysis_arr, loss_analysis_arr)
         
-        final_report: InsightReport = await call_gemini(
+        final_report: InsightReport = await self.scheduler.call(
+            call_gemini,
             user_message=insight_user_prompt,
-            response_schema=InsightReport
+            response_schema=InsightReport,
+            tags={"stage": "insights", "metric": "REPORT"}
         )
              
         for idx,insight in enumerate(final_report.insights):
@@ -1,5 +1,5 @@
 from typing import List
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, create_model
 from enum import Enum
 
 class Subjects(Enum):
@@ -27,6 +27,10 @@ class RelevanceAlignment(BaseModel):
     is_solution_approach_viable: AppropriateAlignment = Field(description="YES if solution methods can be referenced to solve the main question, PARTIAL if some key external information is needed, NO if solution is irrelevant.")
     reasoning: str    
        
+class RelevanceEvaluation(BaseModel):
+    similarity: RelevanceSimilarity
+    alignment:  RelevanceAlignment
+       
 class RelevanceEvaluationReport(BaseModel):
     question_id: str
     similarity: RelevanceSimilarity
@@ -49,6 +53,14 @@ class MetricEvaluation(BaseModel):
     margin_of_winning: float = Field(description="A score from 0.0 (a tie) to 1.0 (complete win for the winner solution) between the solutions A and B.", ge=0.0, le=1.0)
     reasoning: str = Field(description="A concise justification.")
 
+def build_multi_metric_evaluation_model(metrics: dict[str, str]) -> type[BaseModel]:
+    # one MetricEvaluation field per configured metric, so every metric is scored in a single structured response
+    fields = {
+        metric.lower(): (MetricEvaluation, Field(description=f"Evaluation for the {metric} metric."))
+        for metric in metrics
+    }
+    return create_model("MultiMetricEvaluation", **fields)
+
 class Insights(BaseModel):
     recommendation: str
     reasoning: str    
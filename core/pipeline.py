@@ -0,0 +1,139 @@
+import asyncio
+import os
+from tqdm import tqdm
+from core.relevance_evaluator import RelevanceEvaluator
+from core.solution_builder import SolutionBuilder, COMPARED_VARIANTS
+from core.comparative_analyzer import ComparativeAnalyzer, COMPARE_TABLES
+from helpers.checkpoint import Checkpoint
+from helpers.scheduler import get_scheduler
+from helpers.utils import dump_json_array
+
+class Pipeline():
+    # streams every question through build -> compare as soon as its inputs are ready, with relevance
+    # evaluation running alongside as an independent branch. stages are connected by bounded queues,
+    # so a slow stage pushes back on the ones feeding it instead of letting work pile up in memory.
+    def __init__(self, questions, reports_dir, scheduler=None, queue_size=None, workers_per_stage=None, resume=True, judge_mode="per_metric", relevance_mode="separate", solution_variants=None, store=None, export_json=None, judge_early_exit=False, judge_position_swap=False, on_partial_solution=None, duplicates=None, judge_cascade_margin=0.2):
+        # duplicate sharing needs to know upfront which questions are pending, the dataset is in memory for the index anyway
+        self.questions = questions if duplicates is None else list(questions)
+        self.duplicates = duplicates
+        self.reports_dir = reports_dir
+        self.scheduler = scheduler or get_scheduler()
+        self.queue_size = queue_size or self.scheduler.concurrency * 2
+        self.workers_per_stage = workers_per_stage or self.scheduler.concurrency
+        self.resume = resume
+        self.store = store
+        # like the stages, the json reports are only written by default when there is no store to read them from
+        self.export_json = store is None if export_json is None else export_json
+
+        self.relevance_evaluator = RelevanceEvaluator([], reports_dir, scheduler=self.scheduler, relevance_mode=relevance_mode, duplicates=duplicates)
+        self.solution_builder = SolutionBuilder([], reports_dir, scheduler=self.scheduler, solution_variants=solution_variants, on_partial_solution=on_partial_solution, duplicates=duplicates)
+        self.comparative_analyzer = ComparativeAnalyzer([], [], [], reports_dir, scheduler=self.scheduler, judge_mode=judge_mode, early_exit=judge_early_exit, position_swap=judge_position_swap, cascade_margin=judge_cascade_margin)
+
+    async def produce(self, relevance_queue, build_queue, question_ids):
+        for data in self.questions:
+            question_ids.append(data['question_id'])
+            if self.store is not None:
+                self.store.put_questions([data])
+            await relevance_queue.put(data)
+            await build_queue.put(data)
+        for _ in range(self.workers_per_stage):
+            await relevance_queue.put(None)
+            await build_queue.put(None)
+
+    async def relevance_worker(self, queue, checkpoint, progress):
+        while (data := await queue.get()) is not None:
+            if not checkpoint.is_done(data['question_id']):
+                checkpoint.append(await self.relevance_evaluator.evaluate_question(data))
+            progress.update(1)
+
+    async def build_worker(self, queue, compare_queue, checkpoint, progress):
+        while (data := await queue.get()) is not None:
+            question_id = data['question_id']
+            missing = self.solution_builder.missing_variants(checkpoint, question_id)
+            if missing:
+                solutions = self.solution_builder.merge_record(checkpoint, await self.solution_builder.build_question(data, missing))
+                checkpoint.append(solutions)
+            else:
+                solutions = checkpoint.get(question_id)
+            progress.update(1)
+            await compare_queue.put((data, solutions))
+
+    async def compare_worker(self, queue, checkpoint, progress):
+        while (item := await queue.get()) is not None:
+            data, solutions = item
+            if not checkpoint.is_done(data['question_id']):
+                without_similar, with_similar = COMPARED_VARIANTS
+                merged = {
+                    **data,
+                    'solution_generated_with_similar': solutions[with_similar]['generated_solution'],
+                    'solution_generated_without_similar': solutions[without_similar]['generated_solution']
+                }
+                checkpoint.append(await self.comparative_analyzer.analyze_question((data['question_id'], merged)))
+            progress.update(1)
+
+    async def run_build_branch(self, build_queue, compare_queue, build_checkpoint, compare_checkpoint):
+        build_progress = tqdm(desc="Building Solutions", unit="Question", position=1)
+        compare_progress = tqdm(desc="Analyzing Solutions", unit="Question", position=2)
+        try:
+            async with asyncio.TaskGroup() as group:
+                compare_workers = [group.create_task(self.compare_worker(compare_queue, compare_checkpoint, compare_progress)) for _ in range(self.workers_per_stage)]
+                async with asyncio.TaskGroup() as build_group:
+                    for _ in range(self.workers_per_stage):
+                        build_group.create_task(self.build_worker(build_queue, compare_queue, build_checkpoint, build_progress))
+                # all builds are done, let the comparison workers drain and stop
+                for _ in compare_workers:
+                    await compare_queue.put(None)
+        finally:
+            build_progress.close()
+            compare_progress.close()
+
+    async def run(self):
+        print("========= Starting Pipelined Evaluation =========")
+        question_ids = []
+        relevance_queue = asyncio.Queue(maxsize=self.queue_size)
+        build_queue = asyncio.Queue(maxsize=self.queue_size)
+        compare_queue = asyncio.Queue(maxsize=self.queue_size)
+
+        with Checkpoint(os.path.join(self.reports_dir, "relevance_eval_report.jsonl"), resume=self.resume, settings=self.relevance_evaluator.checkpoint_settings()) as relevance_checkpoint, \
+             Checkpoint(os.path.join(self.reports_dir, "generated_solutions.jsonl"), resume=self.resume, settings=self.solution_builder.checkpoint_settings()) as build_checkpoint, \
+             Checkpoint(os.path.join(self.reports_dir, "comparative_analysis_report.jsonl"), resume=self.resume, settings=self.comparative_analyzer.checkpoint_settings()) as compare_checkpoint:
+            if self.store is not None:
+                # results derived from a stale checkpoint go with it
+                for checkpoint, tables in ((relevance_checkpoint, ("relevance",)), (build_checkpoint, ("solutions",)), (compare_checkpoint, COMPARE_TABLES)):
+                    if checkpoint.invalidated:
+                        self.store.clear(*tables)
+            if self.duplicates is not None:
+                self.relevance_evaluator.shared.expect([data['question_id'] for data in relevance_checkpoint.pending(self.questions)], "with_similar")
+                self.solution_builder.expect_shared(build_checkpoint, self.questions)
+            relevance_progress = tqdm(desc="Evaluating Relevance", unit="Question", position=0)
+            try:
+                # any failing stage cancels the rest, whatever finished is already in the checkpoints
+                async with asyncio.TaskGroup() as group:
+                    group.create_task(self.produce(relevance_queue, build_queue, question_ids))
+                    for _ in range(self.workers_per_stage):
+                        group.create_task(self.relevance_worker(relevance_queue, relevance_checkpoint, relevance_progress))
+                    group.create_task(self.run_build_branch(build_queue, compare_queue, build_checkpoint, compare_checkpoint))
+            finally:
+                relevance_progress.close()
+                # the store is derived from the checkpoints, questions finished before a failure get there too
+                if self.store is not None:
+                    self.store.sync_from_checkpoint("relevance", relevance_checkpoint, question_ids, self.store.put_relevance)
+                    self.store.sync_from_checkpoint("solutions", build_checkpoint, question_ids, self.store.put_solutions)
+                    self.store.sync_from_checkpoint("comparisons", compare_checkpoint, question_ids, self.store.put_comparison)
+            if self.export_json:
+                self.export(question_ids, relevance_checkpoint, build_checkpoint, compare_checkpoint)
+            if self.comparative_analyzer.position_swap:
+                self.comparative_analyzer.print_position_bias(self.comparative_analyzer.position_bias_stats(list(compare_checkpoint.iter_ordered(question_ids))))
+
+        self.comparative_analyzer.print_judge_routes()
+        print("========= Pipelined Evaluation Complete, check reports directory for full reports. =========")
+
+    def export(self, question_ids, relevance_checkpoint, build_checkpoint, compare_checkpoint):
+        # same report files as the staged run, streamed out of the checkpoints in input order
+        with open(os.path.join(self.reports_dir, "relevance_eval_report.json"), "w") as f:
+            dump_json_array(relevance_checkpoint.iter_ordered(question_ids), f)
+        for variant in self.solution_builder.solution_variants:
+            with open(os.path.join(self.reports_dir, self.solution_builder.get_output_file(variant)), "w") as f:
+                dump_json_array((s[variant] for s in build_checkpoint.iter_ordered(question_ids)), f)
+        with open(os.path.join(self.reports_dir, "comparative_analysis_report.json"), "w") as f:
+            dump_json_array(compare_checkpoint.iter_ordered(question_ids), f)
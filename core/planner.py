@@ -0,0 +1,199 @@
+import os
+from core.prompts import estimate_prompt_tokens
+from core.solution_builder import COMPARED_VARIANTS
+from helpers.ai_provider import DEFAULT_MODEL, resolve_route
+from helpers.model_cascade import get_cascade
+from helpers.telemetry import Telemetry
+
+STAGES = ("relevance", "build", "analyze", "insights")
+# stage name on the command line -> stage tag its calls are traced and routed under
+STAGE_TAGS = {"relevance": "relevance", "build": "build", "analyze": "compare", "insights": "insights"}
+
+class RunPlan():
+    # the calls and prompt tokens a run would make, per stage, without making any. prompts are rendered by the
+    # stages' own prompt builders so the estimate follows any prompt change. completion tokens (and the prompt
+    # tokens of insights, which depend on the judge output) come from an earlier run's trace when there is one.
+    # prompts over max_prompt_tokens (LLM_MAX_PROMPT_TOKENS) are collected in oversized, so a run can refuse to
+    # start instead of failing on them halfway through a stage.
+    def __init__(self, history_path=None, pricing=None, max_prompt_tokens=None):
+        self.stages = {}
+        if max_prompt_tokens is None and os.environ.get("LLM_MAX_PROMPT_TOKENS"):
+            max_prompt_tokens = int(os.environ["LLM_MAX_PROMPT_TOKENS"])
+        self.max_prompt_tokens = max_prompt_tokens
+        # (stage, question_id, prompt tokens)
+        self.oversized = []
+        self.history = self.load_history(history_path)
+        self.telemetry = Telemetry(pricing=pricing)
+
+    @staticmethod
+    def load_history(trace_path):
+        # stage tag -> (mean prompt tokens, mean completion tokens) of an earlier run's live calls
+        if not trace_path or not os.path.exists(trace_path):
+            return {}
+        totals = {}
+        for event in Telemetry.from_traces([trace_path]).events:
+            if event.get("cache_hit") or event.get("status") != "ok" or event.get("completion_tokens") is None:
+                continue
+            calls, prompt_tokens, completion_tokens = totals.get(event.get("stage"), (0, 0, 0))
+            totals[event.get("stage")] = (calls + 1, prompt_tokens + (event.get("prompt_tokens") or 0), completion_tokens + event["completion_tokens"])
+        return {stage: (prompt_tokens / calls, completion_tokens / calls) for stage, (calls, prompt_tokens, completion_tokens) in totals.items()}
+
+    def get_stage(self, stage):
+        return self.stages.setdefault(stage, {"questions": 0, "already_done": 0, "calls": 0, "prompt_tokens": 0, "models": {}, "notes": []})
+
+    def add_call(self, stage, prompt_tokens, model=DEFAULT_MODEL, question_id=None):
+        stats = self.get_stage(stage)
+        if self.max_prompt_tokens and prompt_tokens > self.max_prompt_tokens:
+            self.oversized.append((stage, question_id, prompt_tokens))
+        cascade = get_cascade(STAGE_TAGS[stage])
+        # a cascade's calls all start on its first tier, escalations come on top
+        _, model = cascade.tiers[0] if cascade is not None else resolve_route(STAGE_TAGS[stage], model)
+        calls, model_prompt_tokens = stats["models"].get(model, (0, 0))
+        stats["models"][model] = (calls + 1, model_prompt_tokens + prompt_tokens)
+        stats["calls"] += 1
+        stats["prompt_tokens"] += prompt_tokens
+
+    def add_note(self, stage, note):
+        self.get_stage(stage)["notes"].append(note)
+
+    def summary(self):
+        summary = {"stages": {}, "calls": 0, "prompt_tokens": 0, "completion_tokens": None, "estimated_cost_usd": None, "oversized_prompts": len(self.oversized)}
+        for stage, stats in self.stages.items():
+            history = self.history.get(STAGE_TAGS[stage])
+            completion_tokens = round(stats["calls"] * history[1]) if history else None
+            cost = None
+            if history:
+                costs = [self.telemetry.estimate_cost(model, prompt_tokens, round(calls * history[1])) for model, (calls, prompt_tokens) in stats["models"].items()]
+                cost = sum(c for c in costs if c is not None)
+            summary["stages"][stage] = {
+                "questions": stats["questions"],
+                "already_done": stats["already_done"],
+                "calls": stats["calls"],
+                "prompt_tokens": stats["prompt_tokens"],
+                "completion_tokens": completion_tokens,
+                "estimated_cost_usd": cost,
+                "models": {model: calls for model, (calls, _) in stats["models"].items()},
+                "notes": stats["notes"]
+            }
+            summary["calls"] += stats["calls"]
+            summary["prompt_tokens"] += stats["prompt_tokens"]
+            if completion_tokens is not None:
+                summary["completion_tokens"] = (summary["completion_tokens"] or 0) + completion_tokens
+            if cost is not None:
+                summary["estimated_cost_usd"] = (summary["estimated_cost_usd"] or 0.0) + cost
+        return summary
+
+    def print_summary(self):
+        summary = self.summary()
+        print("========= Dry Run Plan, no calls were made =========")
+        for stage, stats in summary["stages"].items():
+            completion = "n/a" if stats["completion_tokens"] is None else f"~{stats['completion_tokens']}"
+            cost = "n/a" if stats["estimated_cost_usd"] is None else f"~${stats['estimated_cost_usd']:.4f}"
+            models = ", ".join(f"{model} x{calls}" for model, calls in stats["models"].items()) or "-"
+            print(f"{stage}: {stats['questions']} questions ({stats['already_done']} already done) | {stats['calls']} calls | ~{stats['prompt_tokens']} in / {completion} out tokens | {cost} | {models}")
+            for note in stats["notes"]:
+                print(f"  note: {note}")
+        completion = "n/a" if summary["completion_tokens"] is None else f"~{summary['completion_tokens']}"
+        cost = "n/a" if summary["estimated_cost_usd"] is None else f"~${summary['estimated_cost_usd']:.4f}"
+        print(f"Total: {summary['calls']} calls | ~{summary['prompt_tokens']} in / {completion} out tokens | estimated cost {cost}")
+        if not self.history:
+            print("No earlier trace found, completion tokens and cost are estimated once a run has been traced.")
+        self.print_oversized()
+        return summary
+
+    def print_oversized(self, limit=10):
+        if not self.oversized:
+            return
+        print(f"{len(self.oversized)} prompts exceed LLM_MAX_PROMPT_TOKENS={self.max_prompt_tokens}:")
+        for stage, question_id, prompt_tokens in sorted(self.oversized, key=lambda item: -item[2])[:limit]:
+            print(f"  {stage}: question {question_id}, ~{prompt_tokens} tokens")
+        if len(self.oversized) > limit:
+            print(f"  ... and {len(self.oversized) - limit} more")
+
+def plan_run(plan, stages, dataset, store, relevance_evaluator, solution_builder, comparative_analyzer, duplicates=None):
+    # fills the plan with every call the selected stages would make on the dataset. results already in the store
+    # are skipped, like the stages skip them when resuming, and so is work an exact duplicate question shares
+    planned = set()
+
+    def is_shared(question_id, kind, scope=None):
+        key = duplicates.work_key(question_id, kind) if duplicates is not None else None
+        if key is None:
+            return False
+        if (scope, key) in planned:
+            return True
+        planned.add((scope, key))
+        return False
+
+    if "relevance" in stages:
+        stats = plan.get_stage("relevance")
+        done = store.done_ids("relevance")
+        for data in dataset:
+            if data['question_id'] in done:
+                stats["already_done"] += 1
+                continue
+            stats["questions"] += 1
+            if is_shared(data['question_id'], "with_similar", "relevance"):
+                stats["shared"] = stats.get("shared", 0) + 1
+                continue
+            for system_prompt, user_prompt in relevance_evaluator.get_prompts(data):
+                plan.add_call("relevance", estimate_prompt_tokens(user_prompt, system_prompt), question_id=data['question_id'])
+
+    if "build" in stages:
+        stats = plan.get_stage("build")
+        done = {variant: store.done_ids("solutions", variant=variant) for variant in solution_builder.solution_variants}
+        for data in dataset:
+            missing = [variant for variant in solution_builder.solution_variants if data['question_id'] not in done[variant]]
+            if not missing:
+                stats["already_done"] += 1
+                continue
+            stats["questions"] += 1
+            for variant in missing:
+                config = solution_builder.solution_variants[variant]
+                if not (config["with_similar"] and config.get("order") == "shuffled") and is_shared(data['question_id'], "with_similar" if config["with_similar"] else "question", variant):
+                    stats["shared"] = stats.get("shared", 0) + 1
+                    continue
+                system_prompt, user_prompt = solution_builder.get_prompts(data, variant)
+                plan.add_call("build", estimate_prompt_tokens(user_prompt, system_prompt), question_id=data['question_id'])
+
+    for stage in ("relevance", "build"):
+        shared = plan.stages.get(stage, {}).get("shared")
+        if shared:
+            plan.add_note(stage, f"{shared} calls are skipped, their exact duplicate questions share the result")
+
+    if "analyze" in stages:
+        stats = plan.get_stage("analyze")
+        done = store.done_ids("comparisons")
+        pending = [data for data in dataset if data['question_id'] not in done]
+        stats["already_done"] = len(dataset) - len(pending)
+        stats["questions"] = len(pending)
+        question_ids = [data['question_id'] for data in pending]
+        without_similar, with_similar = COMPARED_VARIANTS
+        solutions_with_similar = {s['question_id']: s['generated_solution'] for s in store.get_solutions(with_similar, question_ids)}
+        solutions_without_similar = {s['question_id']: s['generated_solution'] for s in store.get_solutions(without_similar, question_ids)}
+        unbuilt = 0
+        for data in pending:
+            solution_a = solutions_with_similar.get(data['question_id'])
+            solution_b = solutions_without_similar.get(data['question_id'])
+            if solution_a is None or solution_b is None:
+                unbuilt += 1
+            for model, system_prompt, user_prompt in comparative_analyzer.get_judge_prompts(data, solution_a or "", solution_b or ""):
+                plan.add_call("analyze", estimate_prompt_tokens(user_prompt, system_prompt), model, data['question_id'])
+        if unbuilt:
+            plan.add_note("analyze", f"{unbuilt} questions have no stored solutions yet, their judge prompts are counted without the solutions and as full evaluations")
+        elif comparative_analyzer.early_exit:
+            plan.add_note("analyze", "early exit triage applied to the stored solutions")
+
+    for stage in ("relevance", "analyze"):
+        cascade = get_cascade(STAGE_TAGS[stage])
+        if stage in stages and cascade is not None and len(cascade.tiers) > 1:
+            plan.add_note(stage, f"model cascade, calls are counted on its first tier, uncertain answers add calls on {', '.join(model for _, model in cascade.tiers[1:])}")
+
+    if "insights" in stages:
+        # at most top_k post mortems for wins and for losses each, plus the final report
+        calls = 2 * comparative_analyzer.top_k + 1
+        history = plan.history.get("insights")
+        for _ in range(calls):
+            plan.add_call("insights", round(history[0]) if history else 0)
+        plan.get_stage("insights")["questions"] = 2 * comparative_analyzer.top_k
+        plan.add_note("insights", "upper bound, only strong wins and losses get a post mortem" + ("" if history else ". prompt tokens depend on the judge output and are unknown without an earlier trace"))
+    return plan
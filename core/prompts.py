@@ -1,3 +1,7 @@
+import hashlib
+from functools import lru_cache
+from helpers.prompt_template import PromptTemplate, estimate_text_tokens
+
 relevance_similarity_system_prompt = """You are an expert {subject} professor at Stanford and MIT. Your task is to assess the similarity of similar question(s) to the main question across 2 dimensions.
 
 Evaluate on a scale of 0.0 to 1.0 for each dimensions.
@@ -26,6 +30,32 @@ You MUST return a single, valid JSON object for your Final Assessment. The struc
 }} 
 """
 
+relevance_combined_system_prompt = """You are an expert {subject} professor at Stanford and MIT. Your task is to assess the similar question(s) against the main question in two parts: how similar they are, and how well they represent the main question.
+
+PART 1 - SIMILARITY. Evaluate on a scale of 0.0 to 1.0 for each dimensions.
+1. CONCEPTUAL SIMILARITY (0.0 - 1.0): Do the similar question(s) and the main question test the same underlying concepts, principles or theories?
+2. STRUCTURAL SIMILARITY (0.0 - 1.0): Are the problem structures, setup, logical/mathematical frameworks analogous?
+
+PART 2 - ALIGNMENT.
+1. DIFFICULTY LEVEL: Are the questions (both main and similar) appropriate for student level knowledge and not PhD level knowledge?
+2. SOLUTION APPROACH VIABILITY: Can the solution method from the similar questions be meaningfully applied to solve the main question?
+
+Think step-by-step before you assess. First, think about the concepts that each of the questions are referring to, then compare the concepts between questions to assess similarity. Second, comprehend the questions, and understand the structures of the problems. Third, assess if those concepts are higher level than a student's knowledge or not. Fourth, try to solve the MAIN QUESTION using the solution methods from the SIMILAR QUESTIONS and assess how viable they are.
+You MUST return a single, valid JSON object for your Final Assessment. The structure MUST be as follows:
+{{
+    "similarity": {{
+        "conceptual_similarity": 0.X,
+        "structural_similarity": 0.X,
+        "reasoning": Justify your similarity scores, by referring to the exact formula/theory/principle found in the questions.
+    }},
+    "alignment": {{
+        "is_difficulty_appropriate": YES/PARTIAL/NO,
+        "is_solution_approach_viable": YES/PARTIAL/NO,
+        "reasoning": Justify your assessments, for difficulty and solution viability separately, by referencing formulae/theories/principles that support your claim and reasoning behind your decisions.
+    }}
+}}
+"""
+
 relevance_user_prompt="""<MAIN_QUESTION>
 {main_question}
 </MAIN_QUESTION>
@@ -35,11 +65,11 @@ relevance_user_prompt="""<MAIN_QUESTION>
 </SIMILAR_QUESTIONS>
 """
 
-solution_builder_prompt = """You are an expert {subject} tutor. Your task is to solve the given question step-by-step. Think clearly before solving.
+# prompts are split into a static system part (role, instructions, output format) and a per question user part.
+# the static part always comes first and only depends on subject/metric, so every call of a stage starts with the
+# same prefix, which the provider can serve from its prefix/context cache instead of processing it again.
 
-<MAIN_QUESTION>
-{main_question}
-</MAIN_QUESTION>
+solution_builder_prompt = """You are an expert {subject} tutor. Your task is to solve the given question (MAIN_QUESTION) step-by-step. Think clearly before solving.
 
 <INSTRUCTIONS>
 1. Write a clear outline of the solution approach of the given question.
@@ -59,15 +89,7 @@ You MUST return a single, valid JSON object for your solution. The structure MUS
 </INSTRUCTIONS>
 """
 
-solution_builder_with_similar_prompt = """You are an expert {subject} tutor. Your task is to solve the given question step-by-step. Along with the question to solve, you will be given similar question(s) with their solution approaches. Use the solution approaches to guide your reasoning through problem solving.
-
-<MAIN_QUESTION>
-{main_question}
-</MAIN_QUESTION>
-
-<SIMILAR_QUESTIONS_WITH_SOLUTION_APPROACHES>
-{similar_questions}
-</SIMILAR_QUESTIONS_WITH_SOLUTION_APPROACHES>
+solution_builder_with_similar_prompt = """You are an expert {subject} tutor. Your task is to solve the given question (MAIN_QUESTION) step-by-step. Along with the question to solve, you will be given similar question(s) with their solution approaches (SIMILAR_QUESTIONS_WITH_SOLUTION_APPROACHES). Use the solution approaches to guide your reasoning through problem solving.
 
 <INSTRUCTIONS>
 1. Write a clear outline of the solution approach of the given question.
@@ -91,15 +113,24 @@ You MUST return a single, valid JSON object for your solution. The structure MUS
 </INSTRUCTIONS>
 """
 
-solution_comparison_prompt = """You are an impartial and expert {subject} professor at Stanford and MIT, acting as a judge. Your task is to blindly compare two solutions, SOLUTION_A and SOLUTION_B, for the same problem (MAIN_PROBLEM) and assess which solution is better. You must be objective and provide a structured comparison based ONLY on the content provided.
+solution_builder_user_prompt = """<MAIN_QUESTION>
+{main_question}
+</MAIN_QUESTION>
+"""
+
+solution_builder_with_similar_user_prompt = """<MAIN_QUESTION>
+{main_question}
+</MAIN_QUESTION>
 
-<INSTRUCTIONS>
-You will evaluate the two solutions across {metric} metric. You will decide on a winner, the margin of victory, and provide your reasoning. Think step-by-step before making a final decision.
+<SIMILAR_QUESTIONS_WITH_SOLUTION_APPROACHES>
+{similar_questions}
+</SIMILAR_QUESTIONS_WITH_SOLUTION_APPROACHES>
+"""
 
-<METRIC_FOR_EVAL>
-{metric}:
-{metric_description}
-</METRIC_FOR_EVAL>    
+solution_comparison_prompt = """You are an impartial and expert {subject} professor at Stanford and MIT, acting as a judge. Your task is to blindly compare two solutions, SOLUTION_A and SOLUTION_B, for the same problem (ORIGINAL_PROBLEM) and assess which solution is better. You must be objective and provide a structured comparison based ONLY on the content provided.
+
+<INSTRUCTIONS>
+You will evaluate the two solutions across the metric given in METRIC_FOR_EVAL, after the solutions. You will decide on a winner, the margin of victory, and provide your reasoning. Think step-by-step before making a final decision.
 
 <OUTPUT_FORMAT>
 You MUST return a single, valid JSON object. The structure MUST be as follows:
@@ -113,6 +144,27 @@ You MUST return a single, valid JSON object. The structure MUST be as follows:
 </INSTRUCTIONS>
 """
 
+solution_comparison_multi_metric_prompt = """You are an impartial and expert {subject} professor at Stanford and MIT, acting as a judge. Your task is to blindly compare two solutions, SOLUTION_A and SOLUTION_B, for the same problem (ORIGINAL_PROBLEM) and assess which solution is better. You must be objective and provide a structured comparison based ONLY on the content provided.
+
+<INSTRUCTIONS>
+You will evaluate the two solutions across each of the metrics below, independently of each other. For every metric, decide on a winner, the margin of victory, and provide your reasoning. Think step-by-step before making a final decision.
+
+<METRICS_FOR_EVAL>
+{metrics}
+</METRICS_FOR_EVAL>
+
+<OUTPUT_FORMAT>
+You MUST return a single, valid JSON object with one key per metric. The structure MUST be as follows:
+{{
+{output_format}
+}}
+</OUTPUT_FORMAT>
+
+</INSTRUCTIONS>
+"""
+
+# problem and solutions come before the metric, so the per metric calls of a question (in the same solution order)
+# share everything up to it
 solution_comparison_user_prompt="""<ORIGINAL_PROBLEM>
 {main_question}
 </ORIGINAL_PROBLEM>
@@ -126,27 +178,16 @@ solution_comparison_user_prompt="""<ORIGINAL_PROBLEM>
 </SOLUTION_B>
 """
 
-solution_performance_analysis_prompt = """USER:
-You are senior AI Prompt Engineer conducting a post mortem analysis. Your task is to deduce why providing SIMILAR QUESTIONS to the LLM while solving MAIN QUESTION resulted in a specific outcome.
-
-<CONTEXT>
-SUBJECT - {subject}
-JUDGE EVALUATION - Solution A was generated with help of similar questions and Solution B was generated without. A Judge evaluated both the solutions and scored them justly. 
-OUTCOME - Solution Generated with Similar Questions resulted in {outcome}.
-PERFORMANCE SCORE - {performance_score} (Value is between -1 and 1. Positive score means solution generated with help of similar questions won, Negative means it lost to the solution that was generated without help of similar questions.)
-</CONTEXT>
-
-<MAIN_QUESTION>
-{main_question}
-</MAIN_QUESTION>
+solution_comparison_metric_prompt="""
+<METRIC_FOR_EVAL>
+{metric}:
+{metric_description}
+</METRIC_FOR_EVAL>
+"""
 
-<SIMILAR_QUESTIONS_PROVIDED_TO_LLM>
-{similar_questions}
-</SIMILAR_QUESTIONS_PROVIDED_TO_LLM>
+solution_performance_analysis_prompt = """You are senior AI Prompt Engineer conducting a post mortem analysis. Your task is to deduce why providing SIMILAR QUESTIONS to the LLM while solving MAIN QUESTION resulted in a specific outcome.
 
-<JUDGE_EVALUATION>
-{judge_evaluation}
-</JUDGE_EVALUATION>
+You will be given the CONTEXT of the case, the MAIN_QUESTION, the SIMILAR_QUESTIONS_PROVIDED_TO_LLM and the JUDGE_EVALUATION. In the JUDGE_EVALUATION, Solution A was generated with help of similar questions and Solution B was generated without. A Judge evaluated both the solutions and scored them justly. The PERFORMANCE SCORE is between -1 and 1. Positive score means solution generated with help of similar questions won, Negative means it lost to the solution that was generated without help of similar questions.
 
 <INSTRUCTIONS>
 Based on all the information, form a clear hypothesis explaining the root cause of the problem. Pinpoint the specific element in the "Similar Questions" that likely led to this success or failure.
@@ -160,8 +201,25 @@ You MUST return a single, valid JSON object. The structure MUST be as follows:
 </OUTPUT_FORMAT>
 
 </INSTRUCTIONS>
+"""
+
+solution_performance_analysis_user_prompt = """<CONTEXT>
+SUBJECT - {subject}
+OUTCOME - Solution Generated with Similar Questions resulted in {outcome}.
+PERFORMANCE SCORE - {performance_score}
+</CONTEXT>
 
-ASSISTANT:
+<MAIN_QUESTION>
+{main_question}
+</MAIN_QUESTION>
+
+<SIMILAR_QUESTIONS_PROVIDED_TO_LLM>
+{similar_questions}
+</SIMILAR_QUESTIONS_PROVIDED_TO_LLM>
+
+<JUDGE_EVALUATION>
+{judge_evaluation}
+</JUDGE_EVALUATION>
 """
 
 insight_generation_prompt="""You are a Lead AI Strategist. You have been given a series of root cause analyses for cases where using "similar questions" to guide an LLM either helped (successes) or hurt (failures) its performance.
@@ -198,43 +256,110 @@ You MUST return a single, valid JSON object. The structure MUST be as follows:
 </OUTPUT_FORMAT>
 """
 
+# templates are parsed once here instead of on every str.format call
+relevance_similarity_template = PromptTemplate(relevance_similarity_system_prompt)
+relevance_alignment_template = PromptTemplate(relevance_alignment_system_prompt)
+relevance_combined_template = PromptTemplate(relevance_combined_system_prompt)
+relevance_user_template = PromptTemplate(relevance_user_prompt)
+solution_builder_template = PromptTemplate(solution_builder_prompt)
+solution_builder_with_similar_template = PromptTemplate(solution_builder_with_similar_prompt)
+solution_builder_user_template = PromptTemplate(solution_builder_user_prompt)
+solution_builder_with_similar_user_template = PromptTemplate(solution_builder_with_similar_user_prompt)
+solution_comparison_template = PromptTemplate(solution_comparison_prompt)
+solution_comparison_multi_metric_template = PromptTemplate(solution_comparison_multi_metric_prompt)
+solution_comparison_user_template = PromptTemplate(solution_comparison_user_prompt)
+solution_comparison_metric_template = PromptTemplate(solution_comparison_metric_prompt)
+solution_performance_analysis_template = PromptTemplate(solution_performance_analysis_prompt)
+solution_performance_analysis_user_template = PromptTemplate(solution_performance_analysis_user_prompt)
+insight_generation_template = PromptTemplate(insight_generation_prompt)
+
+def prompt_version(*templates):
+    # short hash of the templates' text, changes whenever one of the prompts is edited
+    return hashlib.sha1("\0".join(template.template for template in templates).encode("utf-8")).hexdigest()[:12]
+
+RELEVANCE_PROMPT_VERSION = prompt_version(relevance_similarity_template, relevance_alignment_template, relevance_combined_template, relevance_user_template)
+BUILD_PROMPT_VERSION = prompt_version(solution_builder_template, solution_builder_with_similar_template, solution_builder_user_template, solution_builder_with_similar_user_template)
+COMPARE_PROMPT_VERSION = prompt_version(solution_comparison_template, solution_comparison_multi_metric_template, solution_comparison_user_template, solution_comparison_metric_template)
+
+SIMILAR_QUESTIONS_BLOCK_CACHE_SIZE = 65536
+
+@lru_cache(maxsize=SIMILAR_QUESTIONS_BLOCK_CACHE_SIZE)
+def render_similar_questions_block(similar_questions, include_solutions):
+    # similar_questions is a tuple of (question text, solution approach) pairs. a question's block is needed by
+    # relevance, the builder and the post mortem, so it's rendered once per list and solution flag. only the texts
+    # are the key, questions with the same list share the entry and a variant that reorders or truncates it gets its own.
+    if include_solutions:
+        return "\n\n".join([f"<SIMILAR_QUESTION_{idx + 1}>\n{text}\n</SIMILAR_QUESTION_{idx + 1}>\n<SOLUTION_APPROACH_{idx + 1}>\n{approach}\n</SOLUTION_APPROACH_{idx + 1}>" for idx, (text, approach) in enumerate(similar_questions)])
+    return "\n\n".join([f"<SIMILAR_QUESTION_{idx + 1}>\n{text}\n</SIMILAR_QUESTION_{idx + 1}>" for idx, (text, _) in enumerate(similar_questions)])
+
+def format_similar_questions(similar_questions, include_solutions):
+    key = tuple((sq['similar_question_text'], sq.get('summarized_solution_approach')) for sq in similar_questions)
+    return render_similar_questions_block(key, include_solutions)
+
+def estimate_prompt_tokens(user_prompt, system_prompt=""):
+    return estimate_text_tokens(system_prompt) + estimate_text_tokens(user_prompt)
+
 def format_insight_generation_prompt(success_analysis_arr, failure_analysis_arr):
     success_text = "\n".join([f"<analysis>{a['hypothesis']}</analysis>" for a in success_analysis_arr])
     failure_text = "\n".join([f"<analysis>{a['hypothesis']}</analysis>" for a in failure_analysis_arr])
     
-    return insight_generation_prompt.format(success_analysis = success_text, failure_analysis = failure_text)
+    return insight_generation_template.render(success_analysis = success_text, failure_analysis = failure_text)
+
+@lru_cache(maxsize=None)
+def format_solution_performance_analysis_system_prompt():
+    return solution_performance_analysis_template.render()
 
 def format_solution_performance_analysis_prompt(subject, outcome, performance_score, main_question, similar_questions, judge_evaluation):
-    formatted_similar_questions = "\n\n".join([f"<SIMILAR_QUESTION_{idx + 1}>\n{sq['similar_question_text']}\n</SIMILAR_QUESTION_{idx + 1}>\n<SOLUTION_APPROACH_{idx + 1}>\n{sq['summarized_solution_approach']}\n</SOLUTION_APPROACH_{idx + 1}>" for idx,sq in enumerate(similar_questions)])
+    formatted_similar_questions = format_similar_questions(similar_questions, True)
     
-    return solution_performance_analysis_prompt.format(subject=subject, outcome=outcome, performance_score=performance_score, main_question=main_question, similar_questions=formatted_similar_questions, judge_evaluation=judge_evaluation)
+    return solution_performance_analysis_user_template.render(subject=subject, outcome=outcome, performance_score=performance_score, main_question=main_question, similar_questions=formatted_similar_questions, judge_evaluation=judge_evaluation)
+
+@lru_cache(maxsize=None)
+def format_solution_comparison_system_prompt(subject):
+    return solution_comparison_template.render(subject=subject)
+
+def format_solution_comparison_multi_metric_system_prompt(subject, metrics) -> str:
+    return render_multi_metric_system_prompt(subject, tuple(metrics.items()))
 
-def format_solution_comparison_system_prompt_array(subject, metrics) -> dict[str, str]:
-    prompts = {}
-    for metric, description in metrics.items():
-        prompts[metric] = solution_comparison_prompt.format(subject=subject, metric=metric, metric_description=description)
-    return prompts
+@lru_cache(maxsize=None)
+def render_multi_metric_system_prompt(subject, metrics):
+    formatted_metrics = "\n\n".join([f"{metric}:\n{description}" for metric, description in metrics])
+    output_format = ",\n".join([f'    "{metric.lower()}": {{"winner": "SOLUTION_A" | "SOLUTION_B" | "TIE", "margin_of_winning": "A value between 0.0 and 1.0", "reasoning": "Your detailed reasoning for {metric}."}}' for metric, _ in metrics])
+    return solution_comparison_multi_metric_template.render(subject=subject, metrics=formatted_metrics, output_format=output_format)
 
-def format_solution_comparison_user_prompt(main_question, solution_a, solution_b):
-    return solution_comparison_user_prompt.format(main_question=main_question, solution_a_text=solution_a, solution_b_text=solution_b)
+def format_solution_comparison_user_prompt(main_question, solution_a, solution_b, metric=None, metric_description=None):
+    user_prompt = solution_comparison_user_template.render(main_question=main_question, solution_a_text=solution_a, solution_b_text=solution_b)
+    if metric is not None:
+        user_prompt += solution_comparison_metric_template.render(metric=metric, metric_description=metric_description)
+    return user_prompt
 
-def format_solution_builder_prompt(subject, main_question, similar_questions=[], with_similar=False):
+@lru_cache(maxsize=None)
+def format_solution_builder_system_prompt(subject, with_similar=False):
     if with_similar:
-        formatted_similar_questions = "\n\n".join([f"<SIMILAR_QUESTION_{idx + 1}>\n{sq['similar_question_text']}\n</SIMILAR_QUESTION_{idx + 1}>\n<SOLUTION_APPROACH_{idx + 1}>\n{sq['summarized_solution_approach']}\n</SOLUTION_APPROACH_{idx + 1}>" for idx,sq in enumerate(similar_questions)])
-        return solution_builder_with_similar_prompt.format(subject=subject, main_question=main_question, similar_questions=formatted_similar_questions)
+        return solution_builder_with_similar_template.render(subject=subject)
     else:
-        return solution_builder_prompt.format(subject=subject, main_question=main_question)
+        return solution_builder_template.render(subject=subject)
 
+def format_solution_builder_prompt(main_question, similar_questions=[], with_similar=False):
+    if with_similar:
+        formatted_similar_questions = format_similar_questions(similar_questions, True)
+        return solution_builder_with_similar_user_template.render(main_question=main_question, similar_questions=formatted_similar_questions)
+    else:
+        return solution_builder_user_template.render(main_question=main_question)
+
+@lru_cache(maxsize=None)
 def format_relevance_alignment_system_prompt(subject):
-    return relevance_alignment_system_prompt.format(subject=subject)
+    return relevance_alignment_template.render(subject=subject)
 
+@lru_cache(maxsize=None)
 def format_relevance_similarity_system_prompt(subject):
-    return relevance_similarity_system_prompt.format(subject=subject)
+    return relevance_similarity_template.render(subject=subject)
+
+@lru_cache(maxsize=None)
+def format_relevance_combined_system_prompt(subject):
+    return relevance_combined_template.render(subject=subject)
 
 def format_relevance_user_prompt(main_question, similar_questions, include_solutions = False):
-    if include_solutions:
-        formatted_similar_questions = "\n\n".join([f"<SIMILAR_QUESTION_{idx + 1}>\n{sq['similar_question_text']}\n</SIMILAR_QUESTION_{idx + 1}>\n<SOLUTION_APPROACH_{idx + 1}>\n{sq['summarized_solution_approach']}\n</SOLUTION_APPROACH_{idx + 1}>" for idx,sq in enumerate(similar_questions)])
-    else:
-        formatted_similar_questions = "\n\n".join([f"<SIMILAR_QUESTION_{idx + 1}>\n{sq['similar_question_text']}\n</SIMILAR_QUESTION_{idx + 1}>" for idx,sq in enumerate(similar_questions)])
+    formatted_similar_questions = format_similar_questions(similar_questions, include_solutions)
   
-    return relevance_user_prompt.format(main_question = main_question, similar_questions = formatted_similar_questions)
\ No newline at end of file
+    return relevance_user_template.render(main_question = main_question, similar_questions = formatted_similar_questions)
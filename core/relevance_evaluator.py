@@ -1,44 +1,115 @@
-import json
+import asyncio
 import os
-from tqdm import tqdm
-from core.prompts import format_relevance_similarity_system_prompt, format_relevance_alignment_system_prompt, format_relevance_user_prompt
-from core.datatypes import RelevanceSimilarity, RelevanceAlignment, RelevanceEvaluationReport
-from helpers.ai_provider import call_gemini
+from core.prompts import RELEVANCE_PROMPT_VERSION, format_relevance_similarity_system_prompt, format_relevance_alignment_system_prompt, format_relevance_combined_system_prompt, format_relevance_user_prompt
+from core.datatypes import RelevanceSimilarity, RelevanceAlignment, RelevanceEvaluation, RelevanceEvaluationReport, AppropriateAlignment
+from helpers.ai_provider import call_gemini, resolve_temperature, DEFAULT_MODEL
+from helpers.scheduler import get_scheduler
+from helpers.checkpoint import Checkpoint
+from helpers.utils import dump_json_array
+from helpers.dedupe import SharedWork
+from helpers.model_cascade import get_cascade, stage_models
 
 class RelevanceEvaluator():
-    def __init__(self, similar_questions_data, reports_dir):
+    def __init__(self, similar_questions_data, reports_dir, scheduler=None, resume=True, relevance_mode="separate", store=None, export_json=None, duplicates=None):
         self.dataset = similar_questions_data
         self.reports_dir = reports_dir   
+        self.scheduler = scheduler or get_scheduler()
+        self.resume = resume
+        # results also go to the ResultStore when given one, the pretty json report is then opt in
+        self.store = store
+        self.export_json = store is None if export_json is None else export_json
+        # "separate" runs the similarity and alignment calls concurrently, "fused" gets both in one call
+        if relevance_mode not in ("separate", "fused"):
+            raise ValueError("relevance_mode must be either 'separate' or 'fused'.")
+        self.relevance_mode = relevance_mode
+        # questions that are exact duplicates of each other (a DuplicateIndex) share one judgment
+        self.shared = SharedWork(duplicates)
+    
+    def checkpoint_settings(self):
+        # everything a judgment depends on besides the question, a checkpoint written under other settings is stale
+        return {"relevance_mode": self.relevance_mode, "models": stage_models("relevance", DEFAULT_MODEL), "temperature": resolve_temperature("relevance", 0.3), "prompts": RELEVANCE_PROMPT_VERSION}
+
+    def get_prompts(self, data):
+        # (system prompt, user prompt) of every call evaluate_question makes, also used to plan dry runs
+        subject = data['subject']
+        main_question = data['question_text']
+        similar_questions_array = data['similar_questions']
+        
+        if self.relevance_mode == "fused":
+            # alignment needs the solution approaches, so the fused prompt always includes them
+            return [(format_relevance_combined_system_prompt(subject=subject), format_relevance_user_prompt(main_question, similar_questions_array, True))]
+        return [
+            (format_relevance_similarity_system_prompt(subject=subject), format_relevance_user_prompt(main_question, similar_questions_array, False)),
+            (format_relevance_alignment_system_prompt(subject=subject), format_relevance_user_prompt(main_question, similar_questions_array, True))
+        ]
+    
+    async def evaluate_question(self, data):
+        result = await self.shared.run(data['question_id'], "with_similar", lambda: self.judge_relevance(data))
+        return {**result, "question_id": data['question_id']}
+    
+    @staticmethod
+    def relevance_uncertainty(response):
+        # why a cascade tier's judgment isn't trusted, None when it is. a PARTIAL alignment is the judge hedging
+        alignment = response.alignment if isinstance(response, RelevanceEvaluation) else response
+        if isinstance(alignment, RelevanceAlignment) and AppropriateAlignment.PARTIAL in (alignment.is_difficulty_appropriate, alignment.is_solution_approach_viable):
+            return "partial_alignment"
+        return None
+
+    async def relevance_call(self, user_prompt, system_prompt, response_schema, tags):
+        # (response, cascade tier or None)
+        cascade = get_cascade("relevance")
+        if cascade is None:
+            return await self.scheduler.call(call_gemini, user_prompt, system_prompt, response_schema, temperature=0.3, tags=tags), None
+        return await cascade.call(self.scheduler, self.relevance_uncertainty, user_prompt, system_prompt, response_schema, 0.3, tags)
+
+    async def judge_relevance(self, data):
+        question_id = data['question_id']
+        prompts = self.get_prompts(data)
+        
+        if self.relevance_mode == "fused":
+            (system_prompt, user_prompt), = prompts
+            relevance_eval, tier = await self.relevance_call(user_prompt, system_prompt, RelevanceEvaluation, tags={"stage": "relevance", "question_id": question_id, "metric": "FUSED"})
+            relevance_similarity, relevance_alignment = relevance_eval.similarity, relevance_eval.alignment
+            tiers = {"FUSED": tier}
+        else:
+            # similarity and alignment are independent, so both are sent together
+            (similarity_system_prompt, similarity_user_prompt), (alignment_system_prompt, alignment_user_prompt) = prompts
+            (relevance_similarity, similarity_tier), (relevance_alignment, alignment_tier) = await asyncio.gather(
+                self.relevance_call(similarity_user_prompt, similarity_system_prompt, RelevanceSimilarity, tags={"stage": "relevance", "question_id": question_id, "metric": "SIMILARITY"}),
+                self.relevance_call(alignment_user_prompt, alignment_system_prompt, RelevanceAlignment, tags={"stage": "relevance", "question_id": question_id, "metric": "ALIGNMENT"})
+            )
+            tiers = {"SIMILARITY": similarity_tier, "ALIGNMENT": alignment_tier}
+        
+        final_eval = RelevanceEvaluationReport(
+            question_id=question_id,
+            similarity=relevance_similarity,
+            alignment=relevance_alignment
+        ).model_dump(mode="json")
+        if any(tier is not None for tier in tiers.values()):
+            # cascade tier that gave each judgment, 0 is the first (cheapest) tier
+            final_eval["relevance_tiers"] = tiers
+        return final_eval
              
     async def evaluate(self):
         print("========= Starting Relevance Evaluation =========")
-        results_arr = []
-        
-        for data in tqdm(self.dataset, desc="Evaluating Relevance", unit="Question"):
-            subject = data['subject']
-            question_id = data['question_id']
-            main_question = data['question_text']
-            similar_questions_array = data['similar_questions']
-            
-            # check similarity first 
-            system_prompt = format_relevance_similarity_system_prompt(subject=subject)
-            user_prompt = format_relevance_user_prompt(main_question, similar_questions_array, False)
-            relevance_similarity: RelevanceSimilarity = await call_gemini(user_prompt, system_prompt, RelevanceSimilarity, temperature=0.3)
-            
-            # check alignment then
-            system_prompt = format_relevance_alignment_system_prompt(subject=subject)
-            user_prompt = format_relevance_user_prompt(main_question, similar_questions_array, True)
-            relevance_alignment: RelevanceAlignment = await call_gemini(user_prompt, system_prompt, RelevanceAlignment, temperature=0.3)
-            
-            final_eval = RelevanceEvaluationReport(
-                question_id=question_id,
-                similarity=relevance_similarity,
-                alignment=relevance_alignment
-            )
-            results_arr.append(final_eval.model_dump(mode="json"))
+        # every finished question is appended to the checkpoint, so a crash only loses the questions in flight
+        with Checkpoint(os.path.join(self.reports_dir, "relevance_eval_report.jsonl"), resume=self.resume, settings=self.checkpoint_settings()) as checkpoint:
+            if checkpoint.invalidated and self.store is not None:
+                self.store.clear("relevance")
+            async def evaluate_and_checkpoint(data):
+                checkpoint.append(await self.evaluate_question(data))
             
-        # can think of some better way of saving checkpoint
-        with open(os.path.join(self.reports_dir, "relevance_eval_report.json"),"w") as f:
-            json.dump(results_arr, f, indent=2, ensure_ascii=False)
+            pending = checkpoint.pending(self.dataset)
+            self.shared.expect([data['question_id'] for data in pending], "with_similar")
+            question_ids = [data['question_id'] for data in self.dataset]
+            try:
+                await self.scheduler.map(evaluate_and_checkpoint, pending, desc="Evaluating Relevance", unit="Question")
+            finally:
+                # the store is derived from the checkpoint, questions finished before a failure get there too
+                if self.store is not None:
+                    self.store.sync_from_checkpoint("relevance", checkpoint, question_ids, self.store.put_relevance)
+            if self.export_json:
+                with open(os.path.join(self.reports_dir, "relevance_eval_report.json"),"w") as f:
+                    dump_json_array(checkpoint.iter_ordered(question_ids), f)
             
-        print("========= Relevance Evaluation Complete, check relevance_eval file for full report. =========")
\ No newline at end of file
+        print("========= Relevance Evaluation Complete, check relevance_eval file for full report. =========")
@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# runs the pipeline over a dataset too large for one event loop. questions are split into shards by a hash of
+# their question_id, every shard runs in its own process with its own event loop, http pool and rate limiter
+# share, and writes to its own directory. the assignment only depends on the question_id and the shard count,
+# so shards can be spread over machines that share the reports directory, and a failed shard is rerun alone.
+#
+#   python -m core.sharded_runner --num-shards 16 --processes 8            # every unfinished shard, then merge
+#   python -m core.sharded_runner --num-shards 16 --shards 3 11 --no-merge # just these, e.g. on another machine
+#   python -m core.sharded_runner --num-shards 16 --merge-only             # combine the finished shards
+
+SUCCESS_MARKER = "_SUCCESS.json"
+
+def get_shard_dir(reports_dir, shard_index, num_shards):
+    return os.path.join(reports_dir, "shards", f"shard_{shard_index:03d}_of_{num_shards:03d}")
+
+def is_shard_done(reports_dir, shard_index, num_shards):
+    return os.path.exists(os.path.join(get_shard_dir(reports_dir, shard_index, num_shards), SUCCESS_MARKER))
+
+def env_flag(name, default=""):
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+async def run_shard(data_path, reports_dir, shard_index, num_shards, concurrency):
+    # imported here so the rate limiter and clients are built after the worker's env is in place
+    from core.pipeline import Pipeline
+    from helpers.ai_provider import close_providers
+    from helpers.dataloader import Dataloader
+    from helpers.model_cascade import cascade_summary
+    from helpers.result_store import ResultStore
+    from helpers.scheduler import Scheduler
+    from helpers.telemetry import configure_telemetry
+
+    shard_dir = get_shard_dir(reports_dir, shard_index, num_shards)
+    os.makedirs(shard_dir, exist_ok=True)
+    telemetry = configure_telemetry(trace_path=os.path.join(shard_dir, "llm_trace.jsonl"))
+
+    # the shard's questions are streamed out of the dataset file, no process ever holds the whole dataset
+    questions = Dataloader(data_path, streaming=True).iter_dataset(shard_index=shard_index, num_shards=num_shards)
+    with ResultStore(os.path.join(shard_dir, "results.sqlite")) as store:
+        pipeline = Pipeline(
+            questions=questions,
+            reports_dir=shard_dir,
+            scheduler=Scheduler(concurrency=concurrency),
+            judge_mode=os.environ.get("JUDGE_MODE", "per_metric"),
+            relevance_mode=os.environ.get("RELEVANCE_MODE", "separate"),
+            store=store,
+            export_json=False,
+            judge_early_exit=env_flag("JUDGE_EARLY_EXIT"),
+            judge_position_swap=env_flag("JUDGE_POSITION_SWAP"),
+            judge_cascade_margin=float(os.environ.get("JUDGE_CASCADE_MARGIN", 0.2))
+        )
+        await pipeline.run()
+        num_questions = store.count("questions")
+
+    summary = telemetry.summary()
+    telemetry.close()
+    await close_providers()
+
+    result = {
+        "shard_index": shard_index,
+        "num_shards": num_shards,
+        "questions": num_questions,
+        "wall_time_s": summary["wall_time_s"],
+        "total_tokens": summary["total_tokens"],
+        "estimated_cost_usd": summary["estimated_cost_usd"],
+        # routing decisions of the LLM_CASCADES model cascades, per tier latency and cost are in the merged summary
+        "cascades": cascade_summary(),
+        "finished_at": time.time()
+    }
+    # written last, a shard without it is unfinished and gets picked up again (resuming from its checkpoints)
+    with open(os.path.join(shard_dir, SUCCESS_MARKER), "w") as f:
+        json.dump(result, f, indent=2)
+    return result
+
+def run_shard_process(data_path, reports_dir, shard_index, num_shards, concurrency, env):
+    # entry point of a worker process, everything async lives and dies in this process's own loop
+    os.environ.update(env)
+    return asyncio.run(run_shard(data_path, reports_dir, shard_index, num_shards, concurrency))
+
+def get_worker_env(processes):
+    # the rpm/tpm budget is per machine, split it between the shards running side by side on it
+    env = {}
+    for name in ("LLM_RPM", "LLM_TPM"):
+        if os.environ.get(name):
+            env[name] = str(max(1, int(os.environ[name]) // processes))
+    if processes > 1:
+        # interleaved progress bars from several processes are unreadable, each shard reports when it's done
+        env["TQDM_DISABLE"] = "1"
+    return env
+
+def run_shards(data_path, reports_dir, shard_indices, num_shards, processes, concurrency):
+    env = get_worker_env(processes)
+    failed = []
+    print(f"========= Running {len(shard_indices)} of {num_shards} shards in {processes} processes =========")
+    # spawn, not fork, so no worker inherits an event loop, http pool or lock from the parent
+    with ProcessPoolExecutor(max_workers=processes, mp_context=get_context("spawn")) as executor:
+        futures = {
+            executor.submit(run_shard_process, data_path, reports_dir, shard_index, num_shards, concurrency, env): shard_index
+            for shard_index in shard_indices
+        }
+        for future in as_completed(futures):
+            shard_index = futures[future]
+            try:
+                result = future.result()
+                print(f"Shard {shard_index}: {result['questions']} questions in {result['wall_time_s']:.1f}s, {result['total_tokens']} tokens, ${result['estimated_cost_usd']:.4f}")
+            except Exception as e:
+                failed.append(shard_index)
+                print(f"Shard {shard_index} failed, its finished questions are checkpointed. Error: {type(e).__name__}: {e}")
+    return sorted(failed)
+
+async def merge_shards(data_path, reports_dir, num_shards, export_json=False, generate_insights=True):
+    from core.comparative_analyzer import ComparativeAnalyzer
+    from core.solution_builder import COMPARED_VARIANTS
+    from helpers.ai_provider import close_providers
+    from helpers.dataloader import Dataloader
+    from helpers.dedupe import DuplicateIndex
+    from helpers.result_store import ResultStore
+    from helpers.scheduler import Scheduler
+    from helpers.telemetry import Telemetry, configure_telemetry
+
+    missing = [shard_index for shard_index in range(num_shards) if not is_shard_done(reports_dir, shard_index, num_shards)]
+    if missing:
+        raise RuntimeError(f"Shards {missing} of {num_shards} have not finished, rerun them with --shards {' '.join(map(str, missing))}.")
+
+    print(f"========= Merging {num_shards} shards =========")
+    with ResultStore(os.environ.get("RESULT_STORE_PATH") or os.path.join(reports_dir, "results.sqlite")) as store:
+        # questions go in first and in dataset order, the merged reports follow the input file rather than shard order
+        batch = []
+        for data in Dataloader(data_path, streaming=True).iter_dataset():
+            batch.append(data)
+            if len(batch) >= store.commit_every:
+                store.put_questions(batch)
+                batch = []
+        store.put_questions(batch)
+        for shard_index in range(num_shards):
+            store.merge_from(os.path.join(get_shard_dir(reports_dir, shard_index, num_shards), "results.sqlite"))
+
+        # shards stream their questions and evaluate duplicates separately, the report still covers the whole dataset
+        dataset = list(store.iter_records("questions"))
+        duplicates = DuplicateIndex(dataset)
+        duplicates.print_stats()
+        with open(os.path.join(reports_dir, "dedupe_report.json"), "w") as f:
+            json.dump(duplicates.report(), f, indent=2, ensure_ascii=False)
+
+        if export_json:
+            store.export_json(reports_dir)
+            print("========= Merged json reports exported. =========")
+
+        trace_paths = [os.path.join(get_shard_dir(reports_dir, shard_index, num_shards), "llm_trace.jsonl") for shard_index in range(num_shards)]
+        if generate_insights:
+            insights_trace = os.path.join(reports_dir, "llm_trace_insights.jsonl")
+            telemetry = configure_telemetry(trace_path=insights_trace)
+            comparative_analyzer = ComparativeAnalyzer(
+                similar_question_data=dataset,
+                generated_solutions_w_similar=store.get_solutions(COMPARED_VARIANTS[1]),
+                generated_solutions_wo_similar=store.get_solutions(COMPARED_VARIANTS[0]),
+                reports_dir=reports_dir,
+                scheduler=Scheduler(concurrency=int(os.environ.get("LLM_CONCURRENCY", 8))),
+                store=store,
+                export_json=export_json,
+                dedupe_stats=duplicates.stats
+            )
+            await comparative_analyzer.generate_insights()
+            telemetry.close()
+            await close_providers()
+            trace_paths.append(insights_trace)
+
+    # one summary over every shard's calls, wall time is the span of the whole sharded run
+    summary = Telemetry.from_traces(trace_paths).print_summary()
+    summary["dedupe"] = duplicates.stats
+    with open(os.path.join(reports_dir, "llm_call_summary.json"), "w") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    print("========= Merge Complete, check reports directory for full reports. =========")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the evaluation pipeline over question_id hash shards in separate processes.")
+    parser.add_argument("--data", default="similar_question_data.json", help="Dataset file, json array or jsonl.")
+    parser.add_argument("--reports-dir", default="reports")
+    parser.add_argument("--num-shards", type=int, required=True, help="Total number of shards, must stay the same across reruns and machines.")
+    parser.add_argument("--shards", type=int, nargs="+", help="Shard indices to run on this machine, defaults to every unfinished shard.")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Shards run side by side on this machine.")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get("LLM_CONCURRENCY", 8)), help="Calls in flight per shard.")
+    parser.add_argument("--force", action="store_true", help="Rerun shards that already finished (they still resume from their checkpoints).")
+    parser.add_argument("--no-merge", action="store_true", help="Only run shards, merge later with --merge-only.")
+    parser.add_argument("--merge-only", action="store_true")
+    parser.add_argument("--skip-insights", action="store_true", help="Merge the results without generating insights.")
+    parser.add_argument("--export-json", action="store_true", default=env_flag("EXPORT_JSON"), help="Also export the pretty json reports when merging, the merged result store has everything.")
+    args = parser.parse_args()
+
+    if not args.merge_only:
+        shard_indices = args.shards if args.shards is not None else list(range(args.num_shards))
+        invalid = [shard_index for shard_index in shard_indices if not 0 <= shard_index < args.num_shards]
+        if invalid:
+            parser.error(f"Shard indices {invalid} are outside 0..{args.num_shards - 1}.")
+        if not args.force:
+            shard_indices = [shard_index for shard_index in shard_indices if not is_shard_done(args.reports_dir, shard_index, args.num_shards)]
+        processes = max(1, min(args.processes, len(shard_indices)))
+        failed = run_shards(args.data, args.reports_dir, shard_indices, args.num_shards, processes, args.concurrency) if shard_indices else []
+        if failed:
+            print(f"========= Shards {failed} failed, rerun them with --shards {' '.join(map(str, failed))} =========")
+            sys.exit(1)
+
+    if args.no_merge:
+        return
+    pending = [shard_index for shard_index in range(args.num_shards) if not is_shard_done(args.reports_dir, shard_index, args.num_shards)]
+    if pending and not args.merge_only:
+        # other machines are still working on these, whoever finishes last merges
+        print(f"========= Shards {pending} are still unfinished, merge with --merge-only once they are done =========")
+        return
+    asyncio.run(merge_shards(args.data, args.reports_dir, args.num_shards, export_json=args.export_json, generate_insights=not args.skip_insights))
+
+if __name__ == "__main__":
+    main()
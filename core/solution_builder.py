@@ -1,52 +1,173 @@
-import json
+import asyncio
 import os
-from tqdm import tqdm
-from core.prompts import format_solution_builder_prompt
+import random
+from core.prompts import BUILD_PROMPT_VERSION, format_solution_builder_system_prompt, format_solution_builder_prompt
 from core.datatypes import Solution, GeneratedSolution
-from helpers.ai_provider import call_gemini
+from helpers.ai_provider import call_gemini, resolve_temperature, DEFAULT_MODEL
+from helpers.scheduler import get_scheduler
+from helpers.checkpoint import Checkpoint, make_fingerprint
+from helpers.dedupe import SharedWork
+from helpers.utils import dump_json_array
+from helpers.model_cascade import stage_models
+
+# the pair of variants the comparative analysis judges against each other, every variant set has to include both
+COMPARED_VARIANTS = ("without_similar", "with_similar")
 
 class SolutionBuilder():
-    def __init__(self, similar_question_data, reports_dir):
+    def __init__(self, similar_question_data, reports_dir, scheduler=None, resume=True, solution_variants=None, store=None, export_json=None, on_partial_solution=None, duplicates=None):
         self.dataset = similar_question_data
         self.reports_dir = reports_dir
-        
+        self.scheduler = scheduler or get_scheduler()
+        self.resume = resume
+        # results also go to the ResultStore when given one, the pretty json reports are then opt in
+        self.store = store
+        self.export_json = store is None if export_json is None else export_json
+        # with streaming on (LLM_STREAMING), called as on_partial_solution(question_id, variant, text so far) while a
+        # solution is generated, so consumers can start on it before the response is complete
+        self.on_partial_solution = on_partial_solution
+        # questions that are exact duplicates of each other (a DuplicateIndex) share one solution per variant
+        self.shared = SharedWork(duplicates)
+
+        # define prompting variants, this is dynamic, can be extended or modified.
+        # with_similar - include similar questions in the prompt at all
+        # num_similar - only use the first k similar questions, None for all of them
+        # order - "original", "reversed" or "shuffled" (with seed) order of the similar questions
+        # output_file - where the variant's solutions are exported, defaults to generated_solutions_<variant>.json
+        self.solution_variants = solution_variants or {
+            "without_similar": {"with_similar": False, "output_file": "generated_solutions_wo_similar.json"},
+            "with_similar": {"with_similar": True, "output_file": "generated_solutions_w_similar.json"}
+        }
+        missing = [variant for variant in COMPARED_VARIANTS if variant not in self.solution_variants]
+        if missing:
+            raise ValueError(f"solution_variants must include the compared variants {', '.join(COMPARED_VARIANTS)}, missing {', '.join(missing)}.")
+
+    def checkpoint_settings(self):
+        # everything every variant depends on besides the question, a checkpoint written under other settings is stale
+        return {"models": stage_models("build", DEFAULT_MODEL), "temperature": resolve_temperature("build", 0.1), "prompts": BUILD_PROMPT_VERSION}
+
+    def variant_fingerprint(self, variant):
+        # a variant whose config changed since its solution was built counts as missing, output files don't matter
+        return make_fingerprint({key: value for key, value in self.solution_variants[variant].items() if key != "output_file"})
+
+    def get_output_file(self, variant):
+        return self.solution_variants[variant].get("output_file", f"generated_solutions_{variant}.json")
+
+    def select_similar_questions(self, question_id, similar_questions, config):
+        similar_questions = list(similar_questions)
+        order = config.get("order", "original")
+        if order == "reversed":
+            similar_questions.reverse()
+        elif order == "shuffled":
+            # seeded per question so reruns (and the response cache) see the same ordering
+            random.Random(f"{config.get('seed', 0)}:{question_id}").shuffle(similar_questions)
+        if config.get("num_similar") is not None:
+            similar_questions = similar_questions[:config["num_similar"]]
+        return similar_questions
+
+    def get_prompts(self, data, variant):
+        # (system prompt, user prompt) of the variant's call, also used to plan dry runs
+        config = self.solution_variants[variant]
+        question_id = data['question_id']
+        main_question = data['question_text']
+
+        if config["with_similar"]:
+            similar_questions_array = self.select_similar_questions(question_id, data['similar_questions'], config)
+            user_prompt = format_solution_builder_prompt(main_question, similar_questions_array, with_similar=True)
+        else:
+            user_prompt = format_solution_builder_prompt(main_question, with_similar=False)
+        return format_solution_builder_system_prompt(data['subject'], with_similar=config["with_similar"]), user_prompt
+
+    def shared_kind(self, variant):
+        # the duplicate work a variant's solution is shared by, None when duplicates don't get the same prompt
+        config = self.solution_variants[variant]
+        if config["with_similar"] and config.get("order") == "shuffled":
+            # shuffled per question_id
+            return None
+        return "with_similar" if config["with_similar"] else "question"
+
+    def expect_shared(self, checkpoint, questions):
+        # a variant is only shared among the questions this run builds it for
+        missing = {data['question_id']: self.missing_variants(checkpoint, data['question_id']) for data in questions}
+        for variant in self.solution_variants:
+            kind = self.shared_kind(variant)
+            if kind is not None:
+                self.shared.expect([question_id for question_id, variants in missing.items() if variant in variants], kind, scope=variant)
+
+    async def build_variant(self, data, variant):
+        kind = self.shared_kind(variant)
+        if kind is None:
+            return await self.generate_variant(data, variant)
+        solution = await self.shared.run(data['question_id'], kind, lambda: self.generate_variant(data, variant), scope=variant)
+        return {**solution, "question_id": data['question_id']}
+
+    async def generate_variant(self, data, variant):
+        config = self.solution_variants[variant]
+        question_id = data['question_id']
+        system_prompt, user_prompt = self.get_prompts(data, variant)
+
+        on_partial = None
+        if self.on_partial_solution is not None:
+            def on_partial(partial):
+                if "generated_solution" in partial:
+                    self.on_partial_solution(question_id, variant, partial["generated_solution"])
+
+        response = await self.scheduler.call(call_gemini, user_prompt, system_prompt, Solution, temperature=0.1, tags={"stage": "build", "question_id": question_id, "metric": variant.upper()}, on_partial=on_partial)
+        solution = GeneratedSolution(
+            **response.model_dump(),
+            question_id=question_id,
+            was_solved_with_similar_questions=config["with_similar"]
+        )
+        return solution.model_dump(mode="json")
+
+    async def build_question(self, data, variants=None):
+        # variants are independent of each other, so all of them are issued together
+        variants = variants or list(self.solution_variants)
+        solutions = await asyncio.gather(*[self.build_variant(data, variant) for variant in variants])
+        return {"question_id": data['question_id'], **dict(zip(variants, solutions)), "variant_settings": {variant: self.variant_fingerprint(variant) for variant in variants}}
+
+    def missing_variants(self, checkpoint, question_id):
+        if not checkpoint.is_done(question_id):
+            return list(self.solution_variants)
+        record = checkpoint.get(question_id)
+        built = record.get("variant_settings", {})
+        return [variant for variant in self.solution_variants if variant not in record or built.get(variant) != self.variant_fingerprint(variant)]
+
+    def merge_record(self, checkpoint, record):
+        # newly built variants on top of what the checkpoint already has for the question
+        if not checkpoint.is_done(record['question_id']):
+            return record
+        previous = checkpoint.get(record['question_id'])
+        return {**previous, **record, "variant_settings": {**previous.get("variant_settings", {}), **record["variant_settings"]}}
+
     async def build_solution(self):
         print("========= Starting Solution Building =========")
-        solutions_arr = []
-        solutions_with_similar_arr = []
-        
-        for data in tqdm(self.dataset, desc="Building Solutions", unit="Question"):
-            subject = data['subject']
-            question_id = data['question_id']
-            main_question = data['question_text']
-            similar_questions_array = data['similar_questions']
-            
-            # separate prompts for generating solutions with and without similar questions
-            user_prompt = format_solution_builder_prompt(subject, main_question, with_similar=False)
-            user_prompt_with_similar = format_solution_builder_prompt(subject, main_question, similar_questions_array, with_similar=True)
-            
-            # generate both solutions and append to respective arrays
-            response = await call_gemini(user_prompt, response_schema=Solution, temperature=0.1)
-            solution = GeneratedSolution(
-                **response.model_dump(),
-                question_id=question_id,
-                was_solved_with_similar_questions=False
-            )
-            solutions_arr.append(solution.model_dump(mode="json"))
-        
-            response = await call_gemini(user_prompt_with_similar, response_schema=Solution, temperature=0.1)
-            solution_with_similar = GeneratedSolution(
-                **response.model_dump(),
-                question_id=question_id,
-                was_solved_with_similar_questions=True
-            )
-            solutions_with_similar_arr.append(solution_with_similar.model_dump(mode="json"))    
-            
-        # can think of some better way of saving checkpoint
-        with open(os.path.join(self.reports_dir,"generated_solutions_wo_similar.json"),"w") as f:
-            json.dump(solutions_arr, f, indent=2, ensure_ascii=False)
-        with open(os.path.join(self.reports_dir,"generated_solutions_w_similar.json"),"w") as f:
-            json.dump(solutions_with_similar_arr, f, indent=2, ensure_ascii=False)
-                
+        # all variants of a question are checkpointed together, so a resumed run never has half a set.
+        # variants added or reconfigured since the last run are built for the questions that are missing them
+        with Checkpoint(os.path.join(self.reports_dir, "generated_solutions.jsonl"), resume=self.resume, settings=self.checkpoint_settings()) as checkpoint:
+            if checkpoint.invalidated and self.store is not None:
+                self.store.clear("solutions")
+            async def build_and_checkpoint(data):
+                question_id = data['question_id']
+                missing = self.missing_variants(checkpoint, question_id)
+                checkpoint.append(self.merge_record(checkpoint, await self.build_question(data, missing)))
+
+            pending = [data for data in self.dataset if self.missing_variants(checkpoint, data['question_id'])]
+            self.expect_shared(checkpoint, pending)
+            question_ids = [data['question_id'] for data in self.dataset]
+            try:
+                await self.scheduler.map(build_and_checkpoint, pending, desc="Building Solutions", unit="Question")
+            finally:
+                # the store is derived from the checkpoint, questions finished before a failure get there too
+                if self.store is not None:
+                    self.store.sync_from_checkpoint("solutions", checkpoint, question_ids, self.store.put_solutions)
+            results = checkpoint.ordered(question_ids)
+
+        # split the records into one array per variant, order follows the dataset
+        self.variant_solutions = {variant: [result[variant] for result in results] for variant in self.solution_variants}
+        if self.export_json:
+            for variant, solutions in self.variant_solutions.items():
+                with open(os.path.join(self.reports_dir, self.get_output_file(variant)),"w") as f:
+                    dump_json_array(solutions, f)
+
         print("========= Solution Building Complete, check generated_solutions files for solutions. =========")
-        return solutions_arr, solutions_with_similar_arr
+        return tuple(self.variant_solutions[variant] for variant in COMPARED_VARIANTS)
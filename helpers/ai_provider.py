@@ -1,28 +1,267 @@
 import asyncio
-from openai import AsyncOpenAI
+import hashlib
+import importlib.util
+import itertools
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, RateLimitError
 import os 
 from dotenv import load_dotenv
 from pydantic import ValidationError
+from helpers.rate_limiter import get_rate_limiter, is_retryable, get_retry_after, backoff_delay, estimate_tokens
+from helpers.context_cache import ContextCache, get_context_cache_settings
+from helpers.telemetry import get_telemetry, call_queued_at
+from helpers.json_stream import StreamingJSONValidator, MalformedStreamError
 load_dotenv()
 
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/"
+
 class AIProvider():
-    def __init__(self):
-        self.client = AsyncOpenAI(
-            api_key=os.environ['GEMINI_API_KEY'],
-            base_url="https://generativelanguage.googleapis.com/v1beta/"
+    # one shared, tuned http connection pool per provider, with an AsyncOpenAI client per api key on top of it.
+    # get_client() round robins over the keys so throughput can go past a single key's quota
+    # (set LLM_RPM/LLM_TPM to the combined quota of all keys).
+    def __init__(self, api_keys=None, base_url=None, max_connections=None, max_keepalive_connections=None, keepalive_expiry=None, http2=None, timeout=None):
+        if isinstance(api_keys, str):
+            api_keys = [api_keys]
+        api_keys = api_keys or get_api_keys_from_env()
+        if not api_keys:
+            raise ValueError("No API key configured, set GEMINI_API_KEY (or GEMINI_API_KEYS for several keys).")
+        
+        # http2 needs h2 (the httpx[http2] dependency), fall back to http/1.1 keep-alive where it isn't installed
+        if http2 is None:
+            http2 = os.environ.get("LLM_HTTP2", "true").lower() in ("1", "true", "yes")
+        if http2 and importlib.util.find_spec("h2") is None:
+            print("LLM_HTTP2 is on but the h2 package is not installed (pip install 'httpx[http2]'), using HTTP/1.1.")
+            http2 = False
+        
+        self.api_keys = api_keys
+        self.base_url = base_url
+        self.http2 = http2
+        self.limits = httpx.Limits(
+            max_connections=max_connections or int(os.environ.get("LLM_MAX_CONNECTIONS", 200)),
+            max_keepalive_connections=max_keepalive_connections or int(os.environ.get("LLM_MAX_KEEPALIVE_CONNECTIONS", 100)),
+            keepalive_expiry=keepalive_expiry or float(os.environ.get("LLM_KEEPALIVE_EXPIRY", 60))
         )
+        self.timeout = timeout or float(os.environ.get("LLM_TIMEOUT", 600))
+        self.loop = None
+        self.context_cache = None
+        # pools replaced on a loop change, closing in the background
+        self.closing = set()
+        self.build_clients()
+    
+    def build_clients(self):
+        self.http_client = DefaultAsyncHttpxClient(http2=self.http2, limits=self.limits, timeout=self.timeout)
+        # LLM_BASE_URL points the client at any openai compatible endpoint, e.g. the local mock server
+        self.clients = [
+            AsyncOpenAI(
+                api_key=api_key,
+                base_url=self.base_url or os.environ.get("LLM_BASE_URL", GEMINI_BASE_URL),
+                http_client=self.http_client,
+                # retries are handled by call_gemini and the rate limiter, sdk retries would hide 429s from them
+                max_retries=0
+            )
+            for api_key in self.api_keys
+        ]
+        self.next_client = itertools.cycle(self.clients)
+        
+        if self.context_cache is not None:
+            # uploaded entries outlive the pool, keep using them on the new one
+            self.context_cache.rebind(self.http_client)
+        else:
+            context_cache_settings = get_context_cache_settings()
+            self.context_cache = ContextCache(self.http_client, **context_cache_settings) if context_cache_settings else None
+    
     def get_client(self):
-        return self.client
+        # pooled connections belong to the event loop they were opened on, a later asyncio.run in the same
+        # process (benchmark passes, sharded workers) gets a fresh pool instead of dead connections
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None and loop is not self.loop:
+            if self.loop is not None:
+                stale_http_client = self.http_client
+                self.build_clients()
+                task = loop.create_task(self.close_stale(stale_http_client))
+                self.closing.add(task)
+                task.add_done_callback(self.closing.discard)
+            self.loop = loop
+        return next(self.next_client)
+
+    @staticmethod
+    async def close_stale(http_client):
+        # the old pool's connections belong to a loop that is gone, close what can be closed and drop the rest
+        try:
+            await http_client.aclose()
+        except Exception:
+            pass
+    
+    async def close(self):
+        if self.context_cache is not None:
+            await self.context_cache.close()
+        await self.http_client.aclose()
+
+def get_api_keys_from_env():
+    keys = os.environ.get("GEMINI_API_KEYS") or os.environ.get("GEMINI_API_KEY") or ""
+    return [key.strip() for key in keys.split(",") if key.strip()]
+
+# providers are only built on first use, so importing core.* needs neither the env vars nor the client setup
+providers = {}
+# stage -> (provider name, model override), lets e.g. the judge run on a different endpoint or model
+stage_routes = {}
+# stage -> temperature, overrides the temperature the stage calls with
+stage_temperatures = {}
+
+def route_stage(stage, provider_name="default", model=None):
+    stage_routes[stage] = (provider_name, model)
+
+def load_stage_routes_from_env():
+    # LLM_STAGE_ROUTES="compare=judge:gemini-2.5-flash,build=default", provider and model are both optional
+    for route in os.environ.get("LLM_STAGE_ROUTES", "").split(","):
+        if "=" not in route:
+            continue
+        stage, target = (part.strip() for part in route.split("=", 1))
+        provider_name, _, model = target.partition(":")
+        route_stage(stage, provider_name or "default", model or None)
+
+def resolve_route(stage, model):
+    provider_name, routed_model = stage_routes.get(stage, ("default", None))
+    return provider_name, routed_model or model
+
+def set_stage_temperature(stage, temperature):
+    stage_temperatures[stage] = temperature
+
+def resolve_temperature(stage, temperature):
+    return stage_temperatures.get(stage, temperature)
+
+load_stage_routes_from_env()
+
+def get_provider(name="default"):
+    if name not in providers:
+        providers[name] = AIProvider() if name == "default" else build_provider_from_env(name)
+    return providers[name]
+
+def build_provider_from_env(name):
+    # a named provider is configured through LLM_PROVIDER_<NAME>_BASE_URL and LLM_PROVIDER_<NAME>_API_KEYS
+    prefix = f"LLM_PROVIDER_{name.upper()}_"
+    base_url = os.environ.get(prefix + "BASE_URL")
+    api_keys = [key.strip() for key in os.environ.get(prefix + "API_KEYS", "").split(",") if key.strip()]
+    if base_url is None and not api_keys:
+        raise ValueError(f"Unknown AI provider '{name}', set {prefix}BASE_URL / {prefix}API_KEYS.")
+    return AIProvider(api_keys=api_keys or None, base_url=base_url)
+
+def get_ai_client(provider_name="default"):
+    return get_provider(provider_name).get_client()
+
+async def close_providers():
+    for provider in providers.values():
+        await provider.close()
+    providers.clear()
+
+class ResponseCache():
+    # content addressed cache of responses, keyed by a hash of the full request.
+    # backed by sqlite so it survives runs, with ttl and max entries eviction.
+    def __init__(self, path, ttl_seconds=30 * 24 * 3600, max_entries=200_000, memory_entries=1024):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # lru of the parsed objects used most recently, hits here skip the re-parse. bounded so memory stays flat
+        # on large datasets, everything else is read back from sqlite
+        self.memory = OrderedDict()
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, schema TEXT, payload TEXT, created_at REAL, accessed_at REAL)")
+        self.conn.commit()
+        self.evict()
+    
+    @staticmethod
+    def make_key(provider_name, model, temperature, messages, response_schema, extra_body):
+        # the provider is part of the key, two endpoints serving the same model name don't share responses
+        request = {
+            "provider": provider_name,
+            "model": model,
+            "temperature": temperature,
+            "messages": messages,
+            "response_schema": response_schema.__name__ if response_schema else None,
+            "response_schema_json": response_schema.model_json_schema() if response_schema else None,
+            "extra_body": extra_body
+        }
+        return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+    
+    def get(self, key, response_schema=None):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+        
+        row = self.conn.execute("SELECT payload, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or (self.ttl_seconds and time.time() - row[1] > self.ttl_seconds):
+            self.misses += 1
+            return None
+        
+        self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+        value = response_schema.model_validate_json(row[0]) if response_schema else json.loads(row[0])
+        self.remember(key, value)
+        self.hits += 1
+        return value
+    
+    def set(self, key, value, response_schema=None):
+        payload = value.model_dump_json() if response_schema else json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, schema, payload, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, response_schema.__name__ if response_schema else None, payload, now, now)
+        )
+        self.conn.commit()
+        self.remember(key, value)
 
-provider = AIProvider()
+    def remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+    
+    def evict(self):
+        if self.ttl_seconds:
+            self.conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        if self.max_entries:
+            # drop the least recently used entries above the limit
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        self.conn.commit()
+    
+    def clear(self):
+        self.memory.clear()
+        self.conn.execute("DELETE FROM responses")
+        self.conn.commit()
+
+response_cache = None
+
+def get_response_cache():
+    global response_cache
+    if os.environ.get("LLM_CACHE_DISABLED", "").lower() in ("1", "true", "yes"):
+        return None
+    if response_cache is None:
+        response_cache = ResponseCache(os.environ.get("LLM_CACHE_PATH", os.path.join(".cache", "llm_responses.sqlite")))
+    return response_cache
 
-def get_ai_client():
-    return provider.get_client()
+DEFAULT_MODEL = "gemini-2.5-flash-lite"
 
-async def call_gemini(user_message, system_message="", response_schema = None, model="gemini-2.5-flash-lite", temperature = 0.65):
-    client = get_ai_client()
-    max_attempts = 3
-    messages = [
+def build_messages(user_message, system_message=""):
+    return [
         {
             "role": "system",
             "content": system_message
@@ -32,7 +271,9 @@ async def call_gemini(user_message, system_message="", response_schema = None, m
             "content": user_message
         }
     ]
-    extra_body = {
+
+def build_extra_body():
+    return {
         'extra_body': {
             "google": {
                 "thinking_config": {
@@ -42,40 +283,197 @@ async def call_gemini(user_message, system_message="", response_schema = None, m
             }
         }
     }
+
+def build_response_format(response_schema):
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": response_schema.__name__, "schema": response_schema.model_json_schema()}
+    }
+
+def is_streaming_enabled():
+    return os.environ.get("LLM_STREAMING", "false").lower() in ("1", "true", "yes")
+
+async def call_gemini(user_message, system_message="", response_schema = None, model=DEFAULT_MODEL, temperature = 0.65, use_cache = True, tags = None, stream = None, on_partial = None, provider = None, retry_invalid = True):
+    # tags (stage, question_id, metric, cascade tier) only label the request, they never change what is sent.
+    # stream (LLM_STREAMING when None) streams structured responses and aborts them as soon as they break the schema,
+    # on_partial then gets {field: text so far} of the response's top level string fields while it streams.
+    # an explicit provider sends the call to that provider and model as given, bypassing the stage's route.
+    # retry_invalid=False raises a response that fails validation right away instead of retrying it
+    tags = tags or {}
+    stream = (is_streaming_enabled() if stream is None else stream) and response_schema is not None
+    messages = build_messages(user_message, system_message)
+    extra_body = build_extra_body()
+    provider_name, model = (provider, model) if provider is not None else resolve_route(tags.get("stage"), model)
+    temperature = resolve_temperature(tags.get("stage"), temperature)
+    
+    started = time.monotonic()
+    queued_at = call_queued_at.get()
+    trace = {
+        "stage": tags.get("stage"),
+        "metric": tags.get("metric"),
+        "question_id": tags.get("question_id"),
+        "model": model,
+        "provider": provider_name,
+        "tier": tags.get("tier"),
+        "response_schema": response_schema.__name__ if response_schema else None,
+        "cache_hit": False,
+        "attempts": 0,
+        # time waiting for a scheduler slot plus time waiting on the rate limiter
+        "queue_wait_s": started - queued_at if queued_at is not None else 0.0,
+        "network_s": 0.0,
+        "prompt_tokens": None,
+        "cached_prompt_tokens": None,
+        "completion_tokens": None,
+        # streamed calls only, time from sending the request to the first content and the attempts cut short
+        "ttft_s": None,
+        "stream_aborts": 0,
+        "status": "error"
+    }
+    
+    try:
+        cache = get_response_cache() if use_cache else None
+        if cache is not None:
+            cache_key = ResponseCache.make_key(provider_name, model, temperature, messages, response_schema, extra_body)
+            cached = cache.get(cache_key, response_schema)
+            if cached is not None:
+                trace["cache_hit"] = True
+                trace["status"] = "ok"
+                return cached
+        
+        result = await request_with_retries(messages, extra_body, response_schema, model, temperature, trace, provider_name, stream, on_partial, retry_invalid)
+        if cache is not None:
+            cache.set(cache_key, result, response_schema)
+        trace["status"] = "ok"
+        return result
+    except Exception as e:
+        trace["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        trace["total_s"] = time.monotonic() - started
+        get_telemetry().record(trace)
+
+async def request_with_retries(messages, extra_body, response_schema, model, temperature, trace, provider_name="default", stream=False, on_partial=None, retry_invalid=True):
+    provider = get_provider(provider_name)
+    max_attempts = int(os.environ.get("LLM_MAX_ATTEMPTS", 6))
+    limiter = get_rate_limiter()
+    estimated_tokens = estimate_tokens(messages)
     
     for attempt in range(max_attempts):
+        trace["attempts"] = attempt + 1
+        wait_started = time.monotonic()
+        reservation = await limiter.acquire(estimated_tokens)
+        trace["queue_wait_s"] += time.monotonic() - wait_started
+        
+        request_started = time.monotonic()
+        response = None
+        # next key on every attempt, a retry after a 429 goes out on a different key
+        client = provider.get_client()
+        request_messages, request_extra_body = messages, extra_body
         try:
-            if response_schema:
+            if provider.context_cache is not None:
+                request_messages, request_extra_body = await provider.context_cache.prepare(client, model, messages, extra_body)
+            if response_schema and stream:
+                response = await stream_structured(client, model, request_messages, temperature, request_extra_body, response_schema, trace, request_started, on_partial)
+                record_usage(limiter, reservation, response.usage, trace, request_started)
+                return response_schema.model_validate_json(response.content)
+            elif response_schema:
                 response = await client.chat.completions.parse(
                     model = model,
-                    messages = messages,
+                    messages = request_messages,
                     temperature = temperature,
-                    extra_body = extra_body,
+                    extra_body = request_extra_body,
                     response_format = response_schema
                 )  
+                record_usage(limiter, reservation, response.usage, trace, request_started)
                 response_schema.validate(response.choices[0].message.parsed)
                 return response.choices[0].message.parsed
             else:
                 response = await client.chat.completions.create(
                     model = model,
-                    messages = messages,
+                    messages = request_messages,
                     temperature = temperature,
-                    extra_body = extra_body
+                    extra_body = request_extra_body
                 )   
+                record_usage(limiter, reservation, response.usage, trace, request_started)
                 if response.choices[0].message.content == None:
                     raise Exception("Response content is None, retrying...")
                 return response.choices[0].message.content
         
-        except ValidationError as e:
-            print(f"Pydantic validation failed on attempt {attempt + 1}/{max_attempts}. The API returned a malformed object. Error: {e}")
-        
         except Exception as e:
-            print(f"API call failed on attempt {attempt + 1}/{max_attempts}. Error: {type(e).__name__}: {e}")
+            # a response that came back but failed validation is already counted in record_usage
+            if response is None:
+                trace["network_s"] += time.monotonic() - request_started
+            if isinstance(e, MalformedStreamError):
+                trace["stream_aborts"] += 1
+                print(f"Streamed response broke the schema on attempt {attempt + 1}/{max_attempts}, aborted it early. Error: {e}")
+            elif isinstance(e, ValidationError):
+                print(f"Pydantic validation failed on attempt {attempt + 1}/{max_attempts}. The API returned a malformed object. Error: {e}")
+            else:
+                print(f"API call failed on attempt {attempt + 1}/{max_attempts}. Error: {type(e).__name__}: {e}")
+            
+            if not retry_invalid and isinstance(e, (ValidationError, MalformedStreamError)):
+                raise
+            # no point retrying auth errors, bad requests etc.
+            if not is_retryable(e):
+                limiter.counters["fatal_errors"] += 1
+                raise
+            
+            retry_after = get_retry_after(e)
+            if isinstance(e, RateLimitError):
+                # everyone waits out the cooldown, not just this coroutine
+                limiter.record_rate_limited(retry_after if retry_after is not None else backoff_delay(attempt))
         
         if attempt < max_attempts - 1:
-            delay = 0.5 * (2 ** attempt)
+            limiter.counters["retries"] += 1
+            delay = backoff_delay(attempt, retry_after)
             print(f"Retrying in {delay:.2f} seconds...")
             await asyncio.sleep(delay)
         else:
             print(f"Calling Gemini API failed after {max_attempts} attempts.")
-            raise Exception("Gemini API call failed after multiple attempts.")
\ No newline at end of file
+            raise Exception("Gemini API call failed after multiple attempts.")
+
+class StreamedResponse():
+    def __init__(self, content, usage):
+        self.content = content
+        self.usage = usage
+
+async def stream_structured(client, model, messages, temperature, extra_body, response_schema, trace, request_started, on_partial=None):
+    # the json is checked as it arrives, so output that can't validate is dropped after a few tokens instead of
+    # after the whole (possibly very long) generation. leaving the stream early closes the connection, which
+    # stops the generation
+    validator = StreamingJSONValidator(response_schema.model_json_schema(), on_partial)
+    content = []
+    usage = None
+    stream = await client.chat.completions.create(
+        model = model,
+        messages = messages,
+        temperature = temperature,
+        extra_body = extra_body,
+        response_format = build_response_format(response_schema),
+        stream = True,
+        stream_options = {"include_usage": True}
+    )
+    async with stream:
+        async for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                if not content:
+                    trace["ttft_s"] = time.monotonic() - request_started
+                content.append(delta)
+                validator.feed(delta)
+    validator.finish()
+    return StreamedResponse("".join(content), usage)
+
+def record_usage(limiter, reservation, usage, trace, request_started):
+    # reservation is the rate limiter window entry acquire returned for this attempt
+    trace["network_s"] += time.monotonic() - request_started
+    limiter.record_success(reservation, usage.total_tokens if usage else None)
+    if usage:
+        # summed across attempts, retries are billed too
+        trace["prompt_tokens"] = (trace["prompt_tokens"] or 0) + usage.prompt_tokens
+        trace["completion_tokens"] = (trace["completion_tokens"] or 0) + usage.completion_tokens
+        # prefix tokens served from the provider's implicit or explicit context cache, billed at a discount
+        cached_tokens = (usage.prompt_tokens_details.cached_tokens or 0) if usage.prompt_tokens_details else 0
+        trace["cached_prompt_tokens"] = (trace["cached_prompt_tokens"] or 0) + cached_tokens
@@ -0,0 +1,269 @@
+import asyncio
+import inspect
+import json
+import os
+import shutil
+import time
+import uuid
+from pydantic import ValidationError
+from helpers.ai_provider import get_ai_client, get_response_cache, build_messages, build_extra_body, build_response_format, resolve_route, resolve_temperature, ResponseCache
+from helpers.scheduler import Scheduler
+from helpers.telemetry import get_telemetry
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+class OpenAIBatchBackend():
+    # provider side batch jobs through the openai compatible files + batches endpoints
+    def __init__(self, completion_window="24h"):
+        self.completion_window = completion_window
+
+    async def submit(self, input_path):
+        client = get_ai_client()
+        with open(input_path, "rb") as f:
+            batch_file = await client.files.create(file=f, purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window
+        )
+        return batch.id
+
+    async def poll(self, batch_id):
+        batch = await get_ai_client().batches.retrieve(batch_id)
+        if batch.status == "completed":
+            return "completed"
+        if batch.status in ("failed", "expired", "cancelled"):
+            return "failed"
+        return "in_progress"
+
+    async def download(self, batch_id, output_path):
+        batch = await get_ai_client().batches.retrieve(batch_id)
+        content = await get_ai_client().files.content(batch.output_file_id)
+        with open(output_path, "wb") as f:
+            f.write(content.read())
+
+class LocalBatchBackend():
+    # file based stand in for offline runs. a submitted job is copied to batch_dir/<id>.input.jsonl and
+    # is complete once batch_dir/<id>.output.jsonl exists. with a responder the output is produced right
+    # away, responder(body) gets the request body and returns the message content string.
+    def __init__(self, batch_dir, responder=None):
+        self.batch_dir = batch_dir
+        self.responder = responder
+        os.makedirs(batch_dir, exist_ok=True)
+
+    async def submit(self, input_path):
+        batch_id = f"local_batch_{uuid.uuid4().hex[:12]}"
+        local_input = os.path.join(self.batch_dir, f"{batch_id}.input.jsonl")
+        shutil.copyfile(input_path, local_input)
+
+        if self.responder is not None:
+            with open(local_input, "r", encoding="utf-8") as f_in, open(os.path.join(self.batch_dir, f"{batch_id}.output.jsonl"), "w", encoding="utf-8") as f_out:
+                for line in f_in:
+                    request = json.loads(line)
+                    # a failing request becomes an error entry, like a provider batch reports it, and is resubmitted from there
+                    try:
+                        content = self.responder(request["body"])
+                        if inspect.isawaitable(content):
+                            content = await content
+                        response, error = {"status_code": 200, "body": {"choices": [{"message": {"role": "assistant", "content": content}}]}}, None
+                    except Exception as e:
+                        response, error = None, {"message": f"{type(e).__name__}: {e}"}
+                    f_out.write(json.dumps({
+                        "id": f"{batch_id}_{request['custom_id']}",
+                        "custom_id": request["custom_id"],
+                        "response": response,
+                        "error": error
+                    }, ensure_ascii=False) + "\n")
+        return batch_id
+
+    async def poll(self, batch_id):
+        if os.path.exists(os.path.join(self.batch_dir, f"{batch_id}.output.jsonl")):
+            return "completed"
+        return "in_progress"
+
+    async def download(self, batch_id, output_path):
+        shutil.copyfile(os.path.join(self.batch_dir, f"{batch_id}.output.jsonl"), output_path)
+
+async def forward_to_provider(body):
+    # LocalBatchBackend responder that sends each request to the default provider (LLM_BASE_URL, e.g. the mock llm server)
+    response = await get_ai_client().chat.completions.create(**body)
+    return response.choices[0].message.content
+
+class BatchScheduler(Scheduler):
+    # drop in replacement for Scheduler. instead of calling the api, every call is queued into a batch job,
+    # the job is submitted once requests stop arriving (or max_batch_size is hit), polled, and each result
+    # is handed back to the coroutine that asked for it. stages run unchanged on top of it.
+    # requests that fail, go missing or come back schema invalid are resubmitted in a follow up batch, like the live
+    # path retries them, and only raise into their coroutine after max_attempts (LLM_MAX_ATTEMPTS) submissions.
+    def __init__(self, backend, jobs_dir, max_batch_size=50_000, idle_seconds=2.0, poll_interval=30.0, concurrency=100_000, max_attempts=None):
+        super().__init__(concurrency=concurrency)
+        self.max_attempts = max_attempts or int(os.environ.get("LLM_MAX_ATTEMPTS", 6))
+        self.backend = backend
+        self.jobs_dir = jobs_dir
+        self.max_batch_size = max_batch_size
+        self.idle_seconds = idle_seconds
+        self.poll_interval = poll_interval
+        os.makedirs(jobs_dir, exist_ok=True)
+
+        self.pending = []
+        self.last_enqueued = 0.0
+        self.flusher = None
+        self.running_batches = set()
+        self.request_count = 0
+
+    async def call(self, fn, *args, **kwargs):
+        bound = inspect.signature(fn).bind(*args, **kwargs)
+        bound.apply_defaults()
+        params = bound.arguments
+
+        messages = build_messages(params['user_message'], params['system_message'])
+        response_schema = params['response_schema']
+        extra_body = build_extra_body()
+
+        tags = params.get('tags') or {}
+        # batch jobs always go through the default provider, only the stage's model override applies (unless the call
+        # names its provider and model itself, like a cascade tier)
+        model = params['model'] if params.get('provider') is not None else resolve_route(tags.get("stage"), params['model'])[1]
+        temperature = resolve_temperature(tags.get("stage"), params['temperature'])
+        trace = {
+            "stage": tags.get("stage"),
+            "metric": tags.get("metric"),
+            "question_id": tags.get("question_id"),
+            "model": model,
+            "tier": tags.get("tier"),
+            "response_schema": response_schema.__name__ if response_schema else None,
+            "mode": "batch"
+        }
+
+        cache = get_response_cache() if params.get('use_cache', True) else None
+        cache_key = None
+        if cache is not None:
+            # batch jobs go through the default provider
+            cache_key = ResponseCache.make_key("default", model, temperature, messages, response_schema, extra_body)
+            cached = cache.get(cache_key, response_schema)
+            if cached is not None:
+                get_telemetry().record({**trace, "cache_hit": True, "status": "ok", "total_s": 0.0})
+                return cached
+
+        # custom ids carry the stage/question/metric so the job files can be read on their own
+        self.request_count += 1
+        custom_id = ":".join(str(tags.get(k, "-")) for k in ("stage", "question_id", "metric")) + f":{self.request_count}"
+
+        body = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            **extra_body
+        }
+        if response_schema is not None:
+            body["response_format"] = build_response_format(response_schema)
+
+        future = asyncio.get_running_loop().create_future()
+        self.enqueue({
+            "custom_id": custom_id, "body": body, "response_schema": response_schema, "cache_key": cache_key, "trace": trace, "future": future,
+            # schema invalid responses are only resubmitted when the caller retries them (cascade tiers escalate instead)
+            "retry_invalid": params.get('retry_invalid', True), "attempts": 0, "started": None
+        })
+        return await future
+
+    def enqueue(self, request):
+        self.pending.append(request)
+        self.last_enqueued = time.monotonic()
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.ensure_future(self.flush_loop())
+
+    def retry_or_fail(self, request, error):
+        # True when the request went into the next batch, otherwise the error is raised into its coroutine
+        can_retry = request["retry_invalid"] or not isinstance(error, ValidationError)
+        if can_retry and request["attempts"] < self.max_attempts:
+            self.enqueue(request)
+            return True
+        if not request["future"].done():
+            request["future"].set_exception(error)
+        return False
+
+    async def flush_loop(self):
+        while self.pending:
+            await asyncio.sleep(self.idle_seconds)
+            idle = time.monotonic() - self.last_enqueued >= self.idle_seconds
+            if idle or len(self.pending) >= self.max_batch_size:
+                batch, self.pending = self.pending[:self.max_batch_size], self.pending[self.max_batch_size:]
+                task = asyncio.ensure_future(self.run_batch(batch))
+                self.running_batches.add(task)
+                task.add_done_callback(self.running_batches.discard)
+
+    async def run_batch(self, batch):
+        started = time.monotonic()
+        for request in batch:
+            request["attempts"] += 1
+            request["started"] = request["started"] or started
+        job_name = f"batch_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        input_path = os.path.join(self.jobs_dir, f"{job_name}.input.jsonl")
+        output_path = os.path.join(self.jobs_dir, f"{job_name}.output.jsonl")
+        try:
+            with open(input_path, "w", encoding="utf-8") as f:
+                for request in batch:
+                    f.write(json.dumps({"custom_id": request["custom_id"], "method": "POST", "url": BATCH_ENDPOINT, "body": request["body"]}, ensure_ascii=False) + "\n")
+
+            batch_id = await self.backend.submit(input_path)
+            print(f"========= Submitted batch {batch_id} with {len(batch)} requests. =========")
+            while (status := await self.backend.poll(batch_id)) == "in_progress":
+                await asyncio.sleep(self.poll_interval)
+            if status != "completed":
+                raise Exception(f"Batch {batch_id} finished with status {status}.")
+            await self.backend.download(batch_id, output_path)
+
+            results = {}
+            with open(output_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        result = json.loads(line)
+                        results[result["custom_id"]] = result
+            print(f"========= Batch {batch_id} complete, {len(results)}/{len(batch)} results. =========")
+        except Exception as e:
+            resubmitted = sum(self.retry_or_fail(request, e) for request in batch)
+            if resubmitted:
+                print(f"========= Batch failed ({type(e).__name__}: {e}), resubmitting {resubmitted} of its {len(batch)} requests. =========")
+            return
+
+        cache = get_response_cache()
+        telemetry = get_telemetry()
+        resubmitted = 0
+        for request in batch:
+            result = results.get(request["custom_id"])
+            usage = (((result or {}).get("response") or {}).get("body") or {}).get("usage") or {}
+            trace = {
+                **request["trace"],
+                "cache_hit": False,
+                "attempts": request["attempts"],
+                "batch_id": batch_id,
+                # the whole batch turnaround (of every batch the request went into), batch calls have no per request latency
+                "total_s": time.monotonic() - request["started"],
+                "prompt_tokens": usage.get("prompt_tokens"),
+                "completion_tokens": usage.get("completion_tokens")
+            }
+            try:
+                value = self.parse_result(result, request["response_schema"])
+                if cache is not None and request["cache_key"] is not None:
+                    cache.set(request["cache_key"], value, request["response_schema"])
+                telemetry.record({**trace, "status": "ok"})
+                request["future"].set_result(value)
+            except Exception as e:
+                if self.retry_or_fail(request, e):
+                    resubmitted += 1
+                else:
+                    telemetry.record({**trace, "status": "error", "error": f"{type(e).__name__}: {e}"})
+        if resubmitted:
+            print(f"========= Batch {batch_id}: resubmitting {resubmitted} failed requests. =========")
+
+    @staticmethod
+    def parse_result(result, response_schema):
+        if result is None:
+            raise Exception("Batch result missing for request.")
+        if result.get("error") or result["response"]["status_code"] != 200:
+            raise Exception(f"Batch request failed: {result.get('error') or result['response']}")
+        content = result["response"]["body"]["choices"][0]["message"]["content"]
+        if content is None:
+            raise Exception("Batch response content is None.")
+        # same validation as the live path, a malformed object raises ValidationError
+        return response_schema.model_validate_json(content) if response_schema else content
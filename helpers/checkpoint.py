@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+
+FINGERPRINT_KEY = "__checkpoint_fingerprint__"
+
+def make_fingerprint(settings):
+    # short stable hash of everything a stage's results depend on besides the question (mode, metrics, models,
+    # prompts...), records written under another fingerprint are stale
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()[:16]
+
+class Checkpoint():
+    # append only jsonl checkpoint, one record per completed question.
+    # records are flushed on every append and fsynced in batches. only the byte offset
+    # of each record is kept in memory, records themselves are read back from disk on demand.
+    # with settings, the file starts with a header holding their fingerprint. resuming a checkpoint written under
+    # other settings (or without a header) would reuse stale results, so it's moved aside to <path>.stale and the
+    # stage starts over, invalidated tells the stage to drop what it derived from it.
+    def __init__(self, path, key='question_id', resume=True, fsync_every=20, settings=None):
+        self.path = path
+        self.key = key
+        self.fsync_every = fsync_every
+        self.pending_sync = 0
+        self.offsets = {}
+        self.fingerprint = make_fingerprint(settings) if settings is not None else None
+        self.invalidated = False
+
+        if resume and os.path.exists(path) and self.fingerprint is not None and self.read_fingerprint(path) != self.fingerprint:
+            os.replace(path, f"{path}.stale")
+            self.invalidated = True
+            print(f"========= {path} was written with other settings, moved it to {path}.stale and starting over. =========")
+
+        if resume and os.path.exists(path):
+            self.offsets = self.load_offsets(path, key)
+            if self.offsets:
+                print(f"========= Resuming from {path}, {len(self.offsets)} records already completed. =========")
+
+        self.file = open(path, "ab" if resume else "wb")
+        # terminate a partially written last line so the next record starts on its own line
+        if resume and self.file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write(b"\n")
+        if self.file.tell() == 0 and self.fingerprint is not None:
+            self.file.write(json.dumps({FINGERPRINT_KEY: self.fingerprint, "settings": settings}, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+            self.file.flush()
+        # records at or past this offset were written by this run
+        self.start_offset = self.file.tell()
+        self.reader = None
+
+    @staticmethod
+    def read_fingerprint(path):
+        with open(path, "rb") as f:
+            try:
+                header = json.loads(f.readline() or b"{}")
+            except json.JSONDecodeError:
+                return None
+        return header.get(FINGERPRINT_KEY) if isinstance(header, dict) else None
+
+    @staticmethod
+    def load_offsets(path, key='question_id'):
+        offsets = {}
+        with open(path, "rb") as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                        if FINGERPRINT_KEY not in record:
+                            offsets[record[key]] = offset
+                    except json.JSONDecodeError:
+                        # last line can be partially written if the run crashed mid write, that question is simply redone
+                        pass
+                offset += len(line)
+        return offsets
+
+    def is_done(self, record_key):
+        return record_key in self.offsets
+
+    def is_new(self, record_key):
+        # completed by this run rather than resumed
+        return self.offsets.get(record_key, -1) >= self.start_offset
+
+    def pending(self, items, key_fn=None):
+        key_fn = key_fn or (lambda item: item[self.key])
+        return [item for item in items if not self.is_done(key_fn(item))]
+
+    def append(self, record):
+        offset = self.file.tell()
+        self.file.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.file.flush()
+        self.offsets[record[self.key]] = offset
+        self.pending_sync += 1
+        if self.pending_sync >= self.fsync_every:
+            self.sync()
+
+    def get(self, record_key):
+        if self.reader is None:
+            self.reader = open(self.path, "rb")
+        self.reader.seek(self.offsets[record_key])
+        return json.loads(self.reader.readline())
+
+    def iter_ordered(self, keys):
+        # records in the given order, skipping keys that never completed
+        for k in keys:
+            if k in self.offsets:
+                yield self.get(k)
+
+    def ordered(self, keys):
+        return list(self.iter_ordered(keys))
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.pending_sync = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
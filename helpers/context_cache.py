@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+import os
+import time
+from helpers.rate_limiter import estimate_tokens
+
+GEMINI_CACHED_CONTENTS_URL = "https://generativelanguage.googleapis.com/v1beta/cachedContents"
+
+class ContextCache():
+    # explicit provider side context caching. a system prompt long enough to be worth it is uploaded once as a
+    # cachedContents entry, and calls then reference it by name instead of resending it, so the shared prefix
+    # is neither billed at the full input price nor processed again. entries are per api key since caches are
+    # scoped to the project the key belongs to.
+    def __init__(self, http_client, url=None, ttl_seconds=3600, min_tokens=1024):
+        self.http_client = http_client
+        self.url = url or GEMINI_CACHED_CONTENTS_URL
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        # (api key, model, prompt hash) -> (cache name or None when creating it failed, expires at)
+        self.entries = {}
+        self.locks = {}
+
+    def rebind(self, http_client):
+        # the provider moved to a new event loop and connection pool, entries stay valid but the locks belong to the old loop
+        self.http_client = http_client
+        self.locks = {}
+
+    async def prepare(self, client, model, messages, extra_body):
+        # returns the messages and extra body to send, unchanged when the prompt can't or shouldn't be cached
+        if not messages or messages[0]["role"] != "system" or estimate_tokens(messages[:1]) < self.min_tokens:
+            return messages, extra_body
+        name = await self.get(client, model, messages[0]["content"])
+        if name is None:
+            return messages, extra_body
+
+        google = {**extra_body["extra_body"]["google"], "cached_content": name}
+        return messages[1:], {**extra_body, "extra_body": {**extra_body["extra_body"], "google": google}}
+
+    async def get(self, client, model, system_message):
+        key = (client.api_key, model, hashlib.sha256(system_message.encode("utf-8")).hexdigest())
+        # concurrent calls with the same prefix wait for one upload instead of each creating their own entry
+        async with self.locks.setdefault(key, asyncio.Lock()):
+            entry = self.entries.get(key)
+            # refresh a minute early so a call never references an entry that expires mid request
+            if entry is None or (entry[0] is not None and entry[1] - 60 < time.time()):
+                self.entries[key] = entry = await self.create(client.api_key, model, system_message)
+            return entry[0]
+
+    async def create(self, api_key, model, system_message):
+        try:
+            response = await self.http_client.post(
+                self.url,
+                headers={"x-goog-api-key": api_key},
+                json={
+                    "model": f"models/{model}",
+                    "systemInstruction": {"parts": [{"text": system_message}]},
+                    "ttl": f"{self.ttl_seconds}s"
+                }
+            )
+            response.raise_for_status()
+            return response.json()["name"], time.time() + self.ttl_seconds
+        except Exception as e:
+            # e.g. the model has no explicit caching or the prompt is under its minimum, send it inline from now on
+            print(f"Context cache creation failed for {model}, falling back to inline prompts. Error: {type(e).__name__}: {e}")
+            return None, float("inf")
+
+    async def close(self):
+        # entries are billed for storage until their ttl runs out, so drop them once the run is done
+        for (api_key, _, _), (name, _) in list(self.entries.items()):
+            if name is None:
+                continue
+            try:
+                await self.http_client.delete(f"{self.url.rsplit('/', 1)[0]}/{name}", headers={"x-goog-api-key": api_key})
+            except Exception:
+                pass
+        self.entries.clear()
+
+def get_context_cache_settings():
+    # None disables explicit caching, the stable prompt prefixes still benefit from the provider's implicit caching
+    if os.environ.get("LLM_CONTEXT_CACHE", "false").lower() not in ("1", "true", "yes"):
+        return None
+    return {
+        "url": os.environ.get("LLM_CONTEXT_CACHE_URL") or None,
+        "ttl_seconds": int(os.environ.get("LLM_CONTEXT_CACHE_TTL", 3600)),
+        "min_tokens": int(os.environ.get("LLM_CONTEXT_CACHE_MIN_TOKENS", 1024))
+    }
@@ -1,21 +1,123 @@
 import os
 import json
+import hashlib
 import numpy as np
 from pathlib import Path
 
+def get_shard(question_id, num_shards):
+    # stable across processes and machines, unlike the builtin hash()
+    return int(hashlib.md5(str(question_id).encode("utf-8")).hexdigest(), 16) % num_shards
+
+def iter_json_array(f, chunk_size=1 << 20):
+    # incrementally parses a top level json array, only one record is decoded at a time
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    started = False
+    eof = False
+
+    while True:
+        # skip whitespace and separators between records
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if not started and pos < len(buffer):
+            if buffer[pos] != "[":
+                raise ValueError("Expected a JSON array of questions.")
+            started = True
+            pos += 1
+            continue
+        if started and pos < len(buffer) and buffer[pos] == "]":
+            return
+
+        if pos < len(buffer):
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+                # a bare number or literal may be cut at the chunk boundary ("2" of "23", "4." of "4.5"), it only
+                # counts once a separator follows it or the file has ended. objects, arrays and strings are closed
+                complete = buffer[pos] in '{["' or (end < len(buffer) and buffer[end] in " \t\r\n,]")
+                if complete or eof:
+                    yield record
+                    pos = end
+                    continue
+            except json.JSONDecodeError:
+                # most likely the record is cut at the chunk boundary, read more below
+                if eof:
+                    raise
+
+        if eof:
+            if started:
+                raise ValueError("Unexpected end of file while reading JSON array.")
+            return
+
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
 class Dataloader():
-    def __init__(self, question_data_path: Path):
-        if os.path.exists(question_data_path):
+    def __init__(self, question_data_path: Path, streaming=False):
+        if not os.path.exists(question_data_path):
+            raise ValueError("Similar Questions Data path invalid.")
+
+        self.question_data_path = question_data_path
+        # in streaming mode nothing is read up front, records are parsed as they are iterated
+        self.streaming = streaming or str(question_data_path).endswith(".jsonl")
+        self.dataset = None
+
+        if not self.streaming:
             with open(question_data_path,"r") as f:
                 self.dataset = json.load(f)
-        else:
-            raise ValueError("Similar Questions Data path invalid.")
-        
+
         print(f"========= Dataset loaded from {question_data_path}. =========")
-        
-    def get_dataset(self):
-        return self.dataset
-    
-    def get_random_subset(self, size):
-        return np.random.choice(self.dataset,int(size),replace=False).tolist()
-           
\ No newline at end of file
+
+    def iter_raw(self):
+        if self.dataset is not None:
+            yield from self.dataset
+        elif str(self.question_data_path).endswith(".jsonl"):
+            with open(self.question_data_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        else:
+            with open(self.question_data_path, "r", encoding="utf-8") as f:
+                yield from iter_json_array(f)
+
+    def iter_dataset(self, subjects=None, question_ids=None, shard_index=0, num_shards=1):
+        if not 0 <= shard_index < num_shards:
+            raise ValueError("shard_index must be between 0 and num_shards - 1.")
+        subjects = set(subjects) if subjects else None
+        question_ids = set(question_ids) if question_ids else None
+
+        for record in self.iter_raw():
+            if subjects is not None and record['subject'] not in subjects:
+                continue
+            if question_ids is not None and record['question_id'] not in question_ids:
+                continue
+            if num_shards > 1 and get_shard(record['question_id'], num_shards) != shard_index:
+                continue
+            yield record
+
+    def get_dataset(self, **filters):
+        if self.dataset is not None and not filters:
+            return self.dataset
+        return list(self.iter_dataset(**filters))
+
+    def get_random_subset(self, size, seed=None, **filters):
+        # both paths draw from the same seeded generator, a seed always picks the same sample
+        rng = np.random.default_rng(seed)
+        if self.dataset is not None and not filters:
+            return [self.dataset[idx] for idx in rng.choice(len(self.dataset), int(size), replace=False)]
+
+        # reservoir sampling, holds at most `size` records no matter how big the file is
+        reservoir = []
+        for idx, record in enumerate(self.iter_dataset(**filters)):
+            if idx < size:
+                reservoir.append(record)
+            else:
+                replace_idx = rng.integers(0, idx + 1)
+                if replace_idx < size:
+                    reservoir[replace_idx] = record
+        if len(reservoir) < size:
+            raise ValueError(f"Requested {size} questions but only {len(reservoir)} match.")
+        return reservoir
@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import zlib
+import numpy as np
+from helpers.text_utils import normalize_text
+
+# permutations are multiply-shift hashes, (a * h + b) mod 2^64 with odd a, keeping the high 32 bits
+HASH_SHIFT = np.uint64(32)
+
+def shingle_hashes(text, size=3):
+    # crc32 of every word n-gram of the normalized text, stable across processes unlike hash()
+    words = normalize_text(text).split()
+    if len(words) < size:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[idx:idx + size]) for idx in range(len(words) - size + 1)]
+    return np.unique(np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles)))
+
+def text_key(text):
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+class MinHashIndex():
+    # near duplicate detection over short texts. every text gets a minhash signature of its word 3-gram shingles,
+    # signatures are split into bands and texts sharing a band are candidates, kept when their estimated jaccard
+    # similarity reaches the threshold. candidates are then merged into groups with union find.
+    def __init__(self, num_perm=64, bands=16, threshold=0.8, seed=0):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands.")
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(0, np.iinfo(np.uint64).max, size=num_perm, dtype=np.uint64, endpoint=True) | np.uint64(1)
+        self.b = rng.integers(0, np.iinfo(np.uint64).max, size=num_perm, dtype=np.uint64, endpoint=True)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.signatures = []
+
+    def add(self, text):
+        # returns the text's position in the index
+        hashes = shingle_hashes(text)
+        # uint64 arrays wrap around on overflow, which is the mod 2^64 here
+        self.signatures.append(((np.outer(self.a, hashes) + self.b[:, None]) >> HASH_SHIFT).min(axis=1))
+        return len(self.signatures) - 1
+
+    def groups(self):
+        # position -> group root position, every position is its own root unless it has near duplicates
+        parent = np.arange(len(self.signatures))
+
+        def find(idx):
+            while parent[idx] != idx:
+                parent[idx] = parent[parent[idx]]
+                idx = parent[idx]
+            return idx
+
+        if not self.signatures:
+            return parent
+        signatures = np.vstack(self.signatures)
+        for band in range(self.bands):
+            buckets = {}
+            for idx, row in enumerate(signatures[:, band * self.rows:(band + 1) * self.rows]):
+                buckets.setdefault(row.tobytes(), []).append(idx)
+            for members in buckets.values():
+                for other in members[1:]:
+                    root, other_root = find(members[0]), find(other)
+                    if root != other_root and np.mean(signatures[members[0]] == signatures[other]) >= self.threshold:
+                        # the earlier text stays the root, so groups are named after their first occurrence
+                        parent[max(root, other_root)] = min(root, other_root)
+        return np.array([find(idx) for idx in range(len(parent))])
+
+class DuplicateIndex():
+    # built once over a loaded dataset. exact duplicates (same subject, same normalized question text and, for work
+    # that sees them, the same similar questions) share one relevance judgment and one solution per variant. near
+    # duplicates (minhash jaccard >= threshold) only differ in a few words, which can be the numbers that change the
+    # answer, so they are flagged in the reports but never share work.
+    def __init__(self, dataset, threshold=0.8, num_perm=64, bands=16):
+        self.work_keys = {}
+        self.group_sizes = {}
+        index = MinHashIndex(num_perm=num_perm, bands=bands, threshold=threshold)
+        question_positions = {}
+        similar_positions = {}
+        similar_occurrences = 0
+        self.similar_matches_main = []
+        for data in dataset:
+            question_id = data['question_id']
+            similar_keys = tuple((text_key(sq['similar_question_text']), text_key(sq.get('summarized_solution_approach') or "")) for sq in data['similar_questions'])
+            question_key = (data['subject'], text_key(data['question_text']))
+            self.work_keys[question_id] = {"question": question_key, "with_similar": (*question_key, similar_keys)}
+            question_positions[question_id] = index.add(data['question_text'])
+            for sq in data['similar_questions']:
+                similar_occurrences += 1
+                key = text_key(sq['similar_question_text'])
+                if key not in similar_positions:
+                    similar_positions[key] = index.add(sq['similar_question_text'])
+        for keys in self.work_keys.values():
+            for kind, key in keys.items():
+                self.group_sizes[(kind, key)] = self.group_sizes.get((kind, key), 0) + 1
+
+        roots = index.groups()
+        groups = {}
+        exact_groups = {}
+        for question_id, position in question_positions.items():
+            groups.setdefault(roots[position], []).append(question_id)
+            exact_groups.setdefault(self.work_keys[question_id]["question"], []).append(question_id)
+        self.exact_duplicate_groups = [members for members in exact_groups.values() if len(members) > 1]
+        # minhash groups whose questions actually differ, a group of exact copies is only an exact duplicate group
+        self.near_duplicate_groups = [members for members in groups.values() if len({self.work_keys[question_id]["question"] for question_id in members}) > 1]
+        # a similar question that is (nearly) its own main question leaks the answer into the with_similar prompt
+        for data in dataset:
+            main_root = roots[question_positions[data['question_id']]]
+            if any(roots[similar_positions[text_key(sq['similar_question_text'])]] == main_root for sq in data['similar_questions']):
+                self.similar_matches_main.append(data['question_id'])
+
+        similar_roots = {roots[position] for position in similar_positions.values()}
+        self.stats = {
+            "questions": len(question_positions),
+            "distinct_questions": len({keys["question"][1] for keys in self.work_keys.values()}),
+            "exact_duplicate_groups": len(self.exact_duplicate_groups),
+            "questions_in_exact_duplicate_groups": sum(len(members) for members in self.exact_duplicate_groups),
+            "near_duplicate_groups": len(self.near_duplicate_groups),
+            "questions_in_near_duplicate_groups": sum(len(members) for members in self.near_duplicate_groups),
+            "questions_sharing_relevance": len(self.work_keys) - len({keys["with_similar"] for keys in self.work_keys.values()}),
+            "questions_sharing_solution_without_similar": len(self.work_keys) - len({keys["question"] for keys in self.work_keys.values()}),
+            "similar_question_occurrences": similar_occurrences,
+            "distinct_similar_questions": len(similar_positions),
+            "near_distinct_similar_questions": len(similar_roots),
+            "similar_questions_matching_their_main_question": len(self.similar_matches_main)
+        }
+
+    def work_key(self, question_id, kind):
+        # kind "question" for work that only sees the question, "with_similar" for work that also sees its similar
+        # questions. None when nothing else in the dataset shares it, there is nothing to reuse then
+        keys = self.work_keys.get(question_id)
+        if keys is None or self.group_sizes[(kind, keys[kind])] < 2:
+            return None
+        return (kind, keys[kind])
+
+    def report(self):
+        return {"stats": self.stats, "exact_duplicate_groups": self.exact_duplicate_groups, "near_duplicate_groups": self.near_duplicate_groups, "similar_matches_main": self.similar_matches_main}
+
+    def print_stats(self):
+        stats = self.stats
+        print(f"========= Dedupe: {stats['distinct_questions']} distinct of {stats['questions']} questions, {stats['exact_duplicate_groups']} exact duplicate groups ({stats['questions_in_exact_duplicate_groups']} questions), {stats['near_duplicate_groups']} near duplicate groups ({stats['questions_in_near_duplicate_groups']} questions) | {stats['questions_sharing_relevance']} relevance and {stats['questions_sharing_solution_without_similar']} solution reuses | {stats['distinct_similar_questions']} distinct of {stats['similar_question_occurrences']} similar questions, {stats['similar_questions_matching_their_main_question']} matching their main question =========")
+
+class SharedWork():
+    # runs the work of a duplicate group once. the first member to arrive computes it, the others await the same
+    # task. expect() is told which members the current run will ask for, members already done on resume or left to
+    # another adaptive batch don't count. a result is dropped once every expected member has taken it, so memory
+    # stays bounded by the groups in flight. work nobody was told about isn't shared
+    def __init__(self, duplicates):
+        self.duplicates = duplicates
+        self.tasks = {}
+        self.remaining = {}
+        self.expected = {}
+        self.reused = 0
+
+    def expect(self, question_ids, kind, scope=None):
+        if self.duplicates is None:
+            return
+        for question_id in question_ids:
+            key = self.duplicates.work_key(question_id, kind)
+            if key is not None:
+                self.expected[(scope, key)] = self.expected.get((scope, key), 0) + 1
+
+    async def run(self, question_id, kind, compute, scope=None):
+        # scope separates work of the same group that isn't interchangeable, e.g. the solution variants
+        key = self.duplicates.work_key(question_id, kind) if self.duplicates is not None else None
+        if key is None:
+            return await compute()
+        task_key = (scope, key)
+        if task_key not in self.tasks:
+            self.tasks[task_key] = asyncio.ensure_future(compute())
+            self.remaining[task_key] = self.expected.pop(task_key, 1)
+        else:
+            self.reused += 1
+        task = self.tasks[task_key]
+        self.remaining[task_key] -= 1
+        if self.remaining[task_key] == 0:
+            del self.tasks[task_key], self.remaining[task_key]
+        return await asyncio.shield(task)
@@ -0,0 +1,257 @@
+import re
+
+NUMBER_PATTERN = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+LITERALS = {"true": True, "false": False, "null": None}
+STRING_SPECIAL = re.compile(r'["\\]')
+ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+# json types a value may arrive as for a schema type, loose like pydantic's lax mode ("0.5" is a valid float)
+ACCEPTED_TYPES = {
+    "string": {"string"},
+    "number": {"number", "string"},
+    "integer": {"number", "string"},
+    "boolean": {"boolean", "number", "string"},
+    "object": {"object"},
+    "array": {"array"},
+    "null": {"null"}
+}
+
+class MalformedStreamError(ValueError):
+    pass
+
+class StreamingJSONValidator():
+    # checks a json document against its json schema while it streams in, one chunk at a time. it only raises on
+    # what can never validate, broken json syntax, a value of the wrong type, a string outside its enum, a number
+    # outside its bounds, missing required keys or text after the document, so a stream is never aborted for
+    # something the final validation would have accepted. string values of the top level object are collected
+    # as they arrive, so callers can use e.g. a solution's text before the document is complete.
+    def __init__(self, schema, on_partial=None):
+        self.defs = schema.get("$defs", {})
+        self.on_partial = on_partial
+        # open containers, dicts of kind ("object"/"array"), schema, state and for objects the keys seen
+        self.stack = []
+        self.state = "value"
+        self.root_schema = schema
+        self.token = None
+        self.string = None
+        self.escape = None
+        # top level key -> characters of its string value received so far
+        self.partial = {}
+        self.position = 0
+
+    def resolve(self, schema):
+        while schema and "$ref" in schema:
+            schema = self.defs.get(schema["$ref"].split("/")[-1], {})
+        if schema and "allOf" in schema and len(schema["allOf"]) == 1:
+            return self.resolve(schema["allOf"][0])
+        return schema or {}
+
+    def accepted_types(self, schema):
+        # None when the schema doesn't pin the type down, anything is accepted then
+        schema = self.resolve(schema)
+        if "anyOf" in schema:
+            accepted = set()
+            for option in schema["anyOf"]:
+                option_types = self.accepted_types(option)
+                if option_types is None:
+                    return None
+                accepted |= option_types
+            return accepted
+        if "enum" in schema and "type" not in schema:
+            return {"string" if isinstance(value, str) else "number" for value in schema["enum"]}
+        schema_type = schema.get("type")
+        if schema_type is None:
+            return None
+        schema_types = schema_type if isinstance(schema_type, list) else [schema_type]
+        return set().union(*(ACCEPTED_TYPES.get(t, {t}) for t in schema_types))
+
+    def fail(self, message):
+        raise MalformedStreamError(f"{message} at character {self.position}")
+
+    def value_schema(self):
+        # schema of the value about to be read, None where the schema has nothing to say
+        if not self.stack:
+            return self.root_schema
+        frame = self.stack[-1]
+        if frame["kind"] == "array":
+            return self.resolve(frame["schema"]).get("items")
+        return self.resolve(frame["schema"]).get("properties", {}).get(frame["key"])
+
+    def check_type(self, json_type, schema):
+        if schema is None:
+            return
+        accepted = self.accepted_types(schema)
+        if accepted is not None and json_type not in accepted:
+            self.fail(f"Got a {json_type} where the schema expects {' or '.join(sorted(accepted))}")
+
+    def check_scalar(self, value, schema):
+        schema = self.resolve(schema)
+        if not schema:
+            return
+        if "enum" in schema and value not in schema["enum"]:
+            self.fail(f"Value {value!r} is not one of {schema['enum']}")
+        if isinstance(value, str) and schema.get("type") in ("number", "integer") and not NUMBER_PATTERN.fullmatch(value.strip()):
+            self.fail(f"Value {value!r} is not a number")
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            if "minimum" in schema and value < schema["minimum"] or "maximum" in schema and value > schema["maximum"]:
+                self.fail(f"Value {value} is outside [{schema.get('minimum')}, {schema.get('maximum')}]")
+
+    def end_value(self):
+        if not self.stack:
+            self.state = "done"
+        else:
+            self.stack[-1]["state"] = "comma_or_end"
+
+    def begin_value(self, char):
+        schema = self.value_schema()
+        if char == "{":
+            self.check_type("object", schema)
+            self.stack.append({"kind": "object", "schema": schema, "state": "key_or_end", "key": None, "keys": set()})
+        elif char == "[":
+            self.check_type("array", schema)
+            self.stack.append({"kind": "array", "schema": schema, "state": "value_or_end"})
+        elif char == '"':
+            self.check_type("string", schema)
+            self.string = []
+        elif char == "-" or char.isdigit():
+            self.check_type("number", schema)
+            self.token = [char]
+        elif char in "tfn":
+            self.check_type("null" if char == "n" else "boolean", schema)
+            self.token = [char]
+        else:
+            self.fail(f"Unexpected {char!r} where a value should start")
+
+    def end_token(self):
+        token = "".join(self.token)
+        self.token = None
+        if token in LITERALS:
+            value = LITERALS[token]
+        elif NUMBER_PATTERN.fullmatch(token):
+            value = float(token)
+        else:
+            self.fail(f"Invalid literal {token!r}")
+        self.check_scalar(value, self.value_schema())
+        self.end_value()
+
+    def end_string(self):
+        value = "".join(self.string)
+        self.string = None
+        frame = self.stack[-1] if self.stack else None
+        if frame is not None and frame["kind"] == "object" and frame["state"] in ("key_or_end", "key"):
+            frame["key"] = value
+            frame["state"] = "colon"
+            return
+        self.check_scalar(value, self.value_schema())
+        self.end_value()
+
+    def is_top_level_string(self):
+        return len(self.stack) == 1 and self.stack[0]["kind"] == "object" and self.stack[0]["state"] == "value"
+
+    def feed(self, chunk):
+        updated = False
+        idx = 0
+        while idx < len(chunk):
+            if self.string is not None and self.escape is None:
+                # plain string content is taken a run at a time, only quotes and escapes need a closer look
+                match = STRING_SPECIAL.search(chunk, idx)
+                stop = match.start() if match else len(chunk)
+                if stop > idx:
+                    self.append_string(chunk[idx:stop])
+                    updated = updated or self.is_top_level_string()
+                    self.position += stop - idx
+                    idx = stop
+                    continue
+            char = chunk[idx]
+            idx += 1
+            self.position += 1
+            if self.string is not None:
+                if self.escape is not None:
+                    self.escape += char
+                    if self.escape[0] == "u":
+                        if len(self.escape) < 5:
+                            continue
+                        try:
+                            char = chr(int(self.escape[1:], 16))
+                        except ValueError:
+                            self.fail(f"Invalid unicode escape \\{self.escape}")
+                    elif self.escape in ESCAPES:
+                        char = ESCAPES[self.escape]
+                    else:
+                        self.fail(f"Invalid escape \\{self.escape}")
+                    self.escape = None
+                    self.append_string(char)
+                    updated = updated or self.is_top_level_string()
+                elif char == "\\":
+                    self.escape = ""
+                else:
+                    self.end_string()
+                continue
+
+            if self.token is not None:
+                if char.isalnum() or char in "+-.":
+                    self.token.append(char)
+                    continue
+                self.end_token()
+            if char in " \t\r\n":
+                continue
+            self.step(char)
+
+        if updated and self.on_partial is not None:
+            self.on_partial(self.partial_text())
+
+    def append_string(self, text):
+        self.string.append(text)
+        if self.is_top_level_string():
+            self.partial.setdefault(self.stack[0]["key"], []).append(text)
+
+    def partial_text(self):
+        # top level key -> its string value so far
+        return {key: "".join(chars) for key, chars in self.partial.items()}
+
+    def step(self, char):
+        if self.state == "done":
+            self.fail(f"Unexpected {char!r} after the end of the document")
+        if not self.stack:
+            self.begin_value(char)
+            return
+
+        frame = self.stack[-1]
+        state = frame["state"]
+        if frame["kind"] == "object":
+            if state in ("key_or_end", "key") and char == '"':
+                self.string = []
+            elif state == "key_or_end" and char == "}" or state == "comma_or_end" and char == "}":
+                self.close_object(frame)
+            elif state == "colon" and char == ":":
+                frame["state"] = "value"
+            elif state == "value":
+                frame["keys"].add(frame["key"])
+                self.begin_value(char)
+            elif state == "comma_or_end" and char == ",":
+                frame["state"] = "key"
+            else:
+                self.fail(f"Unexpected {char!r} in an object")
+        else:
+            if state in ("value_or_end", "comma_or_end") and char == "]":
+                self.stack.pop()
+                self.end_value()
+            elif state in ("value_or_end", "value"):
+                frame["state"] = "value"
+                self.begin_value(char)
+            elif state == "comma_or_end" and char == ",":
+                frame["state"] = "value"
+            else:
+                self.fail(f"Unexpected {char!r} in an array")
+
+    def close_object(self, frame):
+        missing = set(self.resolve(frame["schema"]).get("required", [])) - frame["keys"]
+        if missing:
+            self.fail(f"Object closed without required keys {sorted(missing)}")
+        self.stack.pop()
+        self.end_value()
+
+    def finish(self):
+        if self.token is not None:
+            self.end_token()
+        if self.state != "done":
+            self.fail("Document ended before it was complete")
@@ -0,0 +1,92 @@
+import os
+from collections import Counter
+from pydantic import ValidationError
+from helpers.ai_provider import call_gemini, resolve_route
+from helpers.json_stream import MalformedStreamError
+
+# stage -> ModelCascade, stages without one call their single routed model
+cascades = {}
+
+class ModelCascade():
+    # tiers of (provider name, model), cheapest first. a call goes to the first tier and only moves on to the next
+    # when the stage's is_uncertain(response) names a reason, or the response fails validation. the last tier's
+    # answer is final. tiers are tagged on the trace (0 = first tier), so telemetry breaks latency and cost down
+    # per tier, the routing decisions are counted here
+    def __init__(self, stage, tiers):
+        if not tiers:
+            raise ValueError(f"The {stage} cascade needs at least one tier.")
+        self.stage = stage
+        self.tiers = [parse_tier(tier) if isinstance(tier, str) else tuple(tier) for tier in tiers]
+        self.calls = 0
+        self.resolved = Counter()
+        self.escalations = Counter()
+
+    async def call(self, scheduler, is_uncertain, user_message, system_message, response_schema, temperature, tags):
+        # (response, index of the tier that answered)
+        self.calls += 1
+        last = len(self.tiers) - 1
+        for tier, (provider_name, model) in enumerate(self.tiers):
+            try:
+                response = await scheduler.call(
+                    call_gemini, user_message, system_message, response_schema, model,
+                    temperature=temperature, tags={**tags, "stage": self.stage, "tier": tier}, provider=provider_name, retry_invalid=tier == last
+                )
+            except (ValidationError, MalformedStreamError):
+                if tier == last:
+                    raise
+                self.escalations["invalid_response"] += 1
+                continue
+            reason = is_uncertain(response) if tier < last else None
+            if reason is None:
+                self.resolved[tier] += 1
+                return response, tier
+            self.escalations[reason] += 1
+
+    def summary(self):
+        return {
+            "tiers": [f"{provider_name}:{model}" for provider_name, model in self.tiers],
+            "calls": self.calls,
+            "resolved_by_tier": {tier: self.resolved[tier] for tier in range(len(self.tiers))},
+            "escalation_rate": sum(self.resolved[tier] for tier in range(1, len(self.tiers))) / self.calls if self.calls else None,
+            "escalations": dict(self.escalations)
+        }
+
+def parse_tier(tier):
+    # "provider:model" or just "model" on the default provider
+    provider_name, sep, model = tier.strip().partition(":")
+    return (provider_name, model) if sep else ("default", provider_name)
+
+def set_cascade(stage, tiers):
+    cascades[stage] = ModelCascade(stage, tiers)
+
+def get_cascade(stage):
+    return cascades.get(stage)
+
+def load_cascades_from_env():
+    # LLM_CASCADES="compare=gemini-2.5-flash-lite>gemini-2.5-flash,relevance=gemini-2.5-flash-lite>judge:gemini-2.5-pro"
+    for cascade in os.environ.get("LLM_CASCADES", "").split(","):
+        if "=" not in cascade:
+            continue
+        stage, tiers = (part.strip() for part in cascade.split("=", 1))
+        set_cascade(stage, tiers.split(">"))
+
+def stage_models(stage, model):
+    # "provider:model" of every model the stage's calls can go to, e.g. for checkpoint fingerprints
+    cascade = cascades.get(stage)
+    if cascade is not None:
+        return [f"{provider_name}:{tier_model}" for provider_name, tier_model in cascade.tiers]
+    provider_name, routed_model = resolve_route(stage, model)
+    return [f"{provider_name}:{routed_model}"]
+
+def cascade_summary():
+    return {stage: cascade.summary() for stage, cascade in cascades.items() if cascade.calls}
+
+def print_cascade_summary():
+    summary = cascade_summary()
+    for stage, stats in summary.items():
+        resolved = ", ".join(f"tier {tier} ({stats['tiers'][tier]}) {count}" for tier, count in stats["resolved_by_tier"].items())
+        escalations = ", ".join(f"{reason} {count}" for reason, count in stats["escalations"].items()) or "none"
+        print(f"========= Cascade {stage}: {stats['calls']} calls resolved by {resolved} | {stats['escalation_rate']:.0%} escalated | escalations: {escalations} =========")
+    return summary
+
+load_cascades_from_env()
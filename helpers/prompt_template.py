@@ -0,0 +1,20 @@
+from string import Formatter
+
+# same ~4 characters per token heuristic as the rate limiter, so budgets and limiter estimates agree
+CHARS_PER_TOKEN = 4
+
+class PromptTemplate():
+    # str.format template checked once up front. rendering is a plain str.format, which is as fast as it gets in
+    # python, the parse only rejects fields str.format would treat differently than a plain substitution
+    # (positional, attribute, index, format spec or conversion), so a typo fails on import instead of mid run.
+    def __init__(self, template):
+        self.template = template
+        for _, field, format_spec, conversion in Formatter().parse(template):
+            if field is not None and (not field.isidentifier() or format_spec or conversion):
+                raise ValueError(f"Only plain named fields are supported in prompt templates, got '{{{field}}}'.")
+
+    def render(self, **values):
+        return self.template.format(**values)
+
+def estimate_text_tokens(text):
+    return len(text or "") // CHARS_PER_TOKEN + 1
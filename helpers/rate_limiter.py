@@ -0,0 +1,209 @@
+import asyncio
+import os
+import random
+import re
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+import openai
+from pydantic import ValidationError
+
+class TokenBucket():
+    def __init__(self, per_minute):
+        # None means unlimited
+        self.per_minute = per_minute
+        self.tokens = per_minute or 0
+        self.updated = time.monotonic()
+
+    def refill(self, scale=1.0):
+        now = time.monotonic()
+        if self.per_minute:
+            rate = self.per_minute * scale / 60
+            self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_time(self, amount, scale=1.0):
+        if not self.per_minute:
+            return 0.0
+        self.refill(scale)
+        # a single request bigger than the bucket would otherwise wait forever
+        amount = min(amount, self.per_minute)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / (self.per_minute * scale / 60)
+
+    def consume(self, amount):
+        if self.per_minute:
+            # can go negative when actual usage is reconciled, later requests pay it back
+            self.tokens -= amount
+
+class RateLimiter():
+    # process wide limiter, requests per minute and tokens per minute buckets,
+    # plus a shared cooldown so a 429 pauses everyone instead of each coroutine retrying at once.
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, min_scale=0.1):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        # asyncio locks belong to one event loop, a later asyncio.run in the same process gets a new one
+        self.lock = asyncio.Lock()
+        self.lock_loop = None
+        self.cooldown_until = 0.0
+        # additive increase / multiplicative decrease on the configured quota
+        self.scale = 1.0
+        self.min_scale = min_scale
+
+        self.counters = {
+            "requests": 0,
+            "tokens": 0,
+            "rate_limited": 0,
+            "retries": 0,
+            "fatal_errors": 0,
+            "throttled_seconds": 0.0
+        }
+        # [timestamp, tokens] of every request in the last minute, oldest first
+        self.window = deque()
+
+    def prune_window(self, now):
+        while self.window and now - self.window[0][0] >= 60:
+            self.window.popleft()
+
+    def loop_lock(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self.lock_loop:
+            self.lock = asyncio.Lock()
+            self.lock_loop = loop
+        return self.lock
+
+    async def acquire(self, estimated_tokens):
+        # returns the request's window entry, hand it to record_success to settle the request's actual usage
+        async with self.loop_lock():
+            while True:
+                wait = max(
+                    self.cooldown_until - time.monotonic(),
+                    self.requests.wait_time(1, self.scale),
+                    self.tokens.wait_time(estimated_tokens, self.scale)
+                )
+                if wait <= 0:
+                    break
+                self.counters["throttled_seconds"] += wait
+                await asyncio.sleep(wait)
+            self.requests.consume(1)
+            self.tokens.consume(estimated_tokens)
+            self.counters["requests"] += 1
+            now = time.monotonic()
+            self.prune_window(now)
+            entry = [now, estimated_tokens]
+            self.window.append(entry)
+            return entry
+
+    def record_success(self, entry, actual_tokens=None):
+        # entry is what acquire returned for this request, other requests may have been admitted since
+        estimated_tokens = entry[1]
+        if actual_tokens is not None:
+            self.tokens.consume(actual_tokens - estimated_tokens)
+            self.counters["tokens"] += actual_tokens
+            entry[1] = actual_tokens
+        else:
+            self.counters["tokens"] += estimated_tokens
+        self.scale = min(1.0, self.scale + 0.02)
+
+    def record_rate_limited(self, retry_after):
+        self.counters["rate_limited"] += 1
+        self.scale = max(self.min_scale, self.scale / 2)
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + retry_after)
+
+    def stats(self):
+        # usage over the last minute against the configured quota
+        self.prune_window(time.monotonic())
+        stats = dict(self.counters)
+        stats["requests_last_minute"] = len(self.window)
+        stats["tokens_last_minute"] = sum(tokens for _, tokens in self.window)
+        stats["rpm_utilization"] = len(self.window) / self.requests.per_minute if self.requests.per_minute else None
+        stats["tpm_utilization"] = stats["tokens_last_minute"] / self.tokens.per_minute if self.tokens.per_minute else None
+        stats["rate_scale"] = self.scale
+        return stats
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    ValidationError
+)
+FATAL_ERRORS = (
+    openai.AuthenticationError,
+    openai.PermissionDeniedError,
+    openai.BadRequestError,
+    openai.NotFoundError,
+    openai.UnprocessableEntityError
+)
+
+def is_retryable(error):
+    if isinstance(error, FATAL_ERRORS):
+        return False
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 408 or error.status_code == 409 or error.status_code >= 500
+    # anything else (empty content etc.) is treated as a transient failure
+    return True
+
+def parse_duration(value):
+    # handles "12", "1.5", "500ms", "6m0s", "1h2m3.5s" style values used in rate limit headers
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    multipliers = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * multipliers[unit] for amount, unit in parts)
+
+def get_retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+
+    if headers.get("retry-after-ms"):
+        duration = parse_duration(headers["retry-after-ms"])
+        if duration is not None:
+            return duration / 1000
+    if headers.get("retry-after"):
+        duration = parse_duration(headers["retry-after"])
+        if duration is not None:
+            return duration
+        try:
+            # retry-after can also be an http date
+            return max(0.0, parsedate_to_datetime(headers["retry-after"]).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+
+    resets = [parse_duration(headers[h]) for h in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens") if headers.get(h)]
+    resets = [r for r in resets if r is not None]
+    return max(resets) if resets else None
+
+def backoff_delay(attempt, retry_after=None, base=0.5, cap=60.0):
+    # full jitter so coroutines that failed together do not retry together
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay += retry_after
+    return delay
+
+def estimate_tokens(messages):
+    # rough estimate, ~4 characters per token. reconciled against usage after the call
+    return sum(len(message["content"] or "") for message in messages) // 4 + 1
+
+rate_limiter = None
+
+def get_rate_limiter():
+    global rate_limiter
+    if rate_limiter is None:
+        rpm = os.environ.get("LLM_RPM")
+        tpm = os.environ.get("LLM_TPM")
+        rate_limiter = RateLimiter(
+            requests_per_minute=int(rpm) if rpm else None,
+            tokens_per_minute=int(tpm) if tpm else None
+        )
+    return rate_limiter
@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import sqlite3
+from pathlib import Path
+from helpers.utils import dump_json_array
+
+# question_ids per IN (...) lookup, well under sqlite's bound parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+# file names of the pretty json reports, kept identical to the ones the stages used to write
+DEFAULT_VARIANT_FILES = {
+    "without_similar": "generated_solutions_wo_similar.json",
+    "with_similar": "generated_solutions_w_similar.json"
+}
+
+class ResultStore():
+    # one compact sqlite file for every stage's results, keyed by question_id. records are stored once as compact
+    # json next to the scalar columns the analysis filters and aggregates on, and reports join the tables on
+    # demand instead of each report file carrying its own copy of the question data.
+    # the stage checkpoints are the source of truth for resuming, the stage tables are derived from them with
+    # sync_from_checkpoint once a stage is done (or fails), stages never write them directly.
+    def __init__(self, path, commit_every=100, read_only=False):
+        self.path = path
+        if read_only:
+            # e.g. for dry runs, an existing store is read as is and nothing is created or written
+            self.conn = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True)
+            self.commit_every = commit_every
+            self.uncommitted = 0
+            return
+        store_dir = os.path.dirname(str(path))
+        if store_dir:
+            os.makedirs(store_dir, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS questions (question_id TEXT PRIMARY KEY, subject TEXT, record TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS relevance (
+                question_id TEXT PRIMARY KEY, conceptual_similarity REAL, structural_similarity REAL,
+                is_difficulty_appropriate TEXT, is_solution_approach_viable TEXT, record TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS solutions (question_id TEXT, variant TEXT, record TEXT NOT NULL, PRIMARY KEY (question_id, variant));
+            CREATE TABLE IF NOT EXISTS comparisons (question_id TEXT PRIMARY KEY, record TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS comparison_metrics (question_id TEXT, metric TEXT, winner TEXT, margin_of_winning REAL, PRIMARY KEY (question_id, metric));
+            CREATE TABLE IF NOT EXISTS scores (question_id TEXT PRIMARY KEY, average_score REAL, subject TEXT, relevance_bucket TEXT);
+            CREATE TABLE IF NOT EXISTS post_mortems (question_id TEXT, outcome TEXT, record TEXT NOT NULL, PRIMARY KEY (question_id, outcome));
+        """)
+        # writes are committed in batches, a crash loses at most the last batch which the checkpoints still have
+        self.commit_every = commit_every
+        self.uncommitted = 0
+
+    def write(self, sql, rows):
+        self.conn.executemany(sql, rows)
+        self.uncommitted += len(rows)
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+
+    @staticmethod
+    def dumps(record):
+        return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+    def put_questions(self, questions):
+        self.write(
+            "INSERT OR REPLACE INTO questions VALUES (?, ?, ?)",
+            [(data['question_id'], data.get('subject'), self.dumps(data)) for data in questions]
+        )
+
+    def put_relevance(self, record):
+        similarity, alignment = record['similarity'], record['alignment']
+        self.write("INSERT OR REPLACE INTO relevance VALUES (?, ?, ?, ?, ?, ?)", [(
+            record['question_id'], similarity['conceptual_similarity'], similarity['structural_similarity'],
+            alignment['is_difficulty_appropriate'], alignment['is_solution_approach_viable'], self.dumps(record)
+        )])
+
+    def put_solutions(self, record):
+        # record is a builder checkpoint record, {"question_id": ..., <variant>: <solution>, ..., "variant_settings": ...}
+        self.write(
+            "INSERT OR REPLACE INTO solutions VALUES (?, ?, ?)",
+            [(record['question_id'], variant, self.dumps(solution)) for variant, solution in record.items() if variant not in ('question_id', 'variant_settings')]
+        )
+
+    def put_comparison(self, record):
+        question_id = record['question_id']
+        self.write("INSERT OR REPLACE INTO comparisons VALUES (?, ?)", [(question_id, self.dumps(record))])
+        self.write(
+            "INSERT OR REPLACE INTO comparison_metrics VALUES (?, ?, ?, ?)",
+            [(question_id, metric, evaluation['winner'], evaluation['margin_of_winning']) for metric, evaluation in record.items() if isinstance(evaluation, dict) and 'winner' in evaluation]
+        )
+
+    def put_scores(self, rows):
+        # rows of (question_id, average_score, subject, relevance_bucket)
+        self.write("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)", rows)
+
+    def put_post_mortem(self, outcome, analysis):
+        self.write("INSERT OR REPLACE INTO post_mortems VALUES (?, ?, ?)", [(analysis['question_id'], outcome, self.dumps(analysis))])
+
+    def sync_from_checkpoint(self, table, checkpoint, question_ids, put):
+        # copies the records this run completed into the table, plus any the table doesn't have yet (finished by an
+        # earlier run before the store existed, or one that was killed before its sync)
+        stored = self.done_ids(table)
+        for record in checkpoint.iter_ordered([question_id for question_id in question_ids if checkpoint.is_new(question_id) or question_id not in stored]):
+            put(record)
+        self.commit()
+
+    def clear(self, *tables):
+        # drops a stage's results, e.g. once its checkpoint turned out stale
+        self.commit()
+        for table in tables:
+            self.conn.execute(f"DELETE FROM {table}")
+        self.conn.commit()
+
+    def merge_from(self, path):
+        # copies another store's rows in, e.g. one written by a shard. questions already present keep their row,
+        # so a store seeded with the questions in dataset order keeps that order for its reports
+        self.commit()
+        self.conn.execute("ATTACH DATABASE ? AS other", (str(path),))
+        try:
+            tables = [name for (name,) in self.conn.execute("SELECT name FROM other.sqlite_master WHERE type = 'table'")]
+            for table in tables:
+                self.conn.execute(f"INSERT OR {'IGNORE' if table == 'questions' else 'REPLACE'} INTO main.{table} SELECT * FROM other.{table}")
+            self.conn.commit()
+        finally:
+            self.conn.execute("DETACH DATABASE other")
+
+    @staticmethod
+    def filter_clause(filters, alias):
+        # {"variant": "with_similar"} -> ("<alias>.variant = ?", ("with_similar",)), column names are our own
+        return " AND ".join(f"{alias}.{column} = ?" for column in filters), tuple(filters.values())
+
+    def done_ids(self, table, **filters):
+        # question_ids the table already has results for, filters are column = value conditions
+        condition, params = self.filter_clause(filters, "t")
+        return {question_id for (question_id,) in self.conn.execute(f"SELECT DISTINCT t.question_id FROM {table} t {'WHERE ' + condition if condition else ''}", params)}
+
+    def count(self, table):
+        return self.conn.execute(f"SELECT COUNT(DISTINCT question_id) FROM {table}").fetchone()[0]
+
+    def iter_records(self, table, question_ids=None, **filters):
+        # in the given question order, or in dataset order (the order questions were stored in) without one.
+        # filters are column = value conditions, e.g. variant="with_similar"
+        condition, params = self.filter_clause(filters, "t")
+        if question_ids is None:
+            query = f"SELECT t.record FROM {table} t LEFT JOIN questions q ON q.question_id = t.question_id {'WHERE ' + condition if condition else ''} ORDER BY q.rowid, t.rowid"
+            for (record,) in self.conn.execute(query, params):
+                yield json.loads(record)
+            return
+        query = f"SELECT t.question_id, t.record FROM {table} t WHERE {condition + ' AND ' if condition else ''}t.question_id IN "
+        for _, record in self.iter_in_order(query, question_ids, params):
+            yield json.loads(record)
+
+    def iter_in_order(self, query, question_ids, params=()):
+        # rows of a query ending in "question_id IN ", keyed by their first column and yielded in question_ids order.
+        # ids are looked up LOOKUP_CHUNK_SIZE at a time, one query per chunk instead of one per id
+        question_ids = list(question_ids)
+        for start in range(0, len(question_ids), LOOKUP_CHUNK_SIZE):
+            chunk = question_ids[start:start + LOOKUP_CHUNK_SIZE]
+            rows = {row[0]: row for row in self.conn.execute(query + f"({', '.join('?' * len(chunk))})", (*params, *chunk))}
+            for question_id in chunk:
+                if question_id in rows:
+                    yield rows[question_id]
+
+    def get_solutions(self, variant, question_ids=None):
+        return list(self.iter_records("solutions", question_ids, variant=variant))
+
+    def get_comparisons(self, question_ids=None):
+        return list(self.iter_records("comparisons", question_ids))
+
+    def get_relevance_similarity(self):
+        # question_id -> mean of conceptual and structural similarity
+        return {
+            question_id: (conceptual + structural) / 2
+            for question_id, conceptual, structural in self.conn.execute("SELECT question_id, conceptual_similarity, structural_similarity FROM relevance")
+        }
+
+    def iter_full_analysis(self, question_ids=None):
+        # the old full_analysis_report rows, joined from scores, comparisons and questions
+        query = """
+            SELECT s.question_id, s.average_score, c.record, q.record FROM scores s
+            JOIN comparisons c ON c.question_id = s.question_id
+            LEFT JOIN questions q ON q.question_id = s.question_id
+        """
+        rows = self.conn.execute(query + " ORDER BY q.rowid, s.rowid") if question_ids is None else self.iter_in_order(query + " WHERE s.question_id IN ", question_ids)
+        for question_id, average_score, analysis, question in rows:
+            yield {
+                "question_id": question_id,
+                "average_score": average_score,
+                "full_analysis": json.loads(analysis),
+                "original_question_data": json.loads(question) if question else None
+            }
+
+    def export_json(self, reports_dir, question_ids=None, variant_files=None):
+        # optional pretty json reports, same files and format the stages write with export_json on
+        variant_files = {**DEFAULT_VARIANT_FILES, **(variant_files or {})}
+        with open(os.path.join(reports_dir, "relevance_eval_report.json"), "w") as f:
+            dump_json_array(self.iter_records("relevance", question_ids), f)
+        for (variant,) in self.conn.execute("SELECT DISTINCT variant FROM solutions").fetchall():
+            with open(os.path.join(reports_dir, variant_files.get(variant, f"generated_solutions_{variant}.json")), "w") as f:
+                dump_json_array(self.iter_records("solutions", question_ids, variant=variant), f)
+        with open(os.path.join(reports_dir, "comparative_analysis_report.json"), "w") as f:
+            dump_json_array(self.iter_records("comparisons", question_ids), f)
+        with open(os.path.join(reports_dir, "full_analysis_report.json"), "w") as f:
+            dump_json_array(self.iter_full_analysis(question_ids), f)
+
+    def close(self):
+        if self.conn is not None:
+            self.commit()
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the pretty printed json reports from a result store.")
+    parser.add_argument("store", help="Path of the result store, e.g. reports/results.sqlite.")
+    parser.add_argument("reports_dir", help="Directory the json reports are written to.")
+    args = parser.parse_args()
+    with ResultStore(args.store) as store:
+        store.export_json(args.reports_dir)
+    print(f"========= Exported json reports from {args.store} to {args.reports_dir}. =========")
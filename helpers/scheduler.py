@@ -0,0 +1,59 @@
+import asyncio
+import time
+from tqdm import tqdm
+from helpers.telemetry import call_queued_at
+
+DEFAULT_CONCURRENCY = 8
+
+class Scheduler():
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY):
+        if int(concurrency) < 1:
+            raise ValueError("Concurrency must be at least 1.")
+        self.concurrency = int(concurrency)
+        # guards the actual api calls, shared by every stage using this scheduler
+        self.call_semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def call(self, fn, *args, **kwargs):
+        # lets the call tell how long it waited here from how long the request itself took
+        token = call_queued_at.set(time.monotonic())
+        try:
+            async with self.call_semaphore:
+                return await fn(*args, **kwargs)
+        finally:
+            call_queued_at.reset(token)
+
+    async def map(self, worker, items, desc=None, unit="it"):
+        # fans out worker over items, keeps at most `concurrency` items in flight.
+        # items are bounded separately from calls, so a worker can fan out further
+        # (per metric etc.) through self.call without deadlocking on the same semaphore.
+        items = list(items)
+        results = [None] * len(items)
+        item_semaphore = asyncio.Semaphore(self.concurrency)
+        progress = tqdm(total=len(items), desc=desc, unit=unit)
+
+        async def run(idx, item):
+            async with item_semaphore:
+                results[idx] = await worker(item)
+            progress.update(1)
+
+        tasks = [asyncio.ensure_future(run(idx, item)) for idx, item in enumerate(items)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # one failed item fails the stage, stop the rest instead of leaving them running in the background
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            progress.close()
+        # results are indexed by position, so dataset order is kept regardless of completion order
+        return results
+
+default_scheduler = None
+
+def get_scheduler():
+    global default_scheduler
+    if default_scheduler is None:
+        default_scheduler = Scheduler()
+    return default_scheduler
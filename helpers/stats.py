@@ -0,0 +1,58 @@
+import numpy as np
+
+# keeps a bootstrap block around 32MB of float64 no matter how many rows are resampled
+BOOTSTRAP_BLOCK_ELEMENTS = 4_000_000
+
+def bootstrap_means(values, num_samples, rng):
+    # means of num_samples resamples of values. resamples are drawn in blocks so large groups don't materialise
+    # a num_samples x n index matrix at once
+    n = len(values)
+    means = np.empty(num_samples)
+    block = max(1, BOOTSTRAP_BLOCK_ELEMENTS // n)
+    for start in range(0, num_samples, block):
+        stop = min(start + block, num_samples)
+        means[start:stop] = values[rng.integers(0, n, size=(stop - start, n))].mean(axis=1)
+    return means
+
+def bootstrap_mean_ci(values, num_samples=1000, confidence=0.95, seed=0):
+    # percentile bootstrap of the mean
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n == 0:
+        return None, None
+    if n == 1:
+        return float(values[0]), float(values[0])
+
+    means = bootstrap_means(values, num_samples, np.random.default_rng(seed))
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+def stratified_bootstrap_mean_ci(groups, weights, num_samples=1000, confidence=0.95, seed=0):
+    # percentile bootstrap of a stratified mean, every group is resampled on its own and the group means are
+    # combined with the given weights (e.g. each stratum's share of the population). empty groups are left out
+    # and the remaining weights renormalised
+    rng = np.random.default_rng(seed)
+    means = np.zeros(num_samples)
+    total_weight = 0.0
+    for values, weight in zip(groups, weights):
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            continue
+        means += weight * (bootstrap_means(values, num_samples, rng) if len(values) > 1 else values[0])
+        total_weight += weight
+    if total_weight == 0:
+        return None, None
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means / total_weight, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+def top_k_indices(values, k, largest=True):
+    # indices of the k largest (or smallest) values, best first. argpartition is O(n), only the k picked are sorted
+    values = np.asarray(values, dtype=float)
+    k = min(k, len(values))
+    if k <= 0:
+        return np.array([], dtype=int)
+    keys = -values if largest else values
+    picked = np.argpartition(keys, k - 1)[:k]
+    return picked[np.argsort(keys[picked], kind="stable")]
@@ -0,0 +1,170 @@
+import json
+import os
+import time
+from contextvars import ContextVar
+import numpy as np
+
+# usd per 1M tokens (input, output, cached input). used for the cost estimate only, update when pricing changes
+PRICING_PER_MILLION = {
+    "gemini-2.5-flash-lite": (0.10, 0.40, 0.025),
+    "gemini-2.5-flash": (0.30, 2.50, 0.075),
+    "gemini-2.5-pro": (1.25, 10.00, 0.31)
+}
+
+# set by Scheduler.call when a call starts waiting for a slot, so the queue wait can be split from network time
+call_queued_at = ContextVar("call_queued_at", default=None)
+
+class Telemetry():
+    # one event per llm call, appended to a jsonl trace and summarised per stage at the end of a run
+    def __init__(self, trace_path=None, pricing=None):
+        self.trace_path = trace_path
+        self.pricing = pricing or PRICING_PER_MILLION
+        self.events = []
+        self.started_at = time.time()
+        self.ended_at = None
+        self.trace_file = None
+        if trace_path:
+            trace_dir = os.path.dirname(str(trace_path))
+            if trace_dir:
+                os.makedirs(trace_dir, exist_ok=True)
+            self.trace_file = open(trace_path, "a", encoding="utf-8")
+
+    @classmethod
+    def from_traces(cls, trace_paths, pricing=None):
+        # summarises the traces of runs that already finished, e.g. one per shard, as if they were one run.
+        # wall time spans the first call's start to the last call's end across all of them
+        telemetry = cls(pricing=pricing)
+        for trace_path in trace_paths:
+            if not os.path.exists(trace_path):
+                continue
+            with open(trace_path, "r", encoding="utf-8") as f:
+                telemetry.events.extend(json.loads(line) for line in f if line.strip())
+        if telemetry.events:
+            telemetry.started_at = min(e["ts"] - (e.get("total_s") or 0) for e in telemetry.events)
+            telemetry.ended_at = max(e["ts"] for e in telemetry.events)
+        return telemetry
+
+    def record(self, event):
+        event = {"ts": time.time(), **event}
+        self.events.append(event)
+        if self.trace_file is not None:
+            self.trace_file.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+            self.trace_file.flush()
+
+    def live_calls(self):
+        # calls that went out to a provider so far, cache hits are free
+        return sum(1 for event in self.events if not event.get("cache_hit"))
+
+    def estimate_cost(self, model, prompt_tokens, completion_tokens, cached_prompt_tokens=0):
+        if model not in self.pricing:
+            return None
+        input_price, output_price, cached_input_price = self.pricing[model]
+        # cached tokens are part of prompt_tokens, just billed at the cached rate
+        return ((prompt_tokens - cached_prompt_tokens) * input_price + cached_prompt_tokens * cached_input_price + completion_tokens * output_price) / 1_000_000
+
+    def summary(self):
+        wall_time = (self.ended_at or time.time()) - self.started_at
+        stages = {}
+        for event in self.events:
+            stages.setdefault(event.get("stage") or "unknown", []).append(event)
+
+        summary = {"wall_time_s": wall_time, "stages": {}}
+        total_tokens = 0
+        total_cost = 0.0
+        for stage, events in stages.items():
+            live = [e for e in events if not e.get("cache_hit")]
+            latencies = np.array([e["total_s"] for e in live], dtype=float)
+            prompt_tokens = sum(e.get("prompt_tokens") or 0 for e in live)
+            cached_prompt_tokens = sum(e.get("cached_prompt_tokens") or 0 for e in live)
+            completion_tokens = sum(e.get("completion_tokens") or 0 for e in live)
+            costs = [self.estimate_cost(e.get("model"), e.get("prompt_tokens") or 0, e.get("completion_tokens") or 0, e.get("cached_prompt_tokens") or 0) for e in live]
+            cost = sum(c for c in costs if c is not None)
+            network_time = sum(e.get("network_s") or 0 for e in live)
+            ttfts = [e["ttft_s"] for e in live if e.get("ttft_s") is not None]
+
+            summary["stages"][stage] = {
+                "calls": len(events),
+                "cache_hits": len(events) - len(live),
+                "errors": sum(1 for e in events if e.get("status") != "ok"),
+                "retries": sum(max(0, (e.get("attempts") or 1) - 1) for e in live),
+                "p50_s": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "p95_s": float(np.percentile(latencies, 95)) if len(latencies) else None,
+                "p99_s": float(np.percentile(latencies, 99)) if len(latencies) else None,
+                "mean_queue_wait_s": float(np.mean([e.get("queue_wait_s") or 0 for e in live])) if live else None,
+                "mean_network_s": network_time / len(live) if live else None,
+                # streamed calls only
+                "p50_ttft_s": float(np.percentile(ttfts, 50)) if ttfts else None,
+                "p95_ttft_s": float(np.percentile(ttfts, 95)) if ttfts else None,
+                "stream_aborts": sum(e.get("stream_aborts") or 0 for e in live),
+                "prompt_tokens": prompt_tokens,
+                "cached_prompt_tokens": cached_prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "completion_tokens_per_s": completion_tokens / network_time if network_time else None,
+                "estimated_cost_usd": cost
+            }
+            tiers = self.tier_summary(events)
+            if tiers:
+                summary["stages"][stage]["tiers"] = tiers
+            total_tokens += prompt_tokens + completion_tokens
+            total_cost += cost
+
+        summary["total_tokens"] = total_tokens
+        summary["tokens_per_s"] = total_tokens / wall_time if wall_time else None
+        summary["estimated_cost_usd"] = total_cost
+        return summary
+
+    def tier_summary(self, events):
+        # model cascade tiers of a stage's calls, latency and cost of each to weigh accuracy against throughput
+        tiers = {}
+        for event in events:
+            if event.get("tier") is not None:
+                tiers.setdefault(event["tier"], []).append(event)
+        summary = {}
+        for tier, tier_events in sorted(tiers.items()):
+            live = [e for e in tier_events if not e.get("cache_hit")]
+            latencies = np.array([e["total_s"] for e in live], dtype=float)
+            costs = [self.estimate_cost(e.get("model"), e.get("prompt_tokens") or 0, e.get("completion_tokens") or 0, e.get("cached_prompt_tokens") or 0) for e in live]
+            summary[tier] = {
+                "models": sorted({e.get("model") for e in tier_events}),
+                "calls": len(tier_events),
+                "cache_hits": len(tier_events) - len(live),
+                "errors": sum(1 for e in tier_events if e.get("status") != "ok"),
+                "p50_s": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "p95_s": float(np.percentile(latencies, 95)) if len(latencies) else None,
+                "estimated_cost_usd": sum(c for c in costs if c is not None)
+            }
+        return summary
+
+    def print_summary(self):
+        summary = self.summary()
+        print("========= LLM Call Summary =========")
+        for stage, stats in summary["stages"].items():
+            latency = "n/a" if stats["p50_s"] is None else f"p50 {stats['p50_s']:.2f}s | p95 {stats['p95_s']:.2f}s | p99 {stats['p99_s']:.2f}s"
+            streaming = "" if stats["p50_ttft_s"] is None else f" | ttft p50 {stats['p50_ttft_s']:.2f}s / p95 {stats['p95_ttft_s']:.2f}s, {stats['stream_aborts']} streams aborted"
+            print(f"{stage}: {stats['calls']} calls ({stats['cache_hits']} cached, {stats['errors']} failed, {stats['retries']} retries) | {latency}{streaming} | {stats['prompt_tokens']} in ({stats['cached_prompt_tokens']} cached) / {stats['completion_tokens']} out tokens | ${stats['estimated_cost_usd']:.4f}")
+            for tier, tier_stats in stats.get("tiers", {}).items():
+                tier_latency = "n/a" if tier_stats["p50_s"] is None else f"p50 {tier_stats['p50_s']:.2f}s | p95 {tier_stats['p95_s']:.2f}s"
+                print(f"  tier {tier} ({', '.join(tier_stats['models'])}): {tier_stats['calls']} calls ({tier_stats['cache_hits']} cached, {tier_stats['errors']} failed) | {tier_latency} | ${tier_stats['estimated_cost_usd']:.4f}")
+        tokens_per_s = summary["tokens_per_s"] or 0.0
+        print(f"Total: {summary['total_tokens']} tokens in {summary['wall_time_s']:.1f}s ({tokens_per_s:.1f} tokens/s), estimated cost ${summary['estimated_cost_usd']:.4f}")
+        return summary
+
+    def close(self):
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+
+telemetry = None
+
+def configure_telemetry(trace_path=None, pricing=None):
+    global telemetry
+    if telemetry is not None:
+        telemetry.close()
+    telemetry = Telemetry(trace_path=trace_path, pricing=pricing)
+    return telemetry
+
+def get_telemetry():
+    global telemetry
+    if telemetry is None:
+        telemetry = Telemetry(trace_path=os.environ.get("LLM_TRACE_PATH"))
+    return telemetry
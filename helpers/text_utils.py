@@ -0,0 +1,43 @@
+import re
+from difflib import SequenceMatcher
+
+# most specific first, the last match in the text wins since solutions restate intermediate results
+FINAL_ANSWER_PATTERNS = [
+    re.compile(r"\\boxed\{((?:[^{}]|\{[^{}]*\})*)\}"),
+    re.compile(r"final answer\s*(?:is|:|=)?\s*[:=]?\s*(.+)", re.IGNORECASE),
+    re.compile(r"^\s*answer\s*[:=]\s*(.+)$", re.IGNORECASE | re.MULTILINE)
+]
+MARKUP_PATTERN = re.compile(r"[*_#`>]|\\\(|\\\)|\\\[|\\\]|\$")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+def normalize_text(text):
+    # lowercase, markdown/latex delimiters dropped, whitespace collapsed. formatting-only differences vanish
+    text = MARKUP_PATTERN.sub(" ", (text or "").lower())
+    return WHITESPACE_PATTERN.sub(" ", text).strip()
+
+def normalize_answer(answer):
+    answer = normalize_text(answer)
+    answer = re.sub(r"\\text\{([^{}]*)\}", r"\1", answer)
+    answer = re.sub(r"\\(?:,|;|!| )", "", answer)
+    return answer.replace(" ", "").rstrip(".")
+
+def extract_final_answer(solution_text):
+    # None when the solution has no recognisable final answer, callers should treat that as unknown
+    for pattern in FINAL_ANSWER_PATTERNS:
+        matches = pattern.findall(solution_text or "")
+        if matches:
+            answer = normalize_answer(matches[-1].strip().splitlines()[0] if matches[-1].strip() else "")
+            if answer:
+                return answer
+    return None
+
+def text_similarity(text_a, text_b, min_ratio=0.0):
+    # token level similarity ratio in [0, 1] of the normalized texts. the cheap upper bounds run first, so a
+    # pair that can't reach min_ratio never pays for the full comparison
+    tokens_a, tokens_b = normalize_text(text_a).split(), normalize_text(text_b).split()
+    if tokens_a == tokens_b:
+        return 1.0
+    matcher = SequenceMatcher(None, tokens_a, tokens_b, autojunk=False)
+    if matcher.real_quick_ratio() < min_ratio or matcher.quick_ratio() < min_ratio:
+        return matcher.quick_ratio()
+    return matcher.ratio()
@@ -1,3 +1,15 @@
+import json
+import textwrap
 
 def convert_list_to_dict_with_key(lst, key):
-    return {item[key]: item for item in lst}
\ No newline at end of file
+    return {item[key]: item for item in lst}
+
+def dump_json_array(records, f):
+    # same output as json.dump(records, f, indent=2) but writes one record at a time, records can be a generator
+    f.write("[")
+    count = 0
+    for record in records:
+        f.write(",\n" if count else "\n")
+        f.write(textwrap.indent(json.dumps(record, indent=2, ensure_ascii=False), "  "))
+        count += 1
+    f.write("\n]" if count else "]")
@@ -1,36 +1,365 @@
+import argparse
+import asyncio
 import os
+import sys
+import json
+import tomllib
 from pathlib import Path
 from core.relevance_evaluator import RelevanceEvaluator
-from core.solution_builder import SolutionBuilder
+from core.solution_builder import SolutionBuilder, COMPARED_VARIANTS
 from core.comparative_analyzer import ComparativeAnalyzer
+from core.pipeline import Pipeline
+from core.planner import STAGES, STAGE_TAGS, RunPlan, plan_run
+from core.adaptive_sampler import AdaptiveSampler
 from helpers.dataloader import Dataloader
+from helpers.scheduler import Scheduler
+from helpers.batch_provider import BatchScheduler, OpenAIBatchBackend, LocalBatchBackend, forward_to_provider
+from helpers.rate_limiter import get_rate_limiter
+from helpers.ai_provider import close_providers, resolve_route, route_stage, set_stage_temperature
+from helpers.telemetry import configure_telemetry
+from helpers.result_store import ResultStore
+from helpers.model_cascade import set_cascade, print_cascade_summary
+from helpers.dedupe import DuplicateIndex
 
 from dotenv import load_dotenv
 load_dotenv()
-      
-async def main():
-    reports_dir = Path("./reports")
-    if not os.path.exists(reports_dir):
-        os.makedirs(reports_dir)
-        
-    dataloader = Dataloader('similar_question_data.json')
-    dataset = dataloader.get_random_subset(2)
-    
-    rel_eval = RelevanceEvaluator(similar_questions_data=dataset, reports_dir=reports_dir)
-    await rel_eval.evaluate()
-    
-    solution_builder = SolutionBuilder(similar_question_data=dataset, reports_dir=reports_dir)
-    solutions_with_similar, solutions_without_similar = await solution_builder.build_solution()
-    
-    comparative_analyzer = ComparativeAnalyzer(
-        similar_question_data=dataset,
-        generated_solutions_w_similar=solutions_with_similar,
-        generated_solutions_wo_similar=solutions_without_similar,
-        reports_dir=reports_dir
+
+# runs any subset of the stages, later stages pick up what earlier runs left in the result store.
+#
+#   python main.py                                        # every stage on the whole dataset
+#   python main.py relevance build --sample-size 50       # just these stages, on a seeded sample
+#   python main.py analyze insights --model gemini-2.5-flash --stage-model insights=gemini-2.5-pro
+#   python main.py --config run.toml --dry-run            # planned calls and tokens, no calls made
+#   python main.py analyze --cascade "analyze=gemini-2.5-flash-lite>gemini-2.5-pro"   # escalate uncertain verdicts
+#   python main.py --adaptive --target-ci-width 0.1 --max-calls 5000   # stop once the mean score is pinned down
+#
+# settings come from, in increasing priority: the env (see example.env), the --config file (toml or json, keys
+# are the option names with underscores) and the command line.
+
+def env_flag(name, default=""):
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+def get_defaults():
+    return {
+        "stages": list(STAGES),
+        "data": "similar_question_data.json",
+        "reports_dir": "reports",
+        "sample_size": None,
+        "seed": 0,
+        "subjects": None,
+        "question_ids": None,
+        "concurrency": int(os.environ.get("LLM_CONCURRENCY", 8)),
+        "batch_mode": os.environ.get("BATCH_MODE", "").lower() or None,
+        "pipelined": env_flag("PIPELINE_MODE"),
+        "cache": not env_flag("LLM_CACHE_DISABLED"),
+        "cache_path": os.environ.get("LLM_CACHE_PATH"),
+        "stream": env_flag("LLM_STREAMING"),
+        "model": None,
+        "stage_models": {},
+        "temperatures": {},
+        "judge_mode": os.environ.get("JUDGE_MODE", "per_metric"),
+        # skip or shrink the judge sweep for pairs that reach the same final answer with near identical text. opt in,
+        # it changes the verdicts of those pairs (an automatic TIE instead of the judge's call)
+        "judge_early_exit": env_flag("JUDGE_EARLY_EXIT"),
+        # judge every pair in both orders and debias the verdicts, twice the judge calls at the same concurrency
+        "judge_position_swap": env_flag("JUDGE_POSITION_SWAP"),
+        "relevance_mode": os.environ.get("RELEVANCE_MODE", "separate"),
+        # stage -> model tiers, cheapest first. a call escalates to the next tier when the answer signals uncertainty
+        "cascades": {},
+        # judge verdicts won by less than this margin escalate
+        "judge_cascade_margin": float(os.environ.get("JUDGE_CASCADE_MARGIN", 0.2)),
+        # exact duplicate questions share their relevance judgment and solutions, near duplicates are only reported
+        "dedupe": not env_flag("DEDUPE_DISABLED"),
+        "store": os.environ.get("RESULT_STORE_PATH"),
+        # the result store has every result, the pretty json reports are opt in
+        "export_json": env_flag("EXPORT_JSON"),
+        "trace": os.environ.get("LLM_TRACE_PATH"),
+        # evaluate subject stratified batches until the mean score's confidence interval is narrow enough
+        "adaptive": False,
+        "adaptive_batch_size": 50,
+        "target_ci_width": 0.1,
+        "max_calls": None,
+        "dry_run": False
+    }
+
+def parse_stage_values(values, cast=str):
+    # ["analyze=gemini-2.5-flash", ...] -> {"analyze": "gemini-2.5-flash", ...}
+    parsed = {}
+    for value in values:
+        stage, sep, setting = value.partition("=")
+        if not sep or stage not in STAGES:
+            raise argparse.ArgumentTypeError(f"Expected <stage>=<value> with a stage out of {', '.join(STAGES)}, got '{value}'.")
+        parsed[stage] = cast(setting)
+    return parsed
+
+def load_config_file(path):
+    with open(path, "rb") as f:
+        config = tomllib.load(f) if str(path).endswith(".toml") else json.load(f)
+    unknown = set(config) - set(get_defaults())
+    if unknown:
+        raise ValueError(f"Unknown settings in {path}: {', '.join(sorted(unknown))}.")
+    return config
+
+def parse_args(argv=None):
+    # nothing defaults here, so only the options actually given override the config file
+    parser = argparse.ArgumentParser(description="Evaluate whether similar questions help an llm solve a question.", argument_default=argparse.SUPPRESS)
+    parser.add_argument("stages", nargs="*", help=f"Stages to run, any of {', '.join(STAGES)}. Defaults to all of them.")
+    parser.add_argument("--config", help="Toml or json file with any of the settings below.")
+    parser.add_argument("--data", help="Dataset file, json array or jsonl.")
+    parser.add_argument("--reports-dir")
+    parser.add_argument("--sample-size", type=int, help="Evaluate a random sample of this many questions instead of all of them.")
+    parser.add_argument("--seed", type=int, help="Sample seed, keep it to run later stages on the same sample.")
+    parser.add_argument("--subjects", nargs="+")
+    parser.add_argument("--question-ids", nargs="+")
+    parser.add_argument("--concurrency", type=int, help="Calls in flight.")
+    parser.add_argument("--batch-mode", choices=["provider", "local"], help="Send the calls as batch jobs instead.")
+    parser.add_argument("--pipelined", action="store_true", help="Stream every question through relevance, build and analyze together.")
+    parser.add_argument("--no-cache", dest="cache", action="store_false", help="Don't read or write the response cache.")
+    parser.add_argument("--cache-path")
+    parser.add_argument("--stream", action="store_true", help="Stream structured responses, malformed ones are aborted as soon as they break the schema.")
+    parser.add_argument("--model", help="Model of every stage.")
+    parser.add_argument("--stage-model", dest="stage_models", action="append", metavar="STAGE=MODEL", help="Model of one stage, repeatable.")
+    parser.add_argument("--temperature", dest="temperatures", action="append", metavar="STAGE=TEMPERATURE", help="Temperature of one stage, repeatable.")
+    parser.add_argument("--judge-mode", choices=["per_metric", "combined"])
+    parser.add_argument("--early-exit", dest="judge_early_exit", action="store_true", help="Tie pairs with the same final answer and near identical text without judging them, and judge similar ones on the non answer metrics only.")
+    parser.add_argument("--position-swap", dest="judge_position_swap", action="store_true")
+    parser.add_argument("--relevance-mode", choices=["separate", "fused"])
+    parser.add_argument("--cascade", dest="cascades", action="append", metavar="STAGE=MODEL>MODEL", help="Model cascade of the relevance or analyze stage, tiers are [provider:]model, cheapest first. Repeatable.")
+    parser.add_argument("--cascade-margin", dest="judge_cascade_margin", type=float, help="Judge verdicts won by less than this margin escalate to the next tier.")
+    parser.add_argument("--no-dedupe", dest="dedupe", action="store_false", help="Evaluate exact duplicate questions separately.")
+    parser.add_argument("--store", help="Result store path, defaults to <reports-dir>/results.sqlite.")
+    parser.add_argument("--export-json", action="store_true", help="Also write the pretty json reports, the result store has everything.")
+    parser.add_argument("--trace", help="Llm call trace path, defaults to <reports-dir>/llm_trace.jsonl.")
+    parser.add_argument("--adaptive", action="store_true", help="Evaluate batches of questions, stratified by subject, until the mean score is known well enough.")
+    parser.add_argument("--adaptive-batch-size", type=int, help="Questions per adaptive batch.")
+    parser.add_argument("--target-ci-width", type=float, help="Adaptive sampling stops once the mean score's 95%% CI is this narrow.")
+    parser.add_argument("--max-calls", type=int, help="Adaptive sampling stops before its live llm calls exceed this budget.")
+    parser.add_argument("--dry-run", action="store_true", help="Print the planned calls and tokens without making any.")
+    args = vars(parser.parse_args(argv))
+
+    config = get_defaults()
+    config_path = args.pop("config", None)
+    if config_path:
+        config.update(load_config_file(config_path))
+    try:
+        if "stage_models" in args:
+            args["stage_models"] = {**config["stage_models"], **parse_stage_values(args["stage_models"])}
+        if "temperatures" in args:
+            args["temperatures"] = {**config["temperatures"], **parse_stage_values(args["temperatures"], float)}
+        if "cascades" in args:
+            args["cascades"] = {**config["cascades"], **parse_stage_values(args["cascades"], lambda tiers: tiers.split(">"))}
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    if not args.get("stages", True):
+        args.pop("stages")
+    config.update(args)
+
+    invalid = [stage for stage in config["stages"] if stage not in STAGES]
+    if invalid:
+        parser.error(f"Unknown stages {', '.join(invalid)}, choose from {', '.join(STAGES)}.")
+    # always run in pipeline order, whatever order they were given in
+    config["stages"] = [stage for stage in STAGES if stage in config["stages"]]
+    invalid = [stage for stage in config["cascades"] if stage not in ("relevance", "analyze")]
+    if invalid:
+        parser.error(f"Model cascades are for the relevance and analyze stages, they escalate on uncertain judgments. Got {', '.join(invalid)}.")
+    if config["adaptive"] and not {"build", "analyze"} <= set(config["stages"]):
+        parser.error("Adaptive sampling needs the build and analyze stages, it stops on the scores they produce.")
+    return config
+
+def apply_settings(config):
+    # the cache and the clients read these lazily, so setting them before the first call is enough
+    if not config["cache"]:
+        os.environ["LLM_CACHE_DISABLED"] = "true"
+    if config["cache_path"]:
+        os.environ["LLM_CACHE_PATH"] = config["cache_path"]
+    os.environ["LLM_STREAMING"] = "true" if config["stream"] else "false"
+    for stage, tag in STAGE_TAGS.items():
+        model = config["stage_models"].get(stage) or config["model"]
+        if model:
+            # keeps the provider an LLM_STAGE_ROUTES entry picked for the stage
+            provider_name, _ = resolve_route(tag, None)
+            route_stage(tag, provider_name, model)
+        if stage in config["temperatures"]:
+            set_stage_temperature(tag, float(config["temperatures"][stage]))
+        if stage in config["cascades"]:
+            tiers = config["cascades"][stage]
+            set_cascade(tag, tiers.split(">") if isinstance(tiers, str) else tiers)
+
+def load_questions(config):
+    dataloader = Dataloader(config["data"], streaming=True)
+    filters = {"subjects": config["subjects"], "question_ids": config["question_ids"]}
+    if config["sample_size"]:
+        # seeded reservoir sample, the same options pick the same questions in every run
+        return dataloader.get_random_subset(config["sample_size"], seed=config["seed"], **filters)
+    return dataloader.get_dataset(**filters)
+
+def build_scheduler(config, reports_dir):
+    # one scheduler shared by all stages, bounds the number of api calls in flight.
+    # in batch mode the calls are collected into provider batch jobs instead (cheaper, not interactive)
+    if config["batch_mode"] == "provider":
+        return BatchScheduler(OpenAIBatchBackend(), jobs_dir=os.path.join(reports_dir, "batch_jobs"))
+    if config["batch_mode"] == "local":
+        return BatchScheduler(LocalBatchBackend(os.path.join(reports_dir, "local_batches"), responder=forward_to_provider), jobs_dir=os.path.join(reports_dir, "batch_jobs"), poll_interval=5.0)
+    return Scheduler(concurrency=config["concurrency"])
+
+def get_judge_options(config):
+    return {"judge_mode": config["judge_mode"], "early_exit": config["judge_early_exit"], "position_swap": config["judge_position_swap"], "cascade_margin": config["judge_cascade_margin"]}
+
+class MissingResultsError(RuntimeError):
+    # a stage was asked for before the stages it reads from ran on the questions
+    pass
+
+def load_solutions(store, question_ids):
+    without_similar, with_similar = COMPARED_VARIANTS
+    solutions_with_similar = store.get_solutions(with_similar, question_ids)
+    solutions_without_similar = store.get_solutions(without_similar, question_ids)
+    built = {s['question_id'] for s in solutions_without_similar} & {s['question_id'] for s in solutions_with_similar}
+    missing = [question_id for question_id in question_ids if question_id not in built]
+    if missing:
+        raise MissingResultsError(f"{len(missing)} questions have no stored solutions (e.g. {missing[0]}), run the build stage for them first.")
+    return solutions_with_similar, solutions_without_similar
+
+async def evaluate(dataset, stages, config, store, scheduler, duplicates):
+    # runs the relevance, build and analyze stages among the selected ones on these questions. adaptive batches
+    # export their json reports once sampling stops, a batch's export would only hold that batch
+    export_json = config["export_json"] and not config["adaptive"]
+    if config["pipelined"] and {"relevance", "build", "analyze"} <= set(stages):
+        # every question flows through build -> compare on its own, relevance runs alongside
+        pipeline = Pipeline(questions=dataset, reports_dir=config["reports_dir"], scheduler=scheduler, judge_mode=config["judge_mode"], relevance_mode=config["relevance_mode"], store=store, export_json=export_json, judge_early_exit=config["judge_early_exit"], judge_position_swap=config["judge_position_swap"], judge_cascade_margin=config["judge_cascade_margin"], duplicates=duplicates)
+        await pipeline.run()
+        return
+    if "relevance" in stages:
+        rel_eval = RelevanceEvaluator(similar_questions_data=dataset, reports_dir=config["reports_dir"], scheduler=scheduler, relevance_mode=config["relevance_mode"], store=store, export_json=export_json, duplicates=duplicates)
+        await rel_eval.evaluate()
+    if "build" in stages:
+        solution_builder = SolutionBuilder(similar_question_data=dataset, reports_dir=config["reports_dir"], scheduler=scheduler, store=store, export_json=export_json, duplicates=duplicates)
+        await solution_builder.build_solution()
+    if "analyze" in stages:
+        # solutions are read back from the store, whichever run produced them
+        solutions_with_similar, solutions_without_similar = load_solutions(store, [data['question_id'] for data in dataset])
+        comparative_analyzer = ComparativeAnalyzer(
+            similar_question_data=dataset,
+            generated_solutions_w_similar=solutions_with_similar,
+            generated_solutions_wo_similar=solutions_without_similar,
+            reports_dir=config["reports_dir"],
+            scheduler=scheduler,
+            store=store,
+            export_json=export_json,
+            **get_judge_options(config)
+        )
+        await comparative_analyzer.analyze()
+
+def plan_stages(config, stages, dataset, store, trace_path, duplicates):
+    reports_dir = config["reports_dir"]
+    plan = RunPlan(history_path=trace_path)
+    plan_run(
+        plan, stages, dataset, store,
+        RelevanceEvaluator([], reports_dir, relevance_mode=config["relevance_mode"]),
+        SolutionBuilder([], reports_dir),
+        ComparativeAnalyzer([], [], [], reports_dir, judge_mode=config["judge_mode"], early_exit=config["judge_early_exit"], position_swap=config["judge_position_swap"]),
+        duplicates=duplicates
     )
-    await comparative_analyzer.analyze()
-    await comparative_analyzer.generate_insights()
-    
-import asyncio 
+    if config["adaptive"]:
+        budget = "" if config["max_calls"] is None else f" or {config['max_calls']} calls"
+        plan.add_note("analyze", f"adaptive sampling stops once the mean score's CI is {config['target_ci_width']} wide{budget}, the counts are for the whole dataset")
+    return plan
+
+async def main(config):
+    stages = config["stages"]
+    reports_dir = Path(config["reports_dir"])
+    # a dry run leaves no files behind
+    if not config["dry_run"]:
+        os.makedirs(reports_dir, exist_ok=True)
+    apply_settings(config)
+    trace_path = config["trace"] or os.path.join(reports_dir, "llm_trace.jsonl")
+
+    dataset = load_questions(config)
+    duplicates = DuplicateIndex(dataset)
+    duplicates.print_stats()
+    if not config["dry_run"]:
+        with open(os.path.join(reports_dir, "dedupe_report.json"), "w") as f:
+            json.dump(duplicates.report(), f, indent=2, ensure_ascii=False)
+    shared_duplicates = duplicates if config["dedupe"] else None
+    # all stage results go into one compact sqlite store keyed by question_id, the pretty json reports are optional.
+    # a dry run only reads an existing store, and plans against an empty in memory one when there is none yet
+    store_path = config["store"] or os.path.join(reports_dir, "results.sqlite")
+    if not config["dry_run"]:
+        store = ResultStore(store_path)
+    elif os.path.exists(store_path):
+        store = ResultStore(store_path, read_only=True)
+    else:
+        store = ResultStore(":memory:")
+
+    # with a prompt token budget the run is planned first, an oversized prompt fails it before any call is made
+    if config["dry_run"] or os.environ.get("LLM_MAX_PROMPT_TOKENS"):
+        plan = plan_stages(config, stages, dataset, store, trace_path, shared_duplicates)
+        if config["dry_run"]:
+            plan.print_summary()
+            store.close()
+            return
+        if plan.oversized:
+            plan.print_oversized()
+            store.close()
+            raise SystemExit(f"{len(plan.oversized)} prompts exceed LLM_MAX_PROMPT_TOKENS={plan.max_prompt_tokens}, shorten them or raise the budget. Nothing was run.")
+
+    # every llm call is traced here, summarised per stage at the end of the run
+    telemetry = configure_telemetry(trace_path=trace_path)
+    store.put_questions(dataset)
+    scheduler = build_scheduler(config, reports_dir)
+
+    if config["adaptive"]:
+        sampler = AdaptiveSampler(dataset, batch_size=config["adaptive_batch_size"], target_ci_width=config["target_ci_width"], max_calls=config["max_calls"], seed=config["seed"])
+        # only reads the metric weights, turns a batch's comparisons into average scores
+        scorer = ComparativeAnalyzer([], [], [], reports_dir)
+        while batch := sampler.next_batch(telemetry.live_calls()):
+            await evaluate(batch, stages, config, store, scheduler, shared_duplicates)
+            records = store.get_comparisons([data['question_id'] for data in batch])
+            scores = scorer.build_metric_scores(records)
+            sampler.update(dict(zip(scores["question_id"], scores["average_score"])), telemetry.live_calls())
+            sampler.print_progress()
+        print(f"========= Adaptive sampling stopped ({sampler.stop_reason}) after {len(sampler.sampled)} of {sampler.population} questions =========")
+        with open(os.path.join(reports_dir, "adaptive_sampling.json"), "w") as f:
+            json.dump(sampler.report(), f, indent=2, ensure_ascii=False)
+        # insights and reports cover the sampled questions
+        dataset = sampler.sampled
+        if config["export_json"]:
+            store.export_json(reports_dir, [data['question_id'] for data in dataset])
+    else:
+        await evaluate(dataset, stages, config, store, scheduler, shared_duplicates)
+
+    if "insights" in stages:
+        # solutions and comparisons are read back from the store, whichever run produced them
+        question_ids = [data['question_id'] for data in dataset]
+        solutions_with_similar, solutions_without_similar = load_solutions(store, question_ids)
+        analysed = store.done_ids("comparisons")
+        missing = [question_id for question_id in question_ids if question_id not in analysed]
+        if missing:
+            raise MissingResultsError(f"{len(missing)} questions have no stored comparisons (e.g. {missing[0]}), run the analyze stage for them first.")
+        comparative_analyzer = ComparativeAnalyzer(
+            similar_question_data=dataset,
+            generated_solutions_w_similar=solutions_with_similar,
+            generated_solutions_wo_similar=solutions_without_similar,
+            reports_dir=reports_dir,
+            scheduler=scheduler,
+            store=store,
+            export_json=config["export_json"],
+            dedupe_stats=duplicates.stats,
+            **get_judge_options(config)
+        )
+        await comparative_analyzer.generate_insights()
+
+    print(f"========= Rate limiter stats: {get_rate_limiter().stats()} =========")
+    summary = telemetry.print_summary()
+    summary["dedupe"] = duplicates.stats
+    summary["cascades"] = print_cascade_summary()
+    with open(os.path.join(reports_dir, "llm_call_summary.json"), "w") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    telemetry.close()
+    store.close()
+    await close_providers()
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        asyncio.run(main(parse_args()))
+    except MissingResultsError as e:
+        sys.exit(f"========= {e} =========")
@@ -0,0 +1,54 @@
+import asyncio
+import importlib
+import typing
+from enum import Enum
+import pytest
+from pydantic import BaseModel
+
+# modules calling the llm through their own call_gemini import, the fake replaces it in every one of them
+LLM_CALLERS = ("core.relevance_evaluator", "core.solution_builder", "core.comparative_analyzer", "helpers.model_cascade")
+
+def fake_value(name, annotation):
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return fake_instance(annotation)
+    if isinstance(annotation, type) and issubclass(annotation, Enum):
+        return next(iter(annotation))
+    if typing.get_origin(annotation) in (list, typing.List):
+        return [fake_value(name, typing.get_args(annotation)[0])]
+    return {float: 0.5, int: 1, bool: True}.get(annotation, f"{name} text")
+
+def fake_instance(schema):
+    return schema(**{name: fake_value(name, field.annotation) for name, field in schema.model_fields.items()})
+
+class FakeLLM():
+    # stands in for call_gemini, answers every call with a valid instance of its response schema
+    def __init__(self):
+        self.calls = []
+        # schema name -> seconds each call takes
+        self.delays = {}
+
+    async def __call__(self, user_message, system_message="", response_schema=None, model=None, **kwargs):
+        name = response_schema.__name__ if response_schema else None
+        self.calls.append({"schema": name, "model": model, "user_message": user_message, **kwargs})
+        await asyncio.sleep(self.delays.get(name, 0))
+        return fake_instance(response_schema) if response_schema else "text"
+
+    def count(self, schema):
+        return sum(call["schema"] == schema for call in self.calls)
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    fake = FakeLLM()
+    for module_name in LLM_CALLERS:
+        monkeypatch.setattr(importlib.import_module(module_name), "call_gemini", fake)
+    return fake
+
+def make_question(idx, subject="PHYSICS"):
+    return {
+        "question_id": f"q{idx}",
+        "subject": subject,
+        "question_text": f"A ball of mass {idx + 1} kg moves at {idx + 2} m/s, find its kinetic energy.",
+        "similar_questions": [
+            {"similar_question_text": f"Find the kinetic energy of a {idx + 3} kg body at 2 m/s.", "summarized_solution_approach": "Use KE = 1/2 m v^2."}
+        ]
+    }
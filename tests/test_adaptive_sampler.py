@@ -0,0 +1,50 @@
+from collections import Counter
+from core.adaptive_sampler import AdaptiveSampler
+from tests.conftest import make_question
+
+# 60 physics, 30 chemistry and 10 maths questions
+DATASET = [make_question(idx, subject) for idx, subject in enumerate(["PHYSICS"] * 60 + ["CHEMISTRY"] * 30 + ["MATHS"] * 10)]
+
+def test_batches_keep_the_subject_shares():
+    sampler = AdaptiveSampler(DATASET, batch_size=20)
+    batch = sampler.next_batch()
+    assert Counter(data["subject"] for data in batch) == {"PHYSICS": 12, "CHEMISTRY": 6, "MATHS": 2}
+    batch = sampler.next_batch()
+    assert Counter(data["subject"] for data in sampler.sampled) == {"PHYSICS": 24, "CHEMISTRY": 12, "MATHS": 4}
+    assert len({data["question_id"] for data in sampler.sampled}) == 40
+
+def test_batches_are_seeded():
+    first = [data["question_id"] for data in AdaptiveSampler(DATASET, batch_size=10, seed=3).next_batch()]
+    assert first == [data["question_id"] for data in AdaptiveSampler(DATASET, batch_size=10, seed=3).next_batch()]
+    assert first != [data["question_id"] for data in AdaptiveSampler(DATASET, batch_size=10, seed=4).next_batch()]
+
+def test_stops_once_the_ci_is_narrow_enough():
+    sampler = AdaptiveSampler(DATASET, batch_size=20, target_ci_width=0.1, bootstrap_samples=200)
+    batch = sampler.next_batch()
+    # near constant scores give a narrow interval right away
+    assert sampler.update({data["question_id"]: 0.5 + 0.01 * (idx % 2) for idx, data in enumerate(batch)})
+    assert sampler.stop_reason == "ci_width"
+    assert sampler.next_batch() == []
+    assert sampler.report()["history"][0]["ci_width"] <= 0.1
+
+def test_keeps_sampling_while_the_ci_is_wide():
+    sampler = AdaptiveSampler(DATASET, batch_size=20, target_ci_width=0.01, bootstrap_samples=200)
+    batch = sampler.next_batch()
+    assert not sampler.update({data["question_id"]: float(idx % 2) for idx, data in enumerate(batch)})
+    assert len(sampler.next_batch()) == 20
+
+def test_budget_shrinks_the_last_batch():
+    sampler = AdaptiveSampler(DATASET, batch_size=20, target_ci_width=0.0, max_calls=100, bootstrap_samples=100)
+    batch = sampler.next_batch()
+    # 4 calls per question so far, 20 calls left fit 5 more questions
+    assert not sampler.update({data["question_id"]: float(idx % 2) for idx, data in enumerate(batch)}, calls_used=80)
+    assert len(sampler.next_batch(calls_used=80)) == 5
+    assert sampler.update({data["question_id"]: 1.0 for data in sampler.sampled[20:]}, calls_used=100)
+    assert sampler.stop_reason == "budget"
+
+def test_exhausted_dataset():
+    sampler = AdaptiveSampler(DATASET[:5], batch_size=20, target_ci_width=0.0)
+    batch = sampler.next_batch()
+    assert len(batch) == 5
+    assert sampler.update({data["question_id"]: 1.0 for data in batch})
+    assert sampler.report()["stop_reason"] == "exhausted"
@@ -0,0 +1,31 @@
+import importlib.util
+import pytest
+import helpers.ai_provider as ai_provider
+from helpers.ai_provider import AIProvider, get_provider
+
+@pytest.fixture(autouse=True)
+def no_providers(monkeypatch):
+    monkeypatch.setattr(ai_provider, "providers", {})
+
+def test_http2_is_on_by_default(monkeypatch):
+    monkeypatch.delenv("LLM_HTTP2", raising=False)
+    assert AIProvider(api_keys="key").http2 == (importlib.util.find_spec("h2") is not None)
+    monkeypatch.setenv("LLM_HTTP2", "false")
+    assert not AIProvider(api_keys="key").http2
+
+def test_http2_falls_back_to_http1_without_h2(monkeypatch, capsys):
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: None)
+    assert not AIProvider(api_keys="key", http2=True).http2
+    assert "h2 package is not installed" in capsys.readouterr().out
+
+def test_named_providers_come_from_the_env(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "default-key")
+    monkeypatch.setenv("LLM_PROVIDER_JUDGE_BASE_URL", "http://127.0.0.1:8000/v1/")
+    monkeypatch.setenv("LLM_PROVIDER_JUDGE_API_KEYS", "a, b")
+    judge = get_provider("judge")
+    assert judge.api_keys == ["a", "b"]
+    assert str(judge.get_client().base_url) == "http://127.0.0.1:8000/v1/"
+    assert get_provider("judge") is judge
+    assert get_provider().api_keys == ["default-key"]
+    with pytest.raises(ValueError):
+        get_provider("unknown")
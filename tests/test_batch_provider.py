@@ -0,0 +1,115 @@
+import asyncio
+import json
+from types import SimpleNamespace
+import pytest
+from pydantic import ValidationError
+import helpers.batch_provider as batch_provider
+from core.datatypes import Solution
+from helpers.ai_provider import call_gemini
+from helpers.batch_provider import BatchScheduler, LocalBatchBackend
+from main import build_scheduler
+
+@pytest.fixture(autouse=True)
+def no_response_cache(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE_DISABLED", "true")
+
+def solution_json(body):
+    return json.dumps({"thoughts": "kinetic energy", "generated_solution": body["messages"][-1]["content"]})
+
+def make_scheduler(tmp_path, responder, **kwargs):
+    backend = LocalBatchBackend(str(tmp_path / "local_batches"), responder=responder)
+    return BatchScheduler(backend, jobs_dir=str(tmp_path / "jobs"), idle_seconds=0.01, poll_interval=0.01, **kwargs)
+
+def test_local_batch_runs_to_completion(tmp_path):
+    requests = []
+    def responder(body):
+        requests.append(body)
+        return solution_json(body)
+    scheduler = make_scheduler(tmp_path, responder)
+
+    async def run():
+        return await asyncio.gather(*[scheduler.call(call_gemini, f"question {idx}", "system", Solution, temperature=0.1) for idx in range(5)])
+
+    solutions = asyncio.run(run())
+    # every call went into one job and got its own answer back
+    assert [solution.generated_solution for solution in solutions] == [f"question {idx}" for idx in range(5)]
+    assert len(requests) == 5
+    assert requests[0]["response_format"]["json_schema"]["name"] == "Solution"
+    assert len(list((tmp_path / "jobs").glob("*.output.jsonl"))) == 1
+
+def test_async_responder_and_plain_text(tmp_path):
+    async def responder(body):
+        await asyncio.sleep(0)
+        return "4 J"
+    scheduler = make_scheduler(tmp_path, responder)
+    assert asyncio.run(scheduler.call(call_gemini, "question", "system")) == "4 J"
+
+def test_invalid_responses_are_resubmitted(tmp_path):
+    attempts = {}
+    def responder(body):
+        question = body["messages"][-1]["content"]
+        attempts[question] = attempts.get(question, 0) + 1
+        # the flaky question answers properly on its third submission
+        if question == "flaky" and attempts[question] < 3:
+            return "{not json"
+        return solution_json(body)
+    scheduler = make_scheduler(tmp_path, responder, max_attempts=4)
+
+    async def run():
+        return await asyncio.gather(*[scheduler.call(call_gemini, question, "system", Solution) for question in ("steady", "flaky")])
+
+    assert [solution.generated_solution for solution in asyncio.run(run())] == ["steady", "flaky"]
+    assert attempts == {"steady": 1, "flaky": 3}
+
+def test_requests_fail_after_max_attempts(tmp_path):
+    calls = []
+    def responder(body):
+        calls.append(body)
+        return "{not json"
+    scheduler = make_scheduler(tmp_path, responder, max_attempts=2)
+    with pytest.raises(ValidationError):
+        asyncio.run(scheduler.call(call_gemini, "question", "system", Solution))
+    assert len(calls) == 2
+
+def test_invalid_responses_raise_right_away_without_retry_invalid(tmp_path):
+    calls = []
+    def responder(body):
+        calls.append(body)
+        return "{not json"
+    scheduler = make_scheduler(tmp_path, responder, max_attempts=4)
+    with pytest.raises(ValidationError):
+        asyncio.run(scheduler.call(call_gemini, "question", "system", Solution, retry_invalid=False))
+    assert len(calls) == 1
+
+def test_failing_responder_items_are_resubmitted(tmp_path):
+    attempts = []
+    def responder(body):
+        attempts.append(body)
+        if len(attempts) == 1:
+            raise ConnectionError("reset by peer")
+        return solution_json(body)
+    scheduler = make_scheduler(tmp_path, responder, max_attempts=3)
+    assert asyncio.run(scheduler.call(call_gemini, "question", "system", Solution)).generated_solution == "question"
+    assert len(attempts) == 2
+
+class FakeCompletions():
+    def __init__(self):
+        self.requests = []
+
+    async def create(self, **body):
+        self.requests.append(body)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=solution_json(body)))])
+
+def test_local_batch_mode_forwards_to_the_provider(tmp_path, monkeypatch):
+    completions = FakeCompletions()
+    monkeypatch.setattr(batch_provider, "get_ai_client", lambda: SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    scheduler = build_scheduler({"batch_mode": "local"}, str(tmp_path))
+    scheduler.idle_seconds = scheduler.poll_interval = 0.01
+
+    async def run():
+        return await asyncio.gather(*[scheduler.call(call_gemini, f"question {idx}", "system", Solution) for idx in range(3)])
+
+    assert [solution.generated_solution for solution in asyncio.run(run())] == [f"question {idx}" for idx in range(3)]
+    assert len(completions.requests) == 3
+    assert completions.requests[0]["response_format"]["json_schema"]["name"] == "Solution"
+    assert len(list((tmp_path / "local_batches").glob("*.output.jsonl"))) == 1
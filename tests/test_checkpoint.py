@@ -0,0 +1,56 @@
+import json
+import os
+from helpers.checkpoint import Checkpoint
+
+def write_records(path, records, **kwargs):
+    with Checkpoint(path, **kwargs) as checkpoint:
+        for record in records:
+            checkpoint.append(record)
+
+def test_resume_skips_completed_records(tmp_path):
+    path = str(tmp_path / "report.jsonl")
+    write_records(path, [{"question_id": "q1", "value": 1}, {"question_id": "q2", "value": 2}])
+
+    with Checkpoint(path) as checkpoint:
+        assert checkpoint.is_done("q1") and checkpoint.is_done("q2")
+        assert checkpoint.get("q2") == {"question_id": "q2", "value": 2}
+        assert checkpoint.pending([{"question_id": "q1"}, {"question_id": "q3"}]) == [{"question_id": "q3"}]
+        checkpoint.append({"question_id": "q3", "value": 3})
+        # only what this run wrote is new
+        assert not checkpoint.is_new("q1")
+        assert checkpoint.is_new("q3")
+        assert checkpoint.ordered(["q3", "missing", "q1"]) == [{"question_id": "q3", "value": 3}, {"question_id": "q1", "value": 1}]
+
+def test_resume_after_partial_last_line(tmp_path):
+    path = str(tmp_path / "report.jsonl")
+    write_records(path, [{"question_id": "q1"}])
+    with open(path, "a") as f:
+        f.write('{"question_id": "q2", "val')
+
+    with Checkpoint(path) as checkpoint:
+        # the cut record is redone, the next one starts on its own line
+        assert checkpoint.is_done("q1") and not checkpoint.is_done("q2")
+        checkpoint.append({"question_id": "q2"})
+    with Checkpoint(path) as checkpoint:
+        assert checkpoint.get("q2") == {"question_id": "q2"}
+
+def test_no_resume_starts_over(tmp_path):
+    path = str(tmp_path / "report.jsonl")
+    write_records(path, [{"question_id": "q1"}])
+    with Checkpoint(path, resume=False) as checkpoint:
+        assert not checkpoint.is_done("q1")
+
+def test_settings_change_moves_checkpoint_aside(tmp_path):
+    path = str(tmp_path / "report.jsonl")
+    write_records(path, [{"question_id": "q1"}], settings={"judge_mode": "per_metric"})
+
+    with Checkpoint(path, settings={"judge_mode": "per_metric"}) as checkpoint:
+        assert checkpoint.is_done("q1") and not checkpoint.invalidated
+
+    with Checkpoint(path, settings={"judge_mode": "combined"}) as checkpoint:
+        assert checkpoint.invalidated
+        assert not checkpoint.is_done("q1")
+    assert os.path.exists(f"{path}.stale")
+    with open(path) as f:
+        header = json.loads(f.readline())
+    assert header["settings"] == {"judge_mode": "combined"}
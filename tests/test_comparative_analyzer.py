@@ -0,0 +1,47 @@
+import pytest
+from core.comparative_analyzer import ComparativeAnalyzer
+from core.datatypes import MetricEvaluation, WinnerSolution
+
+A, B, TIE = WinnerSolution.SOLUTION_A, WinnerSolution.SOLUTION_B, WinnerSolution.TIE
+
+@pytest.fixture
+def analyzer(tmp_path):
+    return ComparativeAnalyzer([], [], [], str(tmp_path))
+
+def verdict(winner, margin):
+    return MetricEvaluation(winner=winner, margin_of_winning=margin, reasoning=f"{winner.value} by {margin}")
+
+def test_agreeing_orders_keep_the_winner(analyzer):
+    # in the swapped order SOLUTION_B is the solution generated with similar questions
+    reconciled = analyzer.reconcile_positions(verdict(A, 0.8), verdict(B, 0.4))
+    assert reconciled["winner"] == A.value
+    assert reconciled["margin_of_winning"] == pytest.approx(0.6)
+    assert reconciled["position_swap"]["swapped"] == {"winner": B.value, "margin_of_winning": 0.4}
+
+def test_position_preference_cancels_out(analyzer):
+    reconciled = analyzer.reconcile_positions(verdict(A, 0.5), verdict(A, 0.5))
+    assert reconciled["winner"] == TIE.value
+    assert reconciled["margin_of_winning"] == 0.0
+
+def test_disagreement_is_decided_by_the_average(analyzer):
+    assert analyzer.reconcile_positions(verdict(B, 0.2), verdict(B, 0.6))["winner"] == A.value
+    assert analyzer.reconcile_positions(verdict(TIE, 0.0), verdict(A, 0.3))["winner"] == B.value
+
+def test_position_bias_stats(analyzer):
+    records = []
+    for question_id, original, swapped in [("q1", (A, 0.8), (B, 0.4)), ("q2", (A, 0.5), (A, 0.5)), ("q3", (TIE, 0.0), (TIE, 0.0))]:
+        reconciled = analyzer.reconcile_positions(verdict(*original), verdict(*swapped))
+        records.append({"question_id": question_id, **{metric.lower(): reconciled for metric in analyzer.solution_comparison_metrics}})
+    stats = analyzer.position_bias_stats(records)["CORRECTNESS"]
+    assert stats["pairs"] == 3
+    assert stats["agreement_rate"] == pytest.approx(2 / 3)
+    assert stats["position_flips"] == 1
+    # 3 of the 4 decisive verdicts went to the first slot
+    assert stats["first_position_rate"] == pytest.approx(0.75)
+
+def test_metric_scores_are_signed_by_winner(analyzer):
+    record = {"question_id": "q1", "correctness": {"winner": A.value, "margin_of_winning": 0.6}, "completeness": {"winner": B.value, "margin_of_winning": 0.3}, "clarity": {"winner": TIE.value, "margin_of_winning": 0.0}}
+    scores = analyzer.build_metric_scores([record])
+    assert scores.loc[0, ["correctness", "completeness", "clarity"]].tolist() == pytest.approx([0.6, -0.3, 0.0])
+    assert scores.loc[0, "average_score"] == pytest.approx(0.1)
+    assert list(analyzer.build_metric_scores([]).columns) == list(scores.columns)
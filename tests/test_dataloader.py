@@ -0,0 +1,52 @@
+import io
+import json
+import pytest
+from helpers.dataloader import Dataloader, get_shard, iter_json_array
+
+RECORDS = [{"question_id": f"q{idx}", "subject": "PHYSICS" if idx % 2 else "MATHS", "question_text": f"Question {idx}, \"quoted\" [x] {{y}}"} for idx in range(25)]
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64, 1 << 20])
+def test_records_split_across_chunks(chunk_size):
+    text = json.dumps(RECORDS, indent=2)
+    assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == RECORDS
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5])
+def test_scalars_cut_at_chunk_boundaries(chunk_size):
+    values = [23, 4.5, -1e-3, True, None, "s", 1000]
+    assert list(iter_json_array(io.StringIO(json.dumps(values)), chunk_size=chunk_size)) == values
+    assert list(iter_json_array(io.StringIO("[1,22]"), chunk_size=chunk_size)) == [1, 22]
+
+def test_empty_array():
+    assert list(iter_json_array(io.StringIO(" [ ] "), chunk_size=2)) == []
+
+@pytest.mark.parametrize("text, error", [('{"question_id": 1}', ValueError), ('[{"question_id": 1}, {"questi', ValueError), ('[1, 2', ValueError)])
+def test_malformed_files(text, error):
+    with pytest.raises(error):
+        list(iter_json_array(io.StringIO(text), chunk_size=4))
+
+def test_streaming_matches_loading(tmp_path):
+    path = tmp_path / "questions.json"
+    path.write_text(json.dumps(RECORDS))
+    loaded, streamed = Dataloader(path), Dataloader(path, streaming=True)
+    assert list(streamed.iter_dataset(subjects=["MATHS"])) == loaded.get_dataset(subjects=["MATHS"])
+    shards = [list(streamed.iter_dataset(shard_index=idx, num_shards=3)) for idx in range(3)]
+    assert sorted(record["question_id"] for shard in shards for record in shard) == sorted(record["question_id"] for record in RECORDS)
+    assert all(get_shard(record["question_id"], 3) == idx for idx, shard in enumerate(shards) for record in shard)
+
+def test_jsonl_is_streamed(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    path.write_text("\n".join(json.dumps(record) for record in RECORDS) + "\n\n")
+    dataloader = Dataloader(path)
+    assert dataloader.streaming
+    assert dataloader.get_dataset(question_ids=["q3", "q4"]) == RECORDS[3:5]
+
+def test_random_subset_is_seeded(tmp_path):
+    path = tmp_path / "questions.json"
+    path.write_text(json.dumps(RECORDS))
+    dataloader = Dataloader(path)
+    subset = dataloader.get_random_subset(5, seed=7)
+    assert len({record["question_id"] for record in subset}) == 5
+    assert subset == dataloader.get_random_subset(5, seed=7)
+    assert dataloader.get_random_subset(3, seed=7, subjects=["PHYSICS"]) == dataloader.get_random_subset(3, seed=7, subjects=["PHYSICS"])
+    with pytest.raises(ValueError):
+        dataloader.get_random_subset(20, subjects=["MATHS"])
@@ -0,0 +1,76 @@
+import asyncio
+from helpers.dedupe import DuplicateIndex, MinHashIndex, SharedWork
+
+def question(question_id, text, similar=("Find the area of a circle of radius 2.",), subject="MATHS"):
+    return {
+        "question_id": question_id,
+        "subject": subject,
+        "question_text": text,
+        "similar_questions": [{"similar_question_text": sq, "summarized_solution_approach": "Use the formula."} for sq in similar]
+    }
+
+BASE = "A train leaves the station at 60 km/h and travels for three hours along a straight track. How far does it go?"
+NEAR = "A train leaves the station at 80 km/h and travels for three hours along a straight track. How far does it go?"
+OTHER = "Balance the chemical equation for the combustion of methane in oxygen and name the products formed."
+
+def test_minhash_groups_near_duplicates():
+    index = MinHashIndex(threshold=0.5)
+    positions = [index.add(text) for text in (BASE, OTHER, NEAR, BASE.upper())]
+    roots = index.groups()
+    assert roots[positions[0]] == roots[positions[2]] == roots[positions[3]] == positions[0]
+    assert roots[positions[1]] == positions[1]
+
+def test_exact_and_near_duplicate_groups_are_told_apart():
+    dataset = [question("q1", BASE), question("q2", "  a train leaves the station at 60 km/h and travels for three hours along a straight track. How far does it go?"), question("q3", NEAR), question("q4", OTHER)]
+    duplicates = DuplicateIndex(dataset, threshold=0.5)
+    assert duplicates.exact_duplicate_groups == [["q1", "q2"]]
+    assert duplicates.near_duplicate_groups == [["q1", "q2", "q3"]]
+    assert duplicates.stats["distinct_questions"] == 3
+    assert duplicates.stats["questions_in_exact_duplicate_groups"] == 2
+    # near duplicates can differ in the numbers that change the answer, they never share work
+    assert duplicates.work_key("q1", "question") == duplicates.work_key("q2", "question")
+    assert duplicates.work_key("q3", "question") is None
+
+def test_exact_copies_alone_are_not_near_duplicates():
+    duplicates = DuplicateIndex([question("q1", BASE), question("q2", BASE), question("q3", OTHER)])
+    assert duplicates.stats["exact_duplicate_groups"] == 1
+    assert duplicates.stats["near_duplicate_groups"] == 0
+
+def test_different_similar_questions_only_share_the_plain_solution():
+    duplicates = DuplicateIndex([question("q1", BASE), question("q2", BASE, similar=("Convert 5 km to metres.",))])
+    assert duplicates.work_key("q1", "question") is not None
+    assert duplicates.work_key("q1", "with_similar") is None
+
+def test_shared_work_computes_once_and_drops_the_result():
+    duplicates = DuplicateIndex([question(f"q{idx}", BASE) for idx in range(3)] + [question("q3", OTHER)])
+    shared = SharedWork(duplicates)
+    calls = []
+
+    async def compute(question_id):
+        calls.append(question_id)
+        await asyncio.sleep(0)
+        return {"answer": 180}
+
+    async def run(question_ids):
+        return await asyncio.gather(*[shared.run(question_id, "question", lambda question_id=question_id: compute(question_id)) for question_id in question_ids])
+
+    # q0 was done on a previous run, only the two pending members wait for the result
+    shared.expect(["q1", "q2", "q3"], "question")
+    results = asyncio.run(run(["q1", "q2", "q3"]))
+    assert results == [{"answer": 180}] * 3
+    assert sorted(calls) == ["q1", "q3"]
+    assert shared.reused == 1
+    assert not shared.tasks and not shared.remaining and not shared.expected
+
+def test_shared_work_without_expectations_is_not_shared():
+    duplicates = DuplicateIndex([question("q1", BASE), question("q2", BASE)])
+    shared = SharedWork(duplicates)
+
+    async def compute():
+        return 1
+
+    async def run():
+        return [await shared.run(question_id, "question", compute) for question_id in ("q1", "q2")]
+
+    assert asyncio.run(run()) == [1, 1]
+    assert shared.reused == 0 and not shared.tasks
@@ -0,0 +1,48 @@
+import json
+import pytest
+from core.datatypes import MetricEvaluation
+from helpers.json_stream import StreamingJSONValidator, MalformedStreamError
+
+SCHEMA = MetricEvaluation.model_json_schema()
+
+def feed_in_chunks(validator, text, size):
+    for start in range(0, len(text), size):
+        validator.feed(text[start:start + size])
+    validator.finish()
+
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_valid_document_in_any_chunking(size):
+    partials = []
+    document = json.dumps({"winner": "SOLUTION_A", "margin_of_winning": 0.75, "reasoning": "Step 2 is \"wrong\"\nin B."})
+    feed_in_chunks(StreamingJSONValidator(SCHEMA, on_partial=partials.append), document, size)
+    assert partials[-1]["reasoning"] == "Step 2 is \"wrong\"\nin B."
+    assert partials[-1]["winner"] == "SOLUTION_A"
+
+def test_partial_text_before_the_document_is_complete():
+    partials = []
+    validator = StreamingJSONValidator(SCHEMA, on_partial=partials.append)
+    validator.feed('{"reasoning": "Solution A ')
+    assert partials[-1] == {"reasoning": "Solution A "}
+
+@pytest.mark.parametrize("document, message", [
+    ('{"winner": "SOLUTION_C"', "not one of"),
+    ('{"margin_of_winning": 1.5', "outside"),
+    ('{"margin_of_winning": [', "where the schema expects"),
+    ('{"winner": "TIE"}', "required keys"),
+    ('{"winner": "TIE", "margin_of_winning": 0, "reasoning": ""} {', "after the end"),
+    ('{"winner" "TIE"', "Unexpected"),
+])
+def test_invalid_documents_fail_early(document, message):
+    validator = StreamingJSONValidator(SCHEMA)
+    with pytest.raises(MalformedStreamError, match=message):
+        validator.feed(document + " ")
+
+def test_incomplete_document_fails_on_finish():
+    validator = StreamingJSONValidator(SCHEMA)
+    validator.feed('{"winner": "TIE", "margin_of_winning": 0')
+    with pytest.raises(MalformedStreamError, match="ended before"):
+        validator.finish()
+
+def test_lax_types_are_not_rejected():
+    # the final pydantic validation accepts a number as a string, so the stream must too
+    feed_in_chunks(StreamingJSONValidator(SCHEMA), '{"winner": "TIE", "margin_of_winning": "0.5", "reasoning": "same"}', 4)
@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from pydantic import BaseModel, ValidationError
+from helpers import model_cascade
+from helpers.model_cascade import ModelCascade, parse_tier, set_cascade, stage_models
+from helpers.scheduler import Scheduler
+
+class Verdict(BaseModel):
+    margin: float
+
+class ScriptedLLM():
+    # model -> margin it answers with, or an exception it raises
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+
+    async def __call__(self, user_message, system_message, response_schema, model, provider=None, **kwargs):
+        self.calls.append((provider, model, kwargs["tags"]["tier"], kwargs["retry_invalid"]))
+        answer = self.answers[model]
+        if isinstance(answer, Exception):
+            raise answer
+        return Verdict(margin=answer)
+
+def is_uncertain(response):
+    return "low_margin" if response.margin < 0.2 else None
+
+def run(cascade, llm, monkeypatch):
+    monkeypatch.setattr(model_cascade, "call_gemini", llm)
+    return asyncio.run(cascade.call(Scheduler(2), is_uncertain, "user", "system", Verdict, 0.0, {"question_id": "q0"}))
+
+def invalid_response():
+    try:
+        Verdict(margin="not a number")
+    except ValidationError as e:
+        return e
+
+def test_confident_answer_stays_on_the_first_tier(monkeypatch):
+    cascade = ModelCascade("compare", ["lite", "judge:pro"])
+    llm = ScriptedLLM({"lite": 0.8, "pro": 0.9})
+    response, tier = run(cascade, llm, monkeypatch)
+    assert (response.margin, tier) == (0.8, 0)
+    assert llm.calls == [("default", "lite", 0, False)]
+
+def test_uncertain_answer_escalates(monkeypatch):
+    cascade = ModelCascade("compare", ["lite", "judge:pro"])
+    llm = ScriptedLLM({"lite": 0.1, "pro": 0.9})
+    response, tier = run(cascade, llm, monkeypatch)
+    assert (response.margin, tier) == (0.9, 1)
+    # only the last tier retries invalid responses, earlier tiers escalate instead
+    assert llm.calls == [("default", "lite", 0, False), ("judge", "pro", 1, True)]
+    assert cascade.summary() == {
+        "tiers": ["default:lite", "judge:pro"],
+        "calls": 1,
+        "resolved_by_tier": {0: 0, 1: 1},
+        "escalation_rate": 1.0,
+        "escalations": {"low_margin": 1}
+    }
+
+def test_invalid_response_escalates(monkeypatch):
+    cascade = ModelCascade("compare", ["lite", "pro"])
+    response, tier = run(cascade, ScriptedLLM({"lite": invalid_response(), "pro": 0.9}), monkeypatch)
+    assert tier == 1
+    assert cascade.summary()["escalations"] == {"invalid_response": 1}
+
+def test_last_tier_is_final(monkeypatch):
+    # an uncertain answer from the last tier is kept, an invalid one fails the call
+    cascade = ModelCascade("compare", ["lite", "pro"])
+    response, tier = run(cascade, ScriptedLLM({"lite": 0.1, "pro": 0.05}), monkeypatch)
+    assert (response.margin, tier) == (0.05, 1)
+    with pytest.raises(ValidationError):
+        run(cascade, ScriptedLLM({"lite": 0.1, "pro": invalid_response()}), monkeypatch)
+
+def test_parse_tier():
+    assert parse_tier("gemini-2.5-flash") == ("default", "gemini-2.5-flash")
+    assert parse_tier(" judge:gemini-2.5-pro ") == ("judge", "gemini-2.5-pro")
+    with pytest.raises(ValueError):
+        ModelCascade("compare", [])
+
+def test_stage_models(monkeypatch):
+    monkeypatch.setattr(model_cascade, "cascades", {})
+    monkeypatch.delenv("LLM_STAGE_ROUTES", raising=False)
+    assert stage_models("compare", "gemini-2.5-flash") == ["default:gemini-2.5-flash"]
+    set_cascade("compare", ["lite", "judge:pro"])
+    assert stage_models("compare", "gemini-2.5-flash") == ["default:lite", "judge:pro"]
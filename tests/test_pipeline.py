@@ -0,0 +1,75 @@
+import asyncio
+import json
+from core.pipeline import Pipeline
+from helpers.checkpoint import Checkpoint
+from helpers.result_store import ResultStore
+from helpers.scheduler import Scheduler
+from tests.conftest import make_question
+
+QUESTIONS = [make_question(idx) for idx in range(6)]
+
+def run_pipeline(reports_dir, questions=QUESTIONS, **kwargs):
+    pipeline = Pipeline(questions, str(reports_dir), scheduler=Scheduler(concurrency=4), **kwargs)
+    asyncio.run(pipeline.run())
+    return pipeline
+
+def checkpoint_ids(path):
+    with Checkpoint(str(path)) as checkpoint:
+        return set(checkpoint.offsets)
+
+def test_every_question_goes_through_every_stage(tmp_path, fake_llm):
+    run_pipeline(tmp_path)
+    question_ids = {data["question_id"] for data in QUESTIONS}
+    for name in ("relevance_eval_report.jsonl", "generated_solutions.jsonl", "comparative_analysis_report.jsonl"):
+        assert checkpoint_ids(tmp_path / name) == question_ids
+    # two solutions per question
+    assert fake_llm.count("Solution") == 2 * len(QUESTIONS)
+    with open(tmp_path / "comparative_analysis_report.json") as f:
+        assert [record["question_id"] for record in json.load(f)] == [data["question_id"] for data in QUESTIONS]
+
+def test_json_reports_are_opt_in_with_a_store(tmp_path, fake_llm):
+    (tmp_path / "default").mkdir()
+    (tmp_path / "exported").mkdir()
+    with ResultStore(str(tmp_path / "results.sqlite")) as store:
+        run_pipeline(tmp_path / "default", store=store)
+        assert len(store.get_comparisons()) == len(QUESTIONS)
+        assert not (tmp_path / "default" / "comparative_analysis_report.json").exists()
+        run_pipeline(tmp_path / "exported", store=store, export_json=True)
+        assert (tmp_path / "exported" / "comparative_analysis_report.json").exists()
+
+def test_resume_only_runs_unfinished_questions(tmp_path, fake_llm):
+    run_pipeline(tmp_path, questions=QUESTIONS[:4])
+    calls = len(fake_llm.calls)
+    run_pipeline(tmp_path)
+    assert fake_llm.count("Solution") == 2 * len(QUESTIONS)
+    assert len(fake_llm.calls) == calls * len(QUESTIONS) // 4
+
+    # nothing left to do
+    calls = len(fake_llm.calls)
+    run_pipeline(tmp_path)
+    assert len(fake_llm.calls) == calls
+
+def test_slow_comparisons_hold_back_the_builds(tmp_path, fake_llm, monkeypatch):
+    fake_llm.delays = {"MetricEvaluation": 0.01, "MultiMetricEvaluation": 0.01}
+    pipeline = Pipeline([make_question(idx) for idx in range(20)], str(tmp_path), scheduler=Scheduler(concurrency=4), queue_size=1, workers_per_stage=1)
+    built, compared, lag = [], [], []
+
+    build_question = pipeline.solution_builder.build_question
+    async def tracked_build(data, *args):
+        solutions = await build_question(data, *args)
+        built.append(data["question_id"])
+        lag.append(len(built) - len(compared))
+        return solutions
+
+    analyze_question = pipeline.comparative_analyzer.analyze_question
+    async def tracked_analyze(item):
+        analysis = await analyze_question(item)
+        compared.append(item[0])
+        return analysis
+
+    monkeypatch.setattr(pipeline.solution_builder, "build_question", tracked_build)
+    monkeypatch.setattr(pipeline.comparative_analyzer, "analyze_question", tracked_analyze)
+    asyncio.run(pipeline.run())
+    assert len(compared) == 20
+    # one question being compared, one in the queue and one built waiting to get in
+    assert max(lag) <= 3
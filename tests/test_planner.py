@@ -0,0 +1,76 @@
+import json
+import pytest
+from core.comparative_analyzer import ComparativeAnalyzer
+from core.planner import RunPlan, plan_run
+from core.relevance_evaluator import RelevanceEvaluator
+from core.solution_builder import SolutionBuilder
+from helpers.dedupe import DuplicateIndex
+from helpers.result_store import ResultStore
+from tests.conftest import make_question
+
+QUESTIONS = [make_question(idx) for idx in range(4)]
+
+@pytest.fixture(autouse=True)
+def no_routes(monkeypatch):
+    for name in ("LLM_MAX_PROMPT_TOKENS", "LLM_CASCADES", "LLM_STAGE_ROUTES"):
+        monkeypatch.delenv(name, raising=False)
+
+def plan(tmp_path, store, stages=("relevance", "build", "analyze"), dataset=QUESTIONS, duplicates=None, **kwargs):
+    reports_dir = str(tmp_path)
+    return plan_run(
+        RunPlan(**kwargs), stages, dataset, store,
+        RelevanceEvaluator([], reports_dir), SolutionBuilder([], reports_dir), ComparativeAnalyzer([], [], [], reports_dir),
+        duplicates=duplicates
+    )
+
+def test_plan_counts_every_call(tmp_path):
+    with ResultStore(":memory:") as store:
+        summary = plan(tmp_path, store).summary()
+    relevance, build, analyze = (summary["stages"][stage] for stage in ("relevance", "build", "analyze"))
+    assert relevance["questions"] == build["questions"] == analyze["questions"] == len(QUESTIONS)
+    assert relevance["calls"] == 2 * len(QUESTIONS)
+    assert build["calls"] == 2 * len(QUESTIONS)
+    assert analyze["calls"] > 0 and analyze["prompt_tokens"] > 0
+    # without an earlier trace there is nothing to estimate the completions from
+    assert summary["completion_tokens"] is None and summary["estimated_cost_usd"] is None
+    assert summary["calls"] == relevance["calls"] + build["calls"] + analyze["calls"]
+
+def test_plan_skips_stored_results(tmp_path):
+    with ResultStore(":memory:") as store:
+        store.put_questions(QUESTIONS)
+        store.put_relevance({"question_id": "q0", "similarity": {"conceptual_similarity": 0.9, "structural_similarity": 0.7, "reasoning": ""}, "alignment": {"is_difficulty_appropriate": "YES", "is_solution_approach_viable": "YES", "reasoning": ""}})
+        summary = plan(tmp_path, store, stages=("relevance",)).summary()
+    assert summary["stages"]["relevance"]["already_done"] == 1
+    assert summary["stages"]["relevance"]["calls"] == 2 * (len(QUESTIONS) - 1)
+
+def test_plan_skips_work_shared_by_exact_duplicates(tmp_path):
+    dataset = QUESTIONS + [dict(QUESTIONS[0], question_id="copy")]
+    with ResultStore(":memory:") as store:
+        result = plan(tmp_path, store, stages=("relevance", "build"), dataset=dataset, duplicates=DuplicateIndex(dataset))
+    summary = result.summary()
+    assert summary["stages"]["relevance"]["calls"] == 2 * len(QUESTIONS)
+    assert summary["stages"]["build"]["calls"] == 2 * len(QUESTIONS)
+    assert summary["stages"]["relevance"]["notes"]
+
+def test_oversized_prompts(tmp_path):
+    with ResultStore(":memory:") as store:
+        result = plan(tmp_path, store, stages=("relevance",), max_prompt_tokens=1)
+    assert len(result.oversized) == 2 * len(QUESTIONS)
+    assert {question_id for _, question_id, _ in result.oversized} == {data["question_id"] for data in QUESTIONS}
+    with ResultStore(":memory:") as store:
+        assert not plan(tmp_path, store, stages=("relevance",), max_prompt_tokens=10**6).oversized
+
+def test_completions_and_cost_come_from_an_earlier_trace(tmp_path):
+    trace_path = tmp_path / "llm_trace.jsonl"
+    events = [
+        {"stage": "relevance", "model": "gemini-2.5-flash", "status": "ok", "ts": 1.0, "prompt_tokens": 500, "completion_tokens": 100},
+        {"stage": "relevance", "model": "gemini-2.5-flash", "status": "ok", "ts": 1.0, "prompt_tokens": 500, "completion_tokens": 300},
+        # cache hits and failures say nothing about a live call's completion
+        {"stage": "relevance", "model": "gemini-2.5-flash", "status": "ok", "ts": 1.0, "cache_hit": True, "prompt_tokens": 500, "completion_tokens": 900},
+        {"stage": "relevance", "model": "gemini-2.5-flash", "status": "error", "ts": 1.0, "prompt_tokens": 500}
+    ]
+    trace_path.write_text("".join(json.dumps(event) + "\n" for event in events))
+    with ResultStore(":memory:") as store:
+        summary = plan(tmp_path, store, stages=("relevance",), history_path=str(trace_path)).summary()
+    assert summary["stages"]["relevance"]["completion_tokens"] == 2 * len(QUESTIONS) * 200
+    assert summary["completion_tokens"] == 2 * len(QUESTIONS) * 200
@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+from helpers.rate_limiter import RateLimiter, TokenBucket, parse_duration
+
+def test_actual_usage_replaces_the_estimate():
+    limiter = RateLimiter(requests_per_minute=100, tokens_per_minute=10_000)
+
+    async def request():
+        entry = await limiter.acquire(1_000)
+        limiter.record_success(entry, actual_tokens=400)
+
+    asyncio.run(request())
+    stats = limiter.stats()
+    assert stats["requests"] == 1
+    assert stats["tokens"] == 400
+    assert stats["tokens_last_minute"] == 400
+    assert stats["tpm_utilization"] == pytest.approx(0.04)
+    assert stats["rpm_utilization"] == pytest.approx(0.01)
+    # the unused part of the estimate is paid back to the bucket
+    assert limiter.tokens.tokens == pytest.approx(9_600, abs=5)
+
+def test_underestimate_is_paid_back_by_later_requests():
+    bucket = TokenBucket(600)
+    bucket.consume(500)
+    bucket.consume(300)
+    assert bucket.tokens < 0
+    # 10 tokens per second, the debt and the next request both have to refill
+    assert bucket.wait_time(100) == pytest.approx(30, abs=0.1)
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(None)
+    bucket.consume(10 ** 9)
+    assert bucket.wait_time(10 ** 9) == 0.0
+
+def test_rate_limited_halves_the_rate_and_recovers():
+    limiter = RateLimiter(requests_per_minute=60)
+    limiter.record_rate_limited(retry_after=0)
+    limiter.record_rate_limited(retry_after=0)
+    assert limiter.scale == 0.25
+    assert limiter.counters["rate_limited"] == 2
+    limiter.record_success([0.0, 1])
+    assert limiter.scale == pytest.approx(0.27)
+
+def test_limiter_survives_new_event_loops():
+    limiter = RateLimiter(requests_per_minute=1_000)
+
+    async def request():
+        limiter.record_success(await limiter.acquire(1))
+
+    for _ in range(3):
+        asyncio.run(request())
+    assert limiter.counters["requests"] == 3
+
+@pytest.mark.parametrize("value, seconds", [("12", 12), ("500ms", 0.5), ("6m0s", 360), ("1h2m3.5s", 3723.5), ("soon", None)])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == seconds
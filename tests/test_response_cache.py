@@ -0,0 +1,68 @@
+import itertools
+from helpers import ai_provider
+from helpers.ai_provider import ResponseCache
+from core.datatypes import MetricEvaluation, WinnerSolution
+
+def make_key(provider_name="default", model="gemini-2.5-flash-lite", content="Solve x + 1 = 2."):
+    messages = [{"role": "system", "content": ""}, {"role": "user", "content": content}]
+    return ResponseCache.make_key(provider_name, model, 0.1, messages, MetricEvaluation, {"extra_body": {}})
+
+def use_clock(monkeypatch, start=1_000_000.0):
+    # every time.time() call is one second later
+    clock = itertools.count(start)
+    monkeypatch.setattr(ai_provider.time, "time", lambda: float(next(clock)))
+
+def test_responses_survive_a_new_cache(tmp_path):
+    path = str(tmp_path / "cache" / "responses.sqlite")
+    evaluation = MetricEvaluation(winner=WinnerSolution.TIE, margin_of_winning=0.0, reasoning="Same steps.")
+    cache = ResponseCache(path)
+    cache.set(make_key(), evaluation, MetricEvaluation)
+    cache.set(make_key(content="plain"), "4", None)
+
+    reopened = ResponseCache(path)
+    assert reopened.get(make_key(), MetricEvaluation) == evaluation
+    assert reopened.get(make_key(content="plain")) == "4"
+    assert reopened.get(make_key(content="other"), MetricEvaluation) is None
+    assert (reopened.hits, reopened.misses) == (2, 1)
+
+def test_key_covers_the_whole_request():
+    assert make_key() == make_key()
+    assert len({make_key(), make_key(provider_name="judge"), make_key(model="gemini-2.5-flash"), make_key(content="Solve x + 2 = 3.")}) == 4
+
+def test_expired_responses_are_misses(tmp_path, monkeypatch):
+    use_clock(monkeypatch)
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), ttl_seconds=5, memory_entries=0)
+    cache.set(make_key(), "4")
+    assert cache.get(make_key()) == "4"
+    for _ in range(10):
+        ai_provider.time.time()
+    assert cache.get(make_key()) is None
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    use_clock(monkeypatch)
+    path = str(tmp_path / "responses.sqlite")
+    cache = ResponseCache(path, ttl_seconds=None, max_entries=2, memory_entries=0)
+    for content in ("a", "b", "c"):
+        cache.set(make_key(content=content), content)
+    # reading a makes b the least recently used
+    cache.get(make_key(content="a"))
+
+    reopened = ResponseCache(path, ttl_seconds=None, max_entries=2)
+    assert reopened.get(make_key(content="a")) == "a"
+    assert reopened.get(make_key(content="b")) is None
+    assert reopened.get(make_key(content="c")) == "c"
+
+def test_memory_is_bounded(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), memory_entries=2)
+    for content in ("a", "b", "c"):
+        cache.set(make_key(content=content), content)
+    assert list(cache.memory) == [make_key(content="b"), make_key(content="c")]
+    # evicted from memory only, still served from sqlite
+    assert cache.get(make_key(content="a")) == "a"
+    assert list(cache.memory) == [make_key(content="c"), make_key(content="a")]
+
+def test_clear(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    cache.set(make_key(), "4")
+    cache.clear()
+    assert cache.get(make_key()) is None
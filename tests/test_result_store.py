@@ -0,0 +1,92 @@
+import json
+import sqlite3
+import pytest
+from helpers import result_store
+from helpers.checkpoint import Checkpoint
+from helpers.result_store import ResultStore
+from tests.conftest import make_question
+
+QUESTIONS = [make_question(idx) for idx in range(5)]
+
+def solutions_record(question_id):
+    return {
+        "question_id": question_id,
+        "without_similar": {"question_id": question_id, "generated_solution": f"{question_id} alone"},
+        "with_similar": {"question_id": question_id, "generated_solution": f"{question_id} with help"},
+        "variant_settings": {"without_similar": "a", "with_similar": "b"}
+    }
+
+def comparison_record(question_id, winner="SOLUTION_A"):
+    return {"question_id": question_id, "correctness": {"winner": winner, "margin_of_winning": 0.5, "reasoning": "..."}, "judge_mode": "combined"}
+
+@pytest.fixture
+def store(tmp_path):
+    with ResultStore(str(tmp_path / "results.sqlite")) as store:
+        store.put_questions(QUESTIONS)
+        yield store
+
+def test_records_come_back_in_dataset_or_requested_order(store):
+    for question_id in ("q3", "q0", "q1"):
+        store.put_solutions(solutions_record(question_id))
+    assert [s["question_id"] for s in store.get_solutions("with_similar")] == ["q0", "q1", "q3"]
+    assert [s["question_id"] for s in store.get_solutions("without_similar", ["q3", "q4", "q0"])] == ["q3", "q0"]
+    assert store.get_solutions("with_similar", ["q1"]) == [solutions_record("q1")["with_similar"]]
+    assert store.done_ids("solutions", variant="with_similar") == {"q0", "q1", "q3"}
+    assert store.count("solutions") == 3
+
+def test_lookups_are_chunked(store, monkeypatch):
+    monkeypatch.setattr(result_store, "LOOKUP_CHUNK_SIZE", 2)
+    for data in QUESTIONS:
+        store.put_comparison(comparison_record(data["question_id"]))
+    question_ids = ["q4", "q2", "missing", "q0", "q3", "q1"]
+    assert [record["question_id"] for record in store.get_comparisons(question_ids)] == ["q4", "q2", "q0", "q3", "q1"]
+
+def test_comparisons_fill_the_metric_columns(store):
+    store.put_comparison(comparison_record("q0", winner="TIE"))
+    assert store.conn.execute("SELECT metric, winner, margin_of_winning FROM comparison_metrics").fetchall() == [("correctness", "TIE", 0.5)]
+
+def test_sync_from_checkpoint(store, tmp_path):
+    path = str(tmp_path / "generated_solutions.jsonl")
+    with Checkpoint(path) as checkpoint:
+        for question_id in ("q0", "q1"):
+            checkpoint.append(solutions_record(question_id))
+    # a later run syncs what it completed plus whatever the store is missing
+    with Checkpoint(path) as checkpoint:
+        checkpoint.append(solutions_record("q2"))
+        store.sync_from_checkpoint("solutions", checkpoint, [data["question_id"] for data in QUESTIONS], store.put_solutions)
+    assert store.done_ids("solutions") == {"q0", "q1", "q2"}
+    store.clear("solutions")
+    assert store.count("solutions") == 0
+
+def test_merge_keeps_the_dataset_order(store, tmp_path):
+    with ResultStore(str(tmp_path / "shard.sqlite")) as shard:
+        shard.put_questions(QUESTIONS[::-1])
+        shard.put_comparison(comparison_record("q4"))
+        shard.put_comparison(comparison_record("q1"))
+    store.merge_from(str(tmp_path / "shard.sqlite"))
+    assert [record["question_id"] for record in store.get_comparisons()] == ["q1", "q4"]
+    assert [record["question_id"] for record in store.iter_records("questions")] == [data["question_id"] for data in QUESTIONS]
+
+def test_read_only_store(store, tmp_path):
+    store.put_comparison(comparison_record("q0"))
+    store.commit()
+    with ResultStore(str(tmp_path / "results.sqlite"), read_only=True) as reader:
+        assert reader.done_ids("comparisons") == {"q0"}
+        with pytest.raises(sqlite3.OperationalError):
+            reader.put_comparison(comparison_record("q1"))
+
+def test_export_json(store, tmp_path):
+    store.put_relevance({"question_id": "q0", "similarity": {"conceptual_similarity": 0.9, "structural_similarity": 0.7, "reasoning": ""}, "alignment": {"is_difficulty_appropriate": "YES", "is_solution_approach_viable": "PARTIAL", "reasoning": ""}})
+    store.put_solutions(solutions_record("q0"))
+    store.put_comparison(comparison_record("q0"))
+    store.put_scores([("q0", 0.5, "PHYSICS", "high")])
+    store.commit()
+    assert store.get_relevance_similarity() == {"q0": pytest.approx(0.8)}
+
+    store.export_json(str(tmp_path))
+    with open(tmp_path / "generated_solutions_w_similar.json") as f:
+        assert json.load(f) == [solutions_record("q0")["with_similar"]]
+    with open(tmp_path / "full_analysis_report.json") as f:
+        full_analysis = json.load(f)
+    assert full_analysis[0]["average_score"] == 0.5
+    assert full_analysis[0]["original_question_data"] == QUESTIONS[0]
@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+from helpers.scheduler import Scheduler
+
+def test_map_keeps_item_order():
+    scheduler = Scheduler(concurrency=4)
+
+    async def worker(item):
+        # later items finish first
+        await asyncio.sleep(0.001 * (10 - item))
+        return item * 2
+
+    assert asyncio.run(scheduler.map(worker, range(10))) == [item * 2 for item in range(10)]
+
+def test_map_bounds_items_in_flight():
+    scheduler = Scheduler(concurrency=3)
+    in_flight = peak = 0
+
+    async def worker(item):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.001)
+        in_flight -= 1
+
+    asyncio.run(scheduler.map(worker, range(20)))
+    assert peak == 3
+
+def test_calls_share_one_bound_across_items():
+    # items fanning out through call() don't deadlock on the item bound, and calls stay bounded across items
+    scheduler = Scheduler(concurrency=2)
+    in_flight = peak = 0
+
+    async def request():
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.001)
+        in_flight -= 1
+        return 1
+
+    async def worker(item):
+        return sum(await asyncio.gather(*[scheduler.call(request) for _ in range(3)]))
+
+    assert asyncio.run(scheduler.map(worker, range(5))) == [3] * 5
+    assert peak == 2
+
+def test_failed_item_cancels_the_rest():
+    scheduler = Scheduler(concurrency=4)
+    cancelled = []
+
+    async def worker(item):
+        if item == 0:
+            await asyncio.sleep(0.001)
+            raise RuntimeError("boom")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(item)
+            raise
+
+    with pytest.raises(RuntimeError, match="boom"):
+        asyncio.run(scheduler.map(worker, range(4)))
+    assert sorted(cancelled) == [1, 2, 3]
+
+def test_concurrency_must_be_positive():
+    with pytest.raises(ValueError):
+        Scheduler(concurrency=0)
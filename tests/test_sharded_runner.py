@@ -0,0 +1,53 @@
+import asyncio
+import json
+import os
+import pytest
+from core.sharded_runner import get_shard_dir, get_worker_env, is_shard_done, merge_shards, run_shard
+from helpers.dataloader import get_shard
+from helpers.result_store import ResultStore
+from tests.conftest import make_question
+
+QUESTIONS = [make_question(idx) for idx in range(8)]
+NUM_SHARDS = 3
+
+@pytest.fixture
+def data_path(tmp_path, monkeypatch):
+    monkeypatch.delenv("RESULT_STORE_PATH", raising=False)
+    path = tmp_path / "questions.json"
+    path.write_text(json.dumps(QUESTIONS))
+    return str(path)
+
+def test_shards_split_the_dataset_and_merge_back(tmp_path, data_path, fake_llm):
+    reports_dir = str(tmp_path / "reports")
+    for shard_index in range(NUM_SHARDS):
+        result = asyncio.run(run_shard(data_path, reports_dir, shard_index, NUM_SHARDS, concurrency=2))
+        assert result["questions"] == sum(get_shard(data["question_id"], NUM_SHARDS) == shard_index for data in QUESTIONS)
+        assert is_shard_done(reports_dir, shard_index, NUM_SHARDS)
+
+    asyncio.run(merge_shards(data_path, reports_dir, NUM_SHARDS, export_json=True, generate_insights=False))
+    with ResultStore(os.path.join(reports_dir, "results.sqlite")) as store:
+        # merged in dataset order, not shard order
+        assert [record["question_id"] for record in store.get_comparisons()] == [data["question_id"] for data in QUESTIONS]
+    with open(os.path.join(reports_dir, "comparative_analysis_report.json")) as f:
+        assert len(json.load(f)) == len(QUESTIONS)
+    assert os.path.exists(os.path.join(reports_dir, "dedupe_report.json"))
+
+def test_merge_waits_for_every_shard(tmp_path, data_path, fake_llm):
+    reports_dir = str(tmp_path / "reports")
+    asyncio.run(run_shard(data_path, reports_dir, 0, NUM_SHARDS, concurrency=2))
+    with pytest.raises(RuntimeError, match=r"\[1, 2\]"):
+        asyncio.run(merge_shards(data_path, reports_dir, NUM_SHARDS))
+
+def test_rerun_shard_resumes_from_its_checkpoints(tmp_path, data_path, fake_llm):
+    reports_dir = str(tmp_path / "reports")
+    asyncio.run(run_shard(data_path, reports_dir, 1, NUM_SHARDS, concurrency=2))
+    calls = len(fake_llm.calls)
+    os.remove(os.path.join(get_shard_dir(reports_dir, 1, NUM_SHARDS), "_SUCCESS.json"))
+    asyncio.run(run_shard(data_path, reports_dir, 1, NUM_SHARDS, concurrency=2))
+    assert len(fake_llm.calls) == calls
+
+def test_worker_env_splits_the_rate_limits(monkeypatch):
+    monkeypatch.setenv("LLM_RPM", "1000")
+    monkeypatch.delenv("LLM_TPM", raising=False)
+    assert get_worker_env(4) == {"LLM_RPM": "250", "TQDM_DISABLE": "1"}
+    assert get_worker_env(1) == {"LLM_RPM": "1000"}
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from helpers import stats
+from helpers.stats import bootstrap_mean_ci, stratified_bootstrap_mean_ci, top_k_indices
+
+def test_bootstrap_ci_contains_the_mean():
+    values = np.random.default_rng(1).normal(0.3, 0.2, size=200)
+    low, high = bootstrap_mean_ci(values, num_samples=2000)
+    assert low < values.mean() < high
+    assert high - low < 0.1
+
+def test_bootstrap_ci_is_seeded():
+    values = [0.1, -0.4, 0.9, 0.0, 0.5]
+    assert bootstrap_mean_ci(values, seed=3) == bootstrap_mean_ci(values, seed=3)
+
+def test_bootstrap_ci_small_samples():
+    assert bootstrap_mean_ci([]) == (None, None)
+    assert bootstrap_mean_ci([0.4]) == (0.4, 0.4)
+
+def test_blocked_resampling_matches_unblocked(monkeypatch):
+    values = np.linspace(-1, 1, 50)
+    expected = bootstrap_mean_ci(values, num_samples=500)
+    # one resample per block
+    monkeypatch.setattr(stats, "BOOTSTRAP_BLOCK_ELEMENTS", 50)
+    assert bootstrap_mean_ci(values, num_samples=500) == pytest.approx(expected)
+
+def test_stratified_ci_weighs_the_groups():
+    groups = [[1.0] * 10, [0.0] * 10]
+    low, high = stratified_bootstrap_mean_ci(groups, [3, 1])
+    assert low == pytest.approx(0.75) and high == pytest.approx(0.75)
+
+def test_stratified_ci_skips_empty_groups():
+    low, high = stratified_bootstrap_mean_ci([[], [0.5, 0.5]], [10, 1])
+    assert low == pytest.approx(0.5) and high == pytest.approx(0.5)
+    assert stratified_bootstrap_mean_ci([[], []], [1, 1]) == (None, None)
+
+def test_top_k_indices():
+    values = [0.2, -0.9, 0.7, 0.1, 0.7]
+    assert top_k_indices(values, 2).tolist() == [2, 4]
+    assert top_k_indices(values, 2, largest=False).tolist() == [1, 3]
+    assert top_k_indices(values, 10).tolist() == [2, 4, 0, 3, 1]
+    assert top_k_indices(values, 0).tolist() == []
@@ -0,0 +1,54 @@
+import json
+import pytest
+from helpers.telemetry import Telemetry
+
+def event(stage="build", total_s=1.0, **fields):
+    return {"stage": stage, "model": "gemini-2.5-flash-lite", "status": "ok", "attempts": 1, "total_s": total_s, "prompt_tokens": 1000, "completion_tokens": 100, **fields}
+
+def test_summary_per_stage():
+    telemetry = Telemetry()
+    for total_s in (1.0, 2.0, 3.0):
+        telemetry.record(event(total_s=total_s, network_s=total_s / 2))
+    telemetry.record(event(cache_hit=True, total_s=0.0))
+    telemetry.record(event(status="error", attempts=3, total_s=4.0))
+    telemetry.record(event(stage="compare", prompt_tokens=None, completion_tokens=None))
+
+    summary = telemetry.summary()
+    build = summary["stages"]["build"]
+    assert (build["calls"], build["cache_hits"], build["errors"], build["retries"]) == (5, 1, 1, 2)
+    # latency and tokens only count the calls that went out
+    assert build["p50_s"] == pytest.approx(2.5)
+    assert build["prompt_tokens"] == 4000 and build["completion_tokens"] == 400
+    assert build["estimated_cost_usd"] == pytest.approx(4 * (1000 * 0.10 + 100 * 0.40) / 1_000_000)
+    assert summary["stages"]["compare"]["prompt_tokens"] == 0
+    assert summary["total_tokens"] == 4400
+    assert telemetry.live_calls() == 5
+
+def test_cached_prompt_tokens_are_billed_at_the_cached_rate():
+    telemetry = Telemetry()
+    assert telemetry.estimate_cost("gemini-2.5-flash", 1_000_000, 0, cached_prompt_tokens=400_000) == pytest.approx(0.6 * 0.30 + 0.4 * 0.075)
+    assert telemetry.estimate_cost("unknown-model", 1000, 1000) is None
+
+def test_traces_are_summarised_together(tmp_path):
+    paths = []
+    for shard in range(2):
+        path = tmp_path / f"shard_{shard}" / "llm_trace.jsonl"
+        telemetry = Telemetry(trace_path=str(path))
+        telemetry.record(event(total_s=1.0 + shard))
+        telemetry.close()
+        paths.append(str(path))
+
+    with open(paths[0]) as f:
+        assert json.loads(f.readline())["stage"] == "build"
+    merged = Telemetry.from_traces(paths + [str(tmp_path / "missing.jsonl")])
+    assert merged.summary()["stages"]["build"]["calls"] == 2
+
+def test_cascade_tiers_are_broken_down():
+    telemetry = Telemetry()
+    telemetry.record(event(stage="compare", tier=0))
+    telemetry.record(event(stage="compare", tier=0))
+    telemetry.record(event(stage="compare", tier=1, model="gemini-2.5-flash"))
+    tiers = telemetry.summary()["stages"]["compare"]["tiers"]
+    assert tiers[0]["calls"] == 2
+    assert tiers[1]["models"] == ["gemini-2.5-flash"]
+    assert "tiers" not in Telemetry().summary()["stages"].get("build", {})
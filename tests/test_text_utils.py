@@ -0,0 +1,27 @@
+import pytest
+from helpers.text_utils import extract_final_answer, normalize_answer, normalize_text, text_similarity
+
+@pytest.mark.parametrize("solution, answer", [
+    ("The speed doubles, so $v = 4$.\n\nFinal answer: $\\boxed{4\\text{ m/s}}$", "4m/s"),
+    ("First 2 + 2 = 4.\nThen we get \\boxed{3} and finally \\boxed{\\frac{1}{2}}.", "\\frac{1}{2}"),
+    ("**Final Answer:** 180 km.", "180km"),
+    ("The final answer is 12.5", "12.5"),
+    ("Working...\nAnswer: x = 3\nCheck: 3 * 2 = 6", "x=3"),
+    ("We cannot conclude anything.", None),
+    ("", None),
+    (None, None),
+])
+def test_extract_final_answer(solution, answer):
+    assert extract_final_answer(solution) == answer
+
+def test_answers_compare_equal_after_formatting():
+    assert extract_final_answer("Answer: **42 J**") == extract_final_answer("Final answer: $42\\,J$.")
+
+def test_normalize():
+    assert normalize_text("  **Bold**  and `code`\n\nText ") == "bold and code text"
+    assert normalize_answer("\\text{5} m.") == "5m"
+
+def test_text_similarity():
+    assert text_similarity("The answer is **4**", "the  answer is 4") == 1.0
+    assert text_similarity("a b c d", "w x y z") == 0.0
+    assert 0.5 < text_similarity("add the two numbers then halve", "add the two numbers then double") < 1.0